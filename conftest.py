@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+
+def make_dummy_df(n=2000, n_groups=2, seed=1):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'group': rng.integers(0, n_groups, size=n),
+        'leads': rng.poisson(1, size=n),
+        'vips': rng.gamma(2, 1, size=n),
+        'revenue': rng.lognormal(2, 1, size=n),
+        'userid': np.arange(n)
+        })
+
+
+ROLES = dict(success_metric=['leads'], health_metric=['revenue'], learning_metrics=['vips'], experiment_unit='userid',
+             treatment='group')
+
+
+def make_experiment(df, name='great_exp', start='2021-01-01', end='2021-01-14', expected_delta=.1,
+                    roll_out_percent=.1, **roles):
+    """Experiment on df, with the roles of make_dummy_df (ROLES) unless given, and groups of equal expected size."""
+    from dexter.experiment import Experiment, ExperimentDataFrame
+
+    roles = {**ROLES, **roles}
+    if 'expected_proportions' not in roles:
+        n_groups = df[roles['treatment']].nunique()
+        roles['expected_proportions'] = [1 / n_groups] * n_groups
+
+    exp_df = ExperimentDataFrame(dataframe=df, **roles)
+    return Experiment(name, start, end, expected_delta, roll_out_percent, exp_df)
+
+
+def make_timed_experiment(start_day=None, days=14, n=70000, seed=0):
+    """Experiment with a timestamp column, in which the treatment share drops to 45% from start_day onwards."""
+    rng = np.random.default_rng(seed)
+    day = rng.integers(0, days, size=n)
+    p_treatment = np.where((start_day is not None) & (day >= (start_day or 0)), .45, .5)
+    df = pd.DataFrame({
+        'group': (rng.random(n) < p_treatment).astype(int),
+        'revenue': rng.normal(size=n),
+        'userid': np.arange(n),
+        'ts': pd.Timestamp('2021-01-01') + pd.to_timedelta(day, unit='D')
+        + pd.to_timedelta(rng.integers(0, 86400, n), unit='s')
+        })
+
+    return make_experiment(df, 'srm', success_metric=['revenue'], health_metric=[], learning_metrics=[], timestamp='ts')
+
+
+@pytest.fixture
+def dummy_df(request):
+    # indirect parametrisation passes the arguments of make_dummy_df
+    return make_dummy_df(**getattr(request, 'param', {}))
+
+
+@pytest.fixture
+def experiment(request, dummy_df):
+    # indirect parametrisation passes the arguments of make_experiment
+    return make_experiment(dummy_df, **{'expected_delta': .3, **getattr(request, 'param', {})})
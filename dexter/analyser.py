@@ -2,10 +2,20 @@ import pingouin as pg
 import numpy as np
 import pandas as pd
 import random
+from math import comb
 
 from numpy import sort
+from scipy.stats import chi2, t
 
-from dexter.utils import _customise_res_table, default_metrics, pinfo, function_details, pretty_results
+from dexter.instrumentation import instrumented, measure
+from dexter.simulation import _chunk_size
+from dexter.summary import ExperimentSummary
+from dexter.stats_func import anova_from_moments, welch_anova_from_moments, pairwise_from_moments, padjust, \
+    ttest_from_moments, proportions_ztest, chisquare_proportions, fisher_exact_proportions, poisson_rate_test, \
+    poisson_homogeneity_test, dispersion_test, normal_posterior_comparison, subset_sum_distribution, \
+    sign_flip_distribution
+from dexter.utils import _customise_res_table, default_metrics, echo, pinfo, function_details, pretty_results, \
+    group_summary, levene_by_group, stratify, time_buckets, metric_type, binary_counts, cluster_summary
 
 
 class ExperimentAnalyser:
@@ -13,13 +23,15 @@ class ExperimentAnalyser:
         self._experiment = experiment
         self._log = {
             'transformations': {},
-            'analyses': {}
+            'analyses': {},
+            'lift_over_time': None
             }
 
     def get_log(self, part=None):
-        assert part in ['transformations', 'analyses', None]
+        assert part in ['transformations', 'analyses', 'lift_over_time', None]
         return self._log[part] if part is not None else self._log
 
+    @instrumented('transform_metrics')
     def transform_metrics(self, metrics, func):
         if not callable(func):
             raise ValueError('transform_func has to be a callable that takes a single argument.')
@@ -28,11 +40,14 @@ class ExperimentAnalyser:
 
         func = function_details(func)
 
+        # all metrics are transformed in a single version of the data
+        transformed = {}
         for metric in metrics:
-            self._experiment.data[metric], signature, func_name = func(self._experiment.data[metric])
+            transformed[metric], signature, func_name = func(self._experiment.data[metric])
             self._log['transformations'][metric] = f'{func_name}'
             if len(signature) > 0:
                 self._log['transformations'][metric] += f' with {signature}'
+        self._experiment.data.override(transformed, name=f'transform with {func.__name__}')
 
         pinfo(
             f'the following metrics were transformed with {func.__name__}: {", ".join(x for x in metrics)}.',
@@ -44,9 +59,101 @@ class ExperimentAnalyser:
             return np.log(x + offset)
         self.transform_metrics(metrics, func=log)
 
+    @instrumented('lift_over_time')
+    def lift_over_time(self, metrics=None, freq='D', alpha=.05):
+        """
+        Lift of every variant over the control (first group) per time bucket and cumulatively, with confidence
+        intervals and Welch's t-test p-values, to spot novelty effects. Per-bucket, per-group counts, sums and sums of
+        squares are computed with bincounts in a single pass per metric, and the cumulative statistics are their prefix
+        sums, so the data is not re-analysed for every date-truncated prefix.
+
+        Requires the timestamp column of the ExperimentDataFrame. Rows are treated as independent observations.
+
+        :return:
+        DataFrame with a row per metric, variant, bucket and kind ('per bucket' or 'cumulative')
+        """
+        data = self._experiment.data
+
+        if data.timestamp is None:
+            raise Exception('The ExperimentDataFrame has no timestamp column. See the timestamp argument.')
+
+        metrics = default_metrics(self._experiment) if metrics is None else metrics
+        metrics = [metrics] if not isinstance(metrics, list) else metrics
+
+        bucket_codes, buckets = time_buckets(data[data.timestamp], freq)
+        group_codes, groups = pd.factorize(data[data.treatment], sort=True)
+        n_buckets, n_groups = len(buckets), len(groups)
+        size = n_buckets * n_groups
+
+        keys = bucket_codes * n_groups + group_codes
+        valid_rows = (bucket_codes >= 0) & (group_codes >= 0)
+
+        tables = []
+        for metric in metrics:
+            values = data[metric].to_numpy(dtype=float)
+            valid = valid_rows & ~np.isnan(values)
+            # centering keeps the sums-of-squares variance numerically stable
+            centre = values[valid].mean()
+            centred = values[valid] - centre
+
+            n = np.bincount(keys[valid], minlength=size).reshape(n_buckets, n_groups).astype(float)
+            sums = np.bincount(keys[valid], weights=centred, minlength=size).reshape(n_buckets, n_groups)
+            sums_sq = np.bincount(keys[valid], weights=centred ** 2, minlength=size).reshape(n_buckets, n_groups)
+
+            for kind, (n_k, sums_k, sums_sq_k) in (
+                    ('per bucket', (n, sums, sums_sq)),
+                    ('cumulative', (n.cumsum(axis=0), sums.cumsum(axis=0), sums_sq.cumsum(axis=0)))
+                    ):
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    mean = sums_k / n_k
+                    var = (sums_sq_k - n_k * mean ** 2) / (n_k - 1)
+
+                _, dof, p = ttest_from_moments(
+                    mean[:, 1:], mean[:, [0]], var[:, 1:], var[:, [0]], n_k[:, 1:], n_k[:, [0]]
+                    )
+
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    lift = mean[:, 1:] - mean[:, [0]]
+                    se = np.sqrt(var[:, 1:] / n_k[:, 1:] + var[:, [0]] / n_k[:, [0]])
+                    margin = t.ppf(1 - alpha / 2, dof) * se
+
+                    control_mean = mean[:, [0]] + centre
+                    relative = lift / control_mean
+                    # delta method for the ratio of the variant and control means
+                    relative_se = np.sqrt(
+                        var[:, 1:] / n_k[:, 1:] / control_mean ** 2
+                        + (mean[:, 1:] + centre) ** 2 * var[:, [0]] / n_k[:, [0]] / control_mean ** 4
+                        )
+
+                n_variants = n_groups - 1
+                tables.append(pd.DataFrame({
+                    'metric': metric,
+                    'bucket': np.repeat(buckets, n_variants),
+                    'kind': kind,
+                    'A': groups[0],
+                    'B': np.tile(groups[1:], n_buckets),
+                    'n(A)': np.repeat(n_k[:, 0], n_variants),
+                    'n(B)': n_k[:, 1:].ravel(),
+                    'mean(A)': np.repeat(control_mean[:, 0], n_variants),
+                    'mean(B)': (mean[:, 1:] + centre).ravel(),
+                    'lift': lift.ravel(),
+                    'ci low': (lift - margin).ravel(),
+                    'ci high': (lift + margin).ravel(),
+                    'relative lift': relative.ravel(),
+                    'relative ci low': (relative - t.ppf(1 - alpha / 2, dof) * relative_se).ravel(),
+                    'relative ci high': (relative + t.ppf(1 - alpha / 2, dof) * relative_se).ravel(),
+                    'p-value': p.ravel()
+                    }))
+
+        res = pd.concat(tables, ignore_index=True)
+        self._log['lift_over_time'] = res
+
+        return res
+
+    @instrumented('compare')
     def compare(self,
                 alpha=.05,
-                padjust='none',
+                padjust=None,
                 alternative='two-sided',
                 paired=False,
                 metrics=None,
@@ -54,18 +161,110 @@ class ExperimentAnalyser:
                 func=None,
                 rounds=1000,
                 method='approx',
-                seed=random.randint(1, 10000)
+                seed=random.randint(1, 10000),
+                contrasts='all',
+                posthoc='auto',
+                by=None,
+                q=3,
+                wide=False,
+                metric_types='auto',
+                clustered=False,
+                draws=10000
                 ):
 
         data = self._experiment.data
-        metrics = default_metrics(self._experiment) if metrics is None else metrics
         treatment = data.treatment
-        groups = sort(data[data.treatment].unique())
+        groups = self._experiment.groups
         n_groups = len(groups)
 
-        if parametric == 'permute':
-            if n_groups > 2:
-                raise Exception('Permutations are not enabled for experiment with more than two variants.')
+        if metrics is None:
+            metrics = default_metrics(self._experiment)
+            if wide:
+                metrics = metrics + data.learning_metrics
+
+        if isinstance(data, ExperimentSummary) and parametric != 'bayes':
+            if wide or clustered or by is not None:
+                raise AttributeError('wide, clustered and segment-level comparisons need the experiment data, '
+                                     'not a summary.')
+
+            calculator = SummaryComparison(
+                data=data,
+                metrics=metrics,
+                treatment=treatment,
+                alpha=alpha,
+                padjust=padjust,
+                parametric=parametric,
+                alternative=alternative,
+                paired=paired,
+                groups=groups,
+                contrasts=contrasts
+                )
+
+        elif parametric == 'bayes':
+            if wide or clustered or by is not None:
+                raise AttributeError('the Bayesian comparison treats rows as independent and does not support wide, '
+                                     'clustered or segment-level comparisons.')
+
+            calculator = BayesianComparison(
+                data=data,
+                metrics=metrics,
+                treatment=treatment,
+                alpha=alpha,
+                padjust=padjust,
+                parametric=parametric,
+                alternative=alternative,
+                paired=paired,
+                groups=groups,
+                draws=draws,
+                seed=seed
+                )
+
+        elif wide:
+
+            calculator = WideComparison(
+                data=data,
+                metrics=metrics,
+                treatment=treatment,
+                alpha=alpha,
+                padjust=padjust,
+                parametric=parametric,
+                alternative=alternative,
+                paired=paired,
+                groups=groups
+                )
+
+        elif clustered:
+
+            calculator = ClusteredComparison(
+                data=data,
+                metrics=metrics,
+                treatment=treatment,
+                alpha=alpha,
+                padjust=padjust,
+                parametric=parametric,
+                alternative=alternative,
+                paired=paired,
+                groups=groups,
+                contrasts=contrasts
+                )
+
+        elif by is not None:
+
+            calculator = SegmentComparison(
+                data=data,
+                metrics=metrics,
+                treatment=treatment,
+                alpha=alpha,
+                padjust=padjust,
+                parametric=parametric,
+                alternative=alternative,
+                paired=paired,
+                groups=groups,
+                by=by,
+                q=q
+                )
+
+        elif parametric == 'permute':
 
             calculator = PermutationComparison(
                 data=data,
@@ -80,7 +279,8 @@ class ExperimentAnalyser:
                 func=func,
                 method=method,
                 rounds=rounds,
-                seed=seed
+                seed=seed,
+                contrasts=contrasts
                 )
 
         elif n_groups > 2:
@@ -94,7 +294,10 @@ class ExperimentAnalyser:
                 parametric=parametric,
                 alternative=alternative,
                 paired=paired,
-                groups=groups
+                groups=groups,
+                contrasts=contrasts,
+                posthoc=posthoc,
+                metric_types=metric_types
                 )
 
         elif n_groups == 2:
@@ -107,15 +310,21 @@ class ExperimentAnalyser:
                 parametric=parametric,
                 padjust=padjust,
                 alternative=alternative,
-                paired=paired
+                paired=paired,
+                metric_types=metric_types
                 )
 
+        calculator.instrumentation = self._experiment.instrumentation
         calculator.run()
 
         self._log['analyses'] = calculator.results
 
+        return calculator.results
+
 
 class BaseAnalyser:
+    instrumentation = None
+
     def __init__(self, data, metrics, treatment, alternative, padjust, parametric, paired, alpha, groups=None):
 
         if alternative not in ('two-sided', 'greater', 'smaller'):
@@ -124,8 +333,8 @@ class BaseAnalyser:
         if not isinstance(paired, bool):
             raise AttributeError('paired should be boolean.')
 
-        if not isinstance(parametric, bool) and parametric != 'permute':
-            raise AttributeError('paired should be boolean or "permute".')
+        if not isinstance(parametric, bool) and parametric not in ('permute', 'bayes'):
+            raise AttributeError('parametric should be boolean, "permute" or "bayes".')
 
         if alpha < 0 or alpha > 1:
             raise AttributeError('alpha should be a proportion.')
@@ -136,34 +345,188 @@ class BaseAnalyser:
         self.groups = groups
         self.alpha = alpha
         self.alternative = alternative
-        self.padjust = padjust
+        # None is the default of the comparison: no adjustment, unless the comparison has its own default
+        self.padjust = 'none' if padjust is None else padjust
         self.parametric = parametric
         self.paired = paired
         self.equal_var_dict = None
         self.results = {}
-        # TODO effect size should be set according to metric type: continuous/binary
 
+    @instrumented('homoskedasticity')
     def _check_homoskedasticity(self):
 
-        equal_var_dict = {}
+        # one vectorized Levene's test for all metrics, instead of a pingouin call per metric
+        _, p = levene_by_group(self.data.data, self.treatment, self.metrics)
+
+        self.equal_var_dict = {metric: bool(p_metric > .05) for metric, p_metric in zip(self.metrics, p)}
 
-        for metric in self.metrics:
-            check_homoskedasticity = pg.homoscedasticity(
-                data=self.data.data,
-                dv=metric,
-                group=self.treatment,
-                method='levene'
-                )
 
-            equal_var = check_homoskedasticity.loc['levene', 'equal_var']
+class SingleComparison(BaseAnalyser):
+    """
+    T-tests for experiments with two variants. Binary metrics are compared with two-proportion z-tests (Fisher's exact
+    test for small expected counts) and count metrics with Poisson rate tests, both computed from per-group counts
+    only. Count metrics that are overdispersed with respect to the Poisson distribution are compared as continuous
+    metrics. The fast paths apply to unpaired, parametric comparisons.
 
-            equal_var_dict[metric] = equal_var
+    metric_types: 'auto' to detect binary and count metrics, None to compare all metrics as continuous, or a dict with
+    the type ('binary', 'count' or 'continuous') of some of the metrics, the rest being detected.
+    """
 
-        self.equal_var_dict = equal_var_dict
+    def __init__(self, *args, metric_types='auto', **kwargs):
+        BaseAnalyser.__init__(self, *args, **kwargs)
 
+        if metric_types is not None and metric_types != 'auto' and not isinstance(metric_types, dict):
+            raise AttributeError(f'metric_types should be either auto, None or a dict. Got {metric_types} instead.')
 
-class SingleComparison(BaseAnalyser):
+        if isinstance(metric_types, dict) and \
+                not set(metric_types.values()) <= {'binary', 'count', 'continuous'}:
+            raise AttributeError('the metric types should be either binary, count or continuous.')
+
+        self.metric_types = metric_types
+        self.types = None
+        self.counts = {}
+
+    def _classify(self):
+        overrides = self.metric_types if isinstance(self.metric_types, dict) else {}
+        detect = self.metric_types is not None and self.parametric is True and not self.paired
+
+        self.types = {
+            metric: overrides.get(metric, metric_type(self.data[metric]) if detect else 'continuous')
+            for metric in self.metrics
+            }
+
+    @instrumented('count-summary')
+    def _summarise_counts(self):
+        binary = [metric for metric in self.metrics if self.types[metric] == 'binary']
+        counts = [metric for metric in self.metrics if self.types[metric] == 'count']
+
+        if binary:
+            summary = binary_counts(self.data.data, self.treatment, binary)
+            for i, metric in enumerate(binary):
+                self.counts[metric] = (summary.groups, summary.n[:, i], summary.successes[:, i], None)
+
+        if counts:
+            summary = group_summary(self.data.data, self.treatment, counts)
+            for i, metric in enumerate(counts):
+                self.counts[metric] = (summary.groups, summary.n[:, i], summary.n[:, i] * summary.mean[:, i],
+                                       summary.var[:, i])
+
+    def _contrast_pairs(self, n_groups):
+        return np.array([0]), np.array([1])
+
+    def _adjust(self, res, p):
+        if len(p) > 1 and self.padjust != 'none':
+            res['p-corr'] = padjust(p, self.padjust)
+        return res
+
+    @instrumented('proportions-test', per_metric=True)
+    def _run_proportions_test(self, metric):
+        groups, n, successes, _ = self.counts[metric]
+        a, b = self._contrast_pairs(len(groups))
+
+        title = metric
+        if len(groups) > 2:
+            stat, dof, p, _ = chisquare_proportions(successes, n)
+            omnibus = pd.DataFrame({'Source': [self.treatment], 'chi2': [stat], 'DF': [dof], 'p-unc': [p]})
+            omnibus = _customise_res_table(omnibus)
+
+            self.results.setdefault(metric, {})['chi-square'] = omnibus.to_dict()
+
+            with measure(self, 'formatting', metric):
+                pretty_results(omnibus, title=metric, subtitle='Chi-square test:')
+            title = None
+
+        delta, se, z, p, cohen_h = proportions_ztest(successes[a], n[a], successes[b], n[b], self.alternative)
+
+        # Fisher's exact test for the contrasts with an expected cell count below 5
+        _, _, _, min_expected = chisquare_proportions(np.stack([successes[a], successes[b]]), np.stack([n[a], n[b]]))
+        exact = min_expected < 5
+        for i in np.flatnonzero(exact):
+            p[i] = fisher_exact_proportions(successes[a][i], n[a][i], successes[b][i], n[b][i], self.alternative)
+
+        res = pd.DataFrame({
+            'A': groups[a],
+            'B': groups[b],
+            'mean(A)': successes[a] / n[a],
+            'mean(B)': successes[b] / n[b],
+            'diff': delta,
+            'se': se,
+            'z': z,
+            'p-unc': p,
+            'cohen-h': cohen_h
+            })
+
+        res = _customise_res_table(self._adjust(res, p))
+
+        self.results.setdefault(metric, {})['proportions'] = res.to_dict()
+
+        note = 'Info: binary metric, compared with two-proportion z-tests.'
+        if exact.any():
+            note += ' Fisher\'s exact test is applied to contrasts with expected counts below 5.'
+
+        with measure(self, 'formatting', metric):
+            pretty_results(res, title=title, subtitle='Proportions:', note=note)
+
+    @instrumented('rate-test', per_metric=True)
+    def _run_rate_test(self, metric):
+        groups, n, sums, var = self.counts[metric]
+
+        _, p_dispersion = dispersion_test(n, sums / n, var)
+        if np.any(p_dispersion <= .05):
+            pinfo(f'{metric} is overdispersed with respect to a Poisson distribution, so it is compared as a continuous '
+                  f'metric.', color='warning')
+            return False
+
+        a, b = self._contrast_pairs(len(groups))
+
+        title = metric
+        if len(groups) > 2:
+            stat, dof, p = poisson_homogeneity_test(sums, n)
+            omnibus = pd.DataFrame({'Source': [self.treatment], 'chi2': [stat], 'DF': [dof], 'p-unc': [p]})
+            omnibus = _customise_res_table(omnibus)
+
+            self.results.setdefault(metric, {})['chi-square'] = omnibus.to_dict()
+
+            with measure(self, 'formatting', metric):
+                pretty_results(omnibus, title=metric, subtitle='Chi-square test of equal rates:')
+            title = None
+
+        delta, se, z, p, ratio = poisson_rate_test(sums[a], n[a], sums[b], n[b], self.alternative)
+
+        res = pd.DataFrame({
+            'A': groups[a],
+            'B': groups[b],
+            'mean(A)': sums[a] / n[a],
+            'mean(B)': sums[b] / n[b],
+            'diff': delta,
+            'se': se,
+            'z': z,
+            'p-unc': p,
+            'rate-ratio': ratio
+            })
 
+        res = _customise_res_table(self._adjust(res, p))
+
+        self.results.setdefault(metric, {})['rates'] = res.to_dict()
+
+        with measure(self, 'formatting', metric):
+            pretty_results(res, title=title, subtitle='Poisson rates:',
+                           note='Info: count metric, compared with Poisson rate tests.')
+
+        return True
+
+    def _run_count_tests(self, metric):
+        """Runs the fast path of binary and count metrics. Returns False if the metric has to be compared as is."""
+        if self.types[metric] == 'binary':
+            self._run_proportions_test(metric)
+            return True
+
+        if self.types[metric] == 'count':
+            return self._run_rate_test(metric)
+
+        return False
+
+    @instrumented('t-test', per_metric=True)
     def _run_ttest(self, metric, equal_var):
 
         res = pg.pairwise_ttests(
@@ -172,7 +535,7 @@ class SingleComparison(BaseAnalyser):
             between=self.treatment,
             padjust=self.padjust,
             parametric=self.parametric,
-            effsize='cohen',  # TODO effect size should be set according to metric type: continuous/binary
+            effsize='cohen',
             correction=equal_var if equal_var else 'auto'
             )
 
@@ -181,7 +544,8 @@ class SingleComparison(BaseAnalyser):
         note = f'Info: Welch\'s tests is applied automatically if metric variance across the experiment variants ' \
                f'differs.'
 
-        pretty_results(res, title=metric, subtitle='T-tests:', note=note)
+        with measure(self, 'formatting', metric):
+            pretty_results(res, title=metric, subtitle='T-tests:', note=note)
 
         if metric not in self.results:
             self.results[metric] = {}
@@ -191,35 +555,83 @@ class SingleComparison(BaseAnalyser):
     def run(self):
 
         self._check_homoskedasticity()
+        self._classify()
+        self._summarise_counts()
 
         for metric, equal_var in self.equal_var_dict.items():
+            if self._run_count_tests(metric):
+                continue
+
             self._run_ttest(metric, equal_var)
 
 
 class MultipleComparison(SingleComparison):
+    """
+    Omnibus test and post-hoc contrasts for experiments with more than two variants.
+
+    The metrics are aggregated into per-group sizes, means and variances in a single pass over the data, after which
+    the (Welch) ANOVA and all contrasts are computed from those summaries. Only the non-parametric omnibus test
+    (Kruskal-Wallis) needs the full data.
+
+    contrasts: 'all' for all pairwise contrasts, 'control' for variant vs. control (first group) contrasts only. Tukey
+    and Games-Howell p-values of control contrasts are still adjusted for all pairwise contrasts, so they are
+    conservative compared to a many-to-one (Dunnett) adjustment.
+    posthoc: 'auto' for Tukey's tests under equal variances and Games-Howell otherwise, or one of 'tukey',
+    'gameshowell' and 'welch' (Welch's t-tests, adjusted with padjust).
+    """
+
+    def __init__(self, *args, contrasts='all', posthoc='auto', **kwargs):
+        SingleComparison.__init__(self, *args, **kwargs)
+
+        if contrasts not in ('all', 'control'):
+            raise AttributeError(f'contrasts should be either all or control. Got {contrasts} instead.')
+
+        if posthoc not in ('auto', 'tukey', 'gameshowell', 'welch'):
+            raise AttributeError(f'posthoc should be either auto, tukey, gameshowell or welch. Got {posthoc} instead.')
+
+        self.contrasts = contrasts
+        self.posthoc = posthoc
+        self.summary = None
+
+    def _summarise(self):
+        self.summary = group_summary(self.data.data, self.treatment, self.metrics)
+
+    def _contrast_pairs(self, n_groups):
+        if self.contrasts == 'all':
+            return np.triu_indices(n_groups, k=1)
+        return np.zeros(n_groups - 1, dtype=int), np.arange(1, n_groups)
+
+    def _moments(self, metric):
+        i = self.summary.metrics.index(metric)
+        return self.summary.n[:, i], self.summary.mean[:, i], self.summary.var[:, i]
 
+    @instrumented('anova', per_metric=True)
     def _run_anova(self, metric, equal_var):
 
-        method = {
-            # outer dict: parametric | inner dict: equal variance
-            True: {
-                True: pg.anova,
-                False: pg.welch_anova
-                },
-            False: {
-                True: pg.kruskal,
-                False: pg.kruskal
-                }
-            }
+        if not self.parametric:
+            res = pg.kruskal(data=self.data.data, dv=metric, between=self.treatment, detailed=True)
 
-        anova = method[self.parametric][equal_var]
+        elif equal_var:
+            ss_between, ss_within, dof_between, dof_within, fstat, p = anova_from_moments(*self._moments(metric))
 
-        res = anova(
-            data=self.data.data,
-            dv=metric,
-            between=self.treatment,
-            detailed=True,
-            )
+            res = pd.DataFrame({
+                'Source': [self.treatment, 'Within'],
+                'SS': [ss_between, ss_within],
+                'DF': [dof_between, dof_within],
+                'F': [fstat, np.nan],
+                'p-unc': [p, np.nan]
+                })
+
+        else:
+            dof_between, dof_within, fstat, p = welch_anova_from_moments(*self._moments(metric))
+
+            res = pd.DataFrame({
+                'Source': [self.treatment],
+                'ddof1': [dof_between],
+                'ddof2': [dof_within],
+                'F': [fstat],
+                'p-unc': [p]
+                })
 
         res = _customise_res_table(res)
 
@@ -242,24 +654,38 @@ class MultipleComparison(SingleComparison):
         else:
             note = None
 
-        pretty_results(res, title=metric, subtitle='ANOVA:', note=note)
+        with measure(self, 'formatting', metric):
+            pretty_results(res, title=metric, subtitle='ANOVA:', note=note)
 
+    @instrumented('post-hoc', per_metric=True)
     def _run_posthoc(self, metric, equal_var):
 
-        # True if variances across groups are equal
-        method = {
-            True: pg.pairwise_tukey,
-            False: pg.pairwise_gameshowell
-            }
-
-        posthoc = method[equal_var]
+        method = self.posthoc
+        if method == 'auto':
+            # True if variances across groups are equal
+            method = 'tukey' if equal_var else 'gameshowell'
+
+        a, b = self._contrast_pairs(len(self.summary.groups))
+
+        n, mean, var = self._moments(metric)
+        delta, se, tstat, dof, p, cohen = pairwise_from_moments(n, mean, var, a, b, method=method)
+
+        groups = self.summary.groups
+        res = pd.DataFrame({
+            'A': groups[a],
+            'B': groups[b],
+            'mean(A)': mean[a],
+            'mean(B)': mean[b],
+            'diff': delta,
+            'se': se,
+            'T': tstat,
+            'dof': dof,
+            'p-tukey' if method != 'welch' else 'p-unc': p,
+            'cohen': cohen
+            })
 
-        res = posthoc(
-            data=self.data.data,
-            dv=metric,
-            between=self.treatment,
-            effsize='cohen'  # TODO effect size should be set according to metric type: continuous/binary
-            )
+        if method == 'welch' and self.padjust != 'none':
+            res['p-corr'] = padjust(p, self.padjust)
 
         res = _customise_res_table(res)
 
@@ -268,31 +694,600 @@ class MultipleComparison(SingleComparison):
 
         self.results[metric]['post_hoc'] = res.to_dict()
 
-        test = 'Tukey\'s tests' if equal_var else 'Games-Howell'
+        test = {'tukey': 'Tukey\'s tests', 'gameshowell': 'Games-Howell', 'welch': 'Welch\'s t-tests'}[method]
 
-        note = 'p-values are adjusted for multiple analyses (see Tukey\'s and Games-Howell tests)'
+        if method == 'welch':
+            note = f'p-values are adjusted for multiple analyses with {self.padjust} (see the padjust argument)'
+        else:
+            note = 'p-values are adjusted for multiple analyses (see Tukey\'s and Games-Howell tests)'
+            if self.contrasts == 'control':
+                note += '; control contrasts are adjusted for all pairs, which is conservative (compare with Dunnett)'
 
-        pretty_results(res, title=None, subtitle=f'Post-hoc ({test}):', note=note)
+        with measure(self, 'formatting', metric):
+            pretty_results(res, title=None, subtitle=f'Post-hoc ({test}):', note=note)
 
     def run(self):
 
         self._check_homoskedasticity()
+        self._classify()
+        self._summarise_counts()
+        self._summarise()
 
         for metric, equal_var in self.equal_var_dict.items():
+            if self._run_count_tests(metric):
+                continue
+
             self._run_anova(metric, equal_var)
 
             self._run_posthoc(metric, equal_var)
 
 
+class BayesianComparison(BaseAnalyser):
+    """
+    Bayesian comparison of every variant with the control (first group), from per-group sufficient statistics:
+    Beta-Binomial posteriors (with a Beta(1, 1) prior by default) for binary metrics and Normal posteriors of the mean
+    (flat prior) for all other metrics. It reports the probability that the variant beats the control, the expected
+    loss of choosing the variant (in units of the metric), the credible interval of the lift (B - A) and the
+    probability that each group is the best one.
+
+    For Normal posteriors, everything but the probability of being the best out of more than two groups is in closed
+    form. The other quantities come from Monte Carlo draws of all groups and metrics at once, in an array of shape
+    (draws, groups, metrics).
+
+    Higher values are better, unless alternative='smaller'. alpha sets the width of the credible intervals.
+    """
+
+    def __init__(self, *args, draws=10000, seed=None, prior=(1, 1), **kwargs):
+        BaseAnalyser.__init__(self, *args, **kwargs)
+
+        if self.paired:
+            raise AttributeError('bayesian comparisons are only available for unpaired data.')
+
+        self.draws = draws
+        self.seed = seed
+        self.prior = prior
+        self.sign = -1 if self.alternative == 'smaller' else 1
+
+    @instrumented('posterior-draws')
+    def _draw(self, rng, n, mean, var, beta):
+        """Posterior draws of the group means of some metrics, with shape (draws, groups, metrics)."""
+        size = (self.draws,) + n.shape
+
+        if beta:
+            successes = np.round(n * mean)
+            return rng.beta(self.prior[0] + successes, self.prior[1] + n - successes, size=size)
+
+        samples = rng.standard_normal(size)
+        samples *= np.sqrt(var / n)
+        samples += mean
+        return samples
+
+    def _p_best(self, samples):
+        best = np.argmax(samples, axis=1) if self.sign > 0 else np.argmin(samples, axis=1)
+        k, m = samples.shape[1:]
+        # one bincount of the (metric, group) pairs of all draws
+        counts = np.bincount((best + k * np.arange(m)).ravel(), minlength=k * m).reshape(m, k).T
+        return counts / self.draws
+
+    @instrumented('posteriors')
+    def _posteriors(self):
+        types = self.data.metric_types(self.metrics)
+        binary = np.array([types[metric] == 'binary' for metric in self.metrics])
+
+        summary = self.data.group_summary(self.metrics)
+        n, mean, var = summary.n, summary.mean, summary.var
+        k, m = n.shape
+        sign = self.sign
+        ci = 1 - self.alpha
+        rng = np.random.default_rng(self.seed)
+
+        lift, low, high, p_beat, loss = (np.empty((k - 1, m)) for _ in range(5))
+        p_best = np.empty((k, m))
+
+        # Normal posteriors in closed form
+        se = np.sqrt(var / n)
+        lift[:], low[:], high[:], p_beat[:], _ = normal_posterior_comparison(mean[[0]], se[[0]], mean[1:], se[1:], ci)
+        _, _, _, _, loss[:] = normal_posterior_comparison(sign * mean[[0]], se[[0]], sign * mean[1:], se[1:])
+        if sign < 0:
+            p_beat = 1 - p_beat
+
+        normal = ~binary
+        if normal.any():
+            if k > 2:
+                p_best[:, normal] = self._p_best(self._draw(rng, n[:, normal], mean[:, normal], var[:, normal], False))
+            else:
+                p_best[:, normal] = np.stack([1 - p_beat[0, normal], p_beat[0, normal]])
+
+        # Monte Carlo for the Beta posteriors
+        if binary.any():
+            samples = self._draw(rng, n[:, binary], mean[:, binary], var[:, binary], True)
+            p_best[:, binary] = self._p_best(samples)
+
+            diff = samples[:, 1:] - samples[:, [0]]
+            lift[:, binary] = diff.mean(axis=0)
+            low[:, binary], high[:, binary] = np.quantile(diff, [(1 - ci) / 2, (1 + ci) / 2], axis=0)
+            p_beat[:, binary] = np.mean(sign * diff > 0, axis=0)
+            loss[:, binary] = np.mean(np.maximum(-sign * diff, 0), axis=0)
+
+        return summary, binary, lift, low, high, p_beat, loss, p_best
+
+    def run(self):
+        summary, binary, lift, low, high, p_beat, loss, p_best = self._posteriors()
+        groups = summary.groups
+        n_variants, n_metrics = lift.shape
+
+        res = pd.DataFrame({
+            'metric': np.repeat(self.metrics, n_variants),
+            'posterior': np.repeat(np.where(binary, 'beta', 'normal'), n_variants),
+            'A': groups[0],
+            'B': np.tile(groups[1:], n_metrics),
+            'mean(A)': np.repeat(summary.mean[0], n_variants),
+            'mean(B)': summary.mean[1:].T.ravel(),
+            'lift': lift.T.ravel(),
+            'ci low': low.T.ravel(),
+            'ci high': high.T.ravel(),
+            'P(B beats A)': p_beat.T.ravel(),
+            'expected loss': loss.T.ravel(),
+            'P(B is best)': p_best[1:].T.ravel()
+            })
+
+        tables = res.drop(columns=['metric', 'posterior'])
+        for i, metric in enumerate(self.metrics):
+            self.results[metric] = {
+                'bayes': tables.iloc[i * n_variants:(i + 1) * n_variants].reset_index(drop=True).to_dict(),
+                'P(best)': dict(zip(groups.tolist(), p_best[:, i]))
+                }
+
+        note = 'Info: Beta-Binomial posteriors for binary metrics, Normal posteriors otherwise. The expected loss is ' \
+               'the expected shortfall of B with respect to A, in units of the metric.'
+
+        with measure(self, 'formatting'):
+            pretty_results(res.set_index(['metric', 'B']), title='Bayesian comparison', note=note)
+
+
+class SummaryComparison(BaseAnalyser):
+    """
+    Parametric comparisons of an experiment that is built from summaries (see dexter.summary.ExperimentSummary), using
+    only the group sizes, means and variances. Equal variances cannot be checked without the rows, so the tests do not
+    assume them: Welch's t-test for two groups, and Welch's ANOVA with Games-Howell contrasts for more groups.
+
+    contrasts: 'all' for all pairwise contrasts, 'control' for variant vs. control (first group) contrasts only. The
+    Games-Howell p-values of control contrasts are adjusted for all pairwise contrasts, so they are conservative.
+    """
+
+    def __init__(self, *args, contrasts='all', **kwargs):
+        BaseAnalyser.__init__(self, *args, **kwargs)
+
+        if self.parametric is not True or self.paired:
+            raise AttributeError('experiments built from summaries only support unpaired, parametric tests.')
+
+        if contrasts not in ('all', 'control'):
+            raise AttributeError(f'contrasts should be either all or control. Got {contrasts} instead.')
+
+        self.contrasts = contrasts
+
+    @instrumented('summary-test', per_metric=True)
+    def _run_test(self, metric, summary):
+        i = summary.metrics.index(metric)
+        n, mean, var = summary.n[:, i], summary.mean[:, i], summary.var[:, i]
+        groups = summary.groups
+        n_groups = len(groups)
+
+        self.results[metric] = {}
+        title = metric
+
+        if n_groups > 2:
+            dof_between, dof_within, fstat, p = welch_anova_from_moments(n, mean, var)
+            anova = _customise_res_table(pd.DataFrame({
+                'Source': [self.treatment], 'ddof1': [dof_between], 'ddof2': [dof_within], 'F': [fstat], 'p-unc': [p]
+                }))
+            self.results[metric]['anova'] = anova.to_dict()
+
+            with measure(self, 'formatting', metric):
+                pretty_results(anova, title=metric, subtitle='Welch ANOVA:')
+            title = None
+
+        if self.contrasts == 'all':
+            a, b = np.triu_indices(n_groups, k=1)
+        else:
+            a, b = np.zeros(n_groups - 1, dtype=int), np.arange(1, n_groups)
+
+        method = 'welch' if n_groups == 2 else 'gameshowell'
+        delta, se, tstat, dof, p, cohen = pairwise_from_moments(n, mean, var, a, b, method=method)
+        if n_groups == 2:
+            _, _, p = ttest_from_moments(mean[a], mean[b], var[a], var[b], n[a], n[b], alternative=self.alternative)
+
+        res = _customise_res_table(pd.DataFrame({
+            'A': groups[a],
+            'B': groups[b],
+            'mean(A)': mean[a],
+            'mean(B)': mean[b],
+            'diff': delta,
+            'se': se,
+            'T': tstat,
+            'dof': dof,
+            'p-unc' if n_groups == 2 else 'p-tukey': p,
+            'cohen': cohen
+            }))
+
+        self.results[metric]['t-tests' if n_groups == 2 else 'post_hoc'] = res.to_dict()
+
+        subtitle = 'T-tests (Welch):' if n_groups == 2 else 'Post-hoc (Games-Howell):'
+        note = 'Info: computed from the experiment summary.'
+        if n_groups > 2 and self.contrasts == 'control':
+            note += ' Control contrasts are adjusted for all pairs, which is conservative (compare with Dunnett).'
+        with measure(self, 'formatting', metric):
+            pretty_results(res, title=title, subtitle=subtitle, note=note)
+
+    def run(self):
+        summary = self.data.group_summary(self.metrics)
+
+        for metric in self.metrics:
+            self._run_test(metric, summary)
+
+
+class ClusteredComparison(BaseAnalyser):
+    """
+    Comparisons for data with repeated rows per experiment unit (e.g. sessions of users). The rows of a unit are not
+    independent, so the units are treated as clusters: the means are ratios of metric totals to row counts, with
+    delta-method standard errors over the per-unit sums and counts, and Welch's t-tests use the number of units.
+
+    contrasts: 'all' for all pairwise contrasts, 'control' for variant vs. control (first group) contrasts only. With
+    more than one contrast, the p-values are adjusted with padjust.
+    """
+
+    def __init__(self, *args, contrasts='all', **kwargs):
+        BaseAnalyser.__init__(self, *args, **kwargs)
+
+        if self.parametric is not True or self.paired:
+            raise AttributeError('clustered comparisons are only available for unpaired, parametric tests.')
+
+        if contrasts not in ('all', 'control'):
+            raise AttributeError(f'contrasts should be either all or control. Got {contrasts} instead.')
+
+        self.contrasts = contrasts
+        self.summary = None
+
+    @instrumented('cluster-summary')
+    def _summarise(self):
+        self.summary = cluster_summary(self.data.data, self.treatment, self.data.experiment_unit, self.metrics)
+
+    @instrumented('clustered-test', per_metric=True)
+    def _run_test(self, metric):
+        i = self.summary.metrics.index(metric)
+        n, mean, var = self.summary.n[:, i], self.summary.mean[:, i], self.summary.var[:, i]
+        groups = self.summary.groups
+
+        n_groups = len(groups)
+        if self.contrasts == 'all':
+            a, b = np.triu_indices(n_groups, k=1)
+        else:
+            a, b = np.zeros(n_groups - 1, dtype=int), np.arange(1, n_groups)
+
+        delta, se, _, dof, _, _ = pairwise_from_moments(n, mean, var, a, b, method='welch')
+        tstat, _, p = ttest_from_moments(mean[a], mean[b], var[a], var[b], n[a], n[b], alternative=self.alternative)
+
+        res = pd.DataFrame({
+            'A': groups[a],
+            'B': groups[b],
+            'n(A)': n[a],
+            'n(B)': n[b],
+            'mean(A)': mean[a],
+            'mean(B)': mean[b],
+            'diff': delta,
+            'se': se,
+            'T': tstat,
+            'dof': dof,
+            'p-unc': p
+            })
+
+        if len(p) > 1 and self.padjust != 'none':
+            res['p-corr'] = padjust(p, self.padjust)
+
+        res = _customise_res_table(res)
+
+        self.results[metric] = {'clustered': res.to_dict()}
+
+        note = f'Info: rows are clustered by {self.data.experiment_unit}; standard errors are cluster-robust ' \
+               f'(delta method).'
+
+        with measure(self, 'formatting', metric):
+            pretty_results(res, title=metric, subtitle='Clustered t-tests:', note=note)
+
+    def run(self):
+        self._summarise()
+
+        for metric in self.metrics:
+            self._run_test(metric)
+
+
+class SegmentComparison(BaseAnalyser):
+    """
+    Treatment effects per segment (e.g. country x platform x user tier), computed from per-segment, per-variant sizes,
+    means and variances that are aggregated in a single groupby pass. Every variant is compared with the control
+    (first group) in every segment with Welch's t-tests, vectorized over segments, variants and metrics, and the
+    p-values are adjusted across segments with padjust, fdr_bh by default; padjust='none' leaves them as they are.
+
+    Numeric segment columns with many distinct values are binned into q quantiles, as in Experiment.describe_data().
+    Use q=None to use every value of the segment columns as is.
+    """
+
+    def __init__(self, *args, by, q=3, **kwargs):
+        BaseAnalyser.__init__(self, *args, **kwargs)
+
+        if self.parametric is not True:
+            raise AttributeError('segment-level comparisons are only available for parametric tests.')
+
+        if kwargs.get('padjust') is None:
+            self.padjust = 'fdr_bh'
+            pinfo('segment-level p-values are adjusted across segments with fdr_bh. Use padjust="none" to leave them '
+                  'unadjusted.', color='warning')
+
+        self.by = [by] if not isinstance(by, list) else by
+        self.q = q
+
+    def _summarise(self):
+        df = self.data.data
+
+        keys = [stratify(df[col], self.q).rename(col) for col in self.by] + [df[self.treatment]]
+
+        stats_df = df.groupby(keys, observed=True)[self.metrics].agg(['count', 'mean', 'var'])
+
+        # segments as rows, (metric, statistic, group) as columns
+        stats_df = stats_df.unstack(self.treatment).sort_index(axis=1)
+        groups = stats_df.columns.get_level_values(-1).unique().sort_values()
+
+        arrays = {}
+        for stat in ('count', 'mean', 'var'):
+            frame = stats_df.xs(stat, axis=1, level=1)
+            frame = frame.reindex(columns=pd.MultiIndex.from_product([self.metrics, groups]))
+            # shape: (segments, groups, metrics)
+            arrays[stat] = frame.to_numpy(dtype=float).reshape(len(frame), len(self.metrics), len(groups)) \
+                .transpose(0, 2, 1)
+
+        return stats_df.index, groups.to_numpy(), arrays['count'], arrays['mean'], arrays['var']
+
+    @instrumented('segment-tests')
+    def _run_tests(self):
+        segments, groups, n, mean, var = self._summarise()
+
+        n = np.nan_to_num(n)
+
+        # control (A) vs. variant (B), following pingouin's convention for delta and the alternative
+        tstat, dof, p = ttest_from_moments(
+            mean[:, [0]], mean[:, 1:],
+            var[:, [0]], var[:, 1:],
+            n[:, [0]], n[:, 1:],
+            alternative=self.alternative
+            )
+        p_adjusted = padjust(p, self.padjust, axis=0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stderr = np.sqrt(var[:, [0]] / n[:, [0]] + var[:, 1:] / n[:, 1:])
+
+        n_segments, n_variants, n_metrics = p.shape
+
+        segment_df = segments.to_frame(index=False)
+        table = segment_df.loc[np.repeat(np.arange(n_segments), n_variants * n_metrics)].reset_index(drop=True)
+
+        variant_idx = np.tile(np.repeat(np.arange(1, n_variants + 1), n_metrics), n_segments)
+        metric_idx = np.tile(np.arange(n_metrics), n_segments * n_variants)
+
+        table['metric'] = np.asarray(self.metrics)[metric_idx]
+        table['A'] = groups[0]
+        table['B'] = groups[variant_idx]
+        table['n(A)'] = np.broadcast_to(n[:, [0]], p.shape).ravel()
+        table['n(B)'] = n[:, 1:].ravel()
+        table['mean(A)'] = np.broadcast_to(mean[:, [0]], p.shape).ravel()
+        table['mean(B)'] = mean[:, 1:].ravel()
+        table['delta'] = table['mean(A)'] - table['mean(B)']
+        table['stderr'] = stderr.ravel()
+        table['t-stat'] = tstat.ravel()
+        table['dof'] = dof.ravel()
+        table['p-value'] = p.ravel()
+        table['p-value (adj)'] = p_adjusted.ravel()
+        table['significant'] = table['p-value (adj)'] <= self.alpha
+
+        return table
+
+    def _heterogeneity(self, table):
+        """Cochran's Q test of whether the effect differs between segments, per metric and variant."""
+        # inverse-variance weights, for segments with a finite, positive standard error
+        table = table.loc[(table['stderr'] > 0) & np.isfinite(table['stderr'])]
+        table = table.assign(weight=1 / table['stderr'] ** 2)
+
+        records = []
+        for (metric, variant), frame in table.groupby(['metric', 'B'], sort=False):
+            pooled = np.sum(frame.weight * frame.delta) / np.sum(frame.weight)
+            q_stat = np.sum(frame.weight * (frame.delta - pooled) ** 2)
+            dof = len(frame) - 1
+            records.append({
+                'metric': metric,
+                'B': variant,
+                'segments': len(frame),
+                'pooled delta': pooled,
+                'Q': q_stat,
+                'p-value': chi2.sf(q_stat, dof) if dof > 0 else np.nan
+                })
+
+        return pd.DataFrame(records)
+
+    def run(self):
+        table = self._run_tests()
+        heterogeneity = self._heterogeneity(table)
+
+        self.results['segments'] = table
+        self.results['heterogeneity'] = heterogeneity
+
+        n_significant = int(table['significant'].sum())
+        title = f'Segments by {", ".join(self.by)}'
+        adjustment = 'without adjustment' if self.padjust == 'none' else \
+            f'after {self.padjust} adjustment across segments'
+        note = f'{n_significant} out of {len(table)} segment tests are significant {adjustment}. ' \
+               f'The full table is in the analyses log.'
+
+        with measure(self, 'formatting'):
+            pretty_results(heterogeneity, title=title, subtitle='Heterogeneity of effects (Cochran\'s Q):')
+            pretty_results(
+                table.nsmallest(10, 'p-value (adj)'),
+                subtitle='Segments with the smallest adjusted p-values:',
+                note=note
+                )
+
+
+class WideComparison(BaseAnalyser):
+    """
+    Compares hundreds of metrics at once. Group sizes, means and variances of all metrics are aggregated in a single
+    pass, Levene's test picks Student's or Welch's t-test per metric, and every variant is tested against the control
+    (first group) for all metrics in one vectorized step.
+
+    The p-values are adjusted within each family of metrics: success, health and learning metrics (metrics outside the
+    roles of the ExperimentDataFrame form an 'other' family). padjust is either a method for all families or a dict
+    with a method per family, fdr_bh by default; 'none' leaves the p-values as they are.
+    """
+
+    families = ('success', 'health', 'learning', 'other')
+
+    def __init__(self, *args, **kwargs):
+        padjust_methods = kwargs.get('padjust')
+        if isinstance(padjust_methods, dict):
+            kwargs['padjust'] = 'none'
+
+        BaseAnalyser.__init__(self, *args, **kwargs)
+
+        if self.parametric is not True:
+            raise AttributeError('the wide comparison is only available for parametric tests.')
+
+        if padjust_methods is None:
+            padjust_methods = 'fdr_bh'
+            pinfo('p-values are adjusted within each family of metrics with fdr_bh. Use padjust="none" to leave them '
+                  'unadjusted.', color='warning')
+
+        if not isinstance(padjust_methods, dict):
+            padjust_methods = {family: padjust_methods for family in self.families}
+
+        self.padjust = padjust_methods
+
+    def _family(self, metric):
+        data = self.data
+        if metric in data.success_metric:
+            return 'success'
+        if metric in data.health_metrics:
+            return 'health'
+        if metric in data.learning_metrics:
+            return 'learning'
+        return 'other'
+
+    @instrumented('wide-tests')
+    def _run_tests(self):
+        summary = group_summary(self.data.data, self.treatment, self.metrics)
+        _, levene_p = levene_by_group(self.data.data, self.treatment, self.metrics)
+        equal_var = levene_p > .05
+
+        n, mean, var = summary.n, summary.mean, summary.var
+
+        # control (A) vs. variants (B), following pingouin's convention for delta and the alternative
+        args = (mean[[0]], mean[1:], var[[0]], var[1:], n[[0]], n[1:])
+        student = ttest_from_moments(*args, equal_var=True, alternative=self.alternative)
+        welch = ttest_from_moments(*args, equal_var=False, alternative=self.alternative)
+        tstat, dof, p = (np.where(equal_var, s, w) for s, w in zip(student, welch))
+
+        families = np.array([self._family(metric) for metric in self.metrics])
+        p_adjusted = np.full_like(p, np.nan)
+        for family in self.families:
+            in_family = families == family
+            if in_family.any():
+                # all variants and metrics of a family form one family of tests
+                p_adjusted[:, in_family] = padjust(p[:, in_family].ravel(), self.padjust[family]) \
+                    .reshape(p[:, in_family].shape)
+
+        n_variants, n_metrics = p.shape
+        groups = summary.groups
+
+        res = pd.DataFrame({
+            'family': np.tile(families, n_variants),
+            'metric': np.tile(self.metrics, n_variants),
+            'A': groups[0],
+            'B': np.repeat(groups[1:], n_metrics),
+            'mean(A)': np.tile(mean[0], n_variants),
+            'mean(B)': mean[1:].ravel(),
+            'delta': (mean[[0]] - mean[1:]).ravel(),
+            't-stat': tstat.ravel(),
+            'dof': dof.ravel(),
+            'welch': np.tile(~equal_var, n_variants),
+            'p-value': p.ravel(),
+            'p-value (adj)': p_adjusted.ravel()
+            })
+        res['significant'] = res['p-value (adj)'] <= self.alpha
+
+        order = {family: i for i, family in enumerate(self.families)}
+        res = res.sort_values(['family', 'B'], key=lambda col: col.map(order) if col.name == 'family' else col,
+                              kind='stable')
+
+        return res.set_index(['family', 'metric', 'B'])
+
+    def run(self):
+        res = self._run_tests()
+
+        self.results['wide'] = res
+
+        counts = res.groupby(level='family', sort=False)['significant'].agg(['size', 'sum']) \
+            .rename(columns={'size': 'tests', 'sum': 'significant'})
+        counts['padjust'] = [self.padjust[family] for family in counts.index]
+
+        with measure(self, 'formatting'):
+            pretty_results(counts, title='Wide comparison', subtitle='Significant tests per family of metrics:')
+
+            significant = res.loc[res['significant']]
+            if len(significant) > 0:
+                pretty_results(significant.drop(columns=['significant']), subtitle='Significant metrics:',
+                               note='The full result matrix is in the analyses log.')
+
+
 class PermutationComparison(BaseAnalyser):
+    """
+    Permutation tests of two groups. Unpaired tests shuffle the group labels; paired tests (paired=True) flip the signs
+    of the within-unit differences between the groups, for the units of experiment_unit that are in both groups.
+
+    For the default statistic, the difference in means, permutations are drawn in chunks that fit in memory_budget
+    bytes, and each chunk is evaluated at once: a gather and sum of the permuted values for unpaired tests, and a
+    single product of the (chunk x units) matrix of signs and the vector of differences for paired tests. When the
+    number of sign vectors (2^units) does not exceed rounds, paired tests enumerate all of them and the p-value is
+    exact. Custom statistics (func) are evaluated one permutation at a time.
+
+    method='exact' replaces the random permutations by the exact null distribution of the difference in means of
+    integer metrics (e.g. counts), from generating functions of the group sum or of the sum of sign flips evaluated
+    with FFTs. The p-value then has no sampling error, at a cost that grows with the range of the values.
+
+    With more than two groups, an omnibus test of the between-group sum of squares (equivalent to the F-statistic
+    under permutation) is followed by pooled-variance t contrasts ('all' pairs or variants vs. 'control'), whose
+    adjusted p-values control the family-wise error rate with the single-step max-T method. Each permutation shuffles
+    the integer group codes in place and bincounts the fixed values per group.
+    """
+
     def __init__(
             self, data, metrics, treatment, alternative, padjust, parametric, paired, alpha, groups,
-            func, method, rounds, seed
+            func, method, rounds, seed, memory_budget=2 ** 28, contrasts='all'
             ):
         BaseAnalyser.__init__(self, data, metrics, treatment, alternative, padjust, parametric, paired, alpha, groups)
 
+        if contrasts not in ('all', 'control'):
+            raise AttributeError(f'contrasts should be either all or control. Got {contrasts} instead.')
+
+        if len(groups) > 2 and (paired or func is not None):
+            raise AttributeError('permutation tests of more than two groups are unpaired, for the difference in means.')
+
+        if method not in ('approx', 'exact'):
+            raise AttributeError(f'method should be either approx or exact. Got {method} instead.')
+
+        if method == 'exact' and (len(groups) > 2 or func is not None):
+            raise AttributeError('exact permutation distributions are for the difference in means of two groups.')
+
+        self.custom_func = func is not None
+        self.contrasts = contrasts
+
         if func is None:
-            print(
+            echo(
                 'Permuting for mean difference by default. Use a custom function in arg func for median and quantiles.')
             if alternative == 'two-sided':
                 def func(a, b):
@@ -314,7 +1309,7 @@ class PermutationComparison(BaseAnalyser):
                 def func(a, b):
                     a_stat = a.mean()
                     b_stat = b.mean()
-                    diff = abs(b_stat - a_stat)
+                    diff = b_stat - a_stat
                     return a_stat, b_stat, diff
 
                 self.func = func
@@ -323,12 +1318,39 @@ class PermutationComparison(BaseAnalyser):
         self.method = method
         self.rounds = rounds
         self.seed = seed
+        self.memory_budget = memory_budget
+
+    def _chunks(self, n_values, total=None, bytes_per_value=16):
+        """Offsets and sizes of the chunks of permutations, with n_values random draws and values per permutation."""
+        total = self.rounds if total is None else total
+        chunk = _chunk_size(n_values, bytes_per_value, self.memory_budget, total)
+        done = 0
+        while done < total:
+            size = min(chunk, total - done)
+            yield done, size
+            done += size
+
+    def _directed(self, delta):
+        # the mean differences in the direction of the default statistic
+        if self.alternative == 'two-sided':
+            return np.abs(delta)
+        return delta if self.alternative == 'greater' else -delta
+
+    def _store(self, metric, results, subtitle):
+        if metric not in self.results:
+            self.results[metric] = {}
+
+        self.results[metric]['permutation-tests'] = results
 
+        with measure(self, 'formatting', metric):
+            pretty_results(results, title=metric, subtitle=subtitle)
+
+    @instrumented('permutation-test', per_metric=True)
     def _unpaired_perm(self, metric):
 
-        a, b = [self.data.loc[self.data[self.treatment] == g, metric] for g in self.groups]
+        a, b = [self.data.loc[self.data[self.treatment] == g, metric].to_numpy(dtype=float) for g in self.groups]
 
-        rng = np.random.RandomState(self.seed)
+        rng = np.random.default_rng(self.seed)
 
         k = len(a)
 
@@ -336,44 +1358,210 @@ class PermutationComparison(BaseAnalyser):
 
         a_stat, b_stat, observed_delta = self.func(a, b)
 
-        total = past_observed = 0
+        past_observed = 0
+
+        if self.custom_func:
+            for i in range(self.rounds):
+                rng.shuffle(null_dist)
+                if self.func(null_dist[:k], null_dist[k:])[2] >= observed_delta:
+                    past_observed += 1
+        elif self.method == 'exact':
+            n = len(null_dist)
+            total = null_dist.sum()
+            observed = self._directed(a.mean() - b.mean())
+            m = min(k, n - k)
+            sums, probabilities = subset_sum_distribution(null_dist, m)
+            a_sums = sums if m == k else total - sums
+            perm_delta = a_sums / k - (total - a_sums) / (n - k)
+            p = np.sum(probabilities[self._directed(perm_delta) >= observed - 1e-12 * abs(observed)])
+        else:
+            n = len(null_dist)
+            total = null_dist.sum()
+            observed = self._directed(a.mean() - b.mean())
+            m = min(k, n - k)
+            for _, size in self._chunks(n):
+                # a random subset of the smaller group size per permutation: the m smallest of random keys
+                subset = np.argpartition(rng.random((size, n), dtype=np.float32), m - 1, axis=1)[:, :m]
+                subset_sums = null_dist[subset].sum(axis=1)
+                a_sums = subset_sums if m == k else total - subset_sums
+                perm_delta = a_sums / k - (total - a_sums) / (n - k)
+                past_observed += np.sum(self._directed(perm_delta) >= observed - 1e-12 * abs(observed))
+
+        exact = self.method == 'exact'
+        if not exact:
+            p = past_observed / self.rounds
 
-        for i in range(self.rounds):
+        results = pd.DataFrame({
+            'A': [self.groups[0]],
+            'B': [self.groups[1]],
+            'stat(A)': [a_stat],
+            'stat(B)': [b_stat],
+            'diff': [observed_delta],
+            'permutations': [comb(len(null_dist), k) if exact else self.rounds],
+            'exact': [exact],
+            'p-value': [p]
+            })
+
+        self._store(metric, results, 'Permutation tests')
+
+    def _pairs(self, metric):
+        """The values of the units that are in both groups (averaged per unit and group), as two aligned arrays."""
+        unit = self.data.experiment_unit
+        df = self.data.data[[unit, self.treatment, metric]].dropna()
+
+        means = df.groupby([unit, self.treatment], sort=False)[metric].mean().unstack(self.treatment)
+        means = means[list(self.groups)].dropna()
+
+        if len(means) == 0:
+            raise Exception(f'There are no units with {metric} in both groups to pair.')
 
-            rng.shuffle(null_dist)
+        return means[self.groups[0]].to_numpy(dtype=float), means[self.groups[1]].to_numpy(dtype=float)
 
-            perm_delta = self.func(null_dist[:k], null_dist[k:])[2]
+    def _sign_chunks(self, rng, n):
+        """Chunks of sign vectors: all 2^n of them when that is at most rounds, random ones otherwise."""
+        exact = 2 ** n <= self.rounds if n < 63 else False
+        total = 2 ** n if exact else self.rounds
 
-            if perm_delta >= observed_delta:
-                past_observed += 1
+        for start, size in self._chunks(n, total):
+            if exact:
+                codes = np.arange(start, start + size, dtype=np.int64)
+                yield exact, 1. - 2. * ((codes[:, None] >> np.arange(n)) & 1)
+            else:
+                yield exact, np.where(rng.random((size, n)) < .5, -1., 1.)
 
-            total += 1
+    @instrumented('paired-permutation-test', per_metric=True)
+    def _paired_perm(self, metric):
 
-        p = past_observed / total
+        a, b = self._pairs(metric)
+        n = len(a)
+        rng = np.random.default_rng(self.seed)
+
+        a_stat, b_stat, observed_delta = self.func(a, b)
+
+        differences = a - b
+        observed = self._directed(differences.mean())
+
+        if self.method == 'exact':
+            sums, probabilities = sign_flip_distribution(differences)
+            p = np.sum(probabilities[self._directed(sums / n) >= observed - 1e-12 * abs(observed)])
+            total, exact = 2 ** n, True
+        else:
+            past_observed = total = 0
+            exact = False
+            for exact, signs in self._sign_chunks(rng, n):
+                if self.custom_func:
+                    for flips in signs < 0:
+                        # a sign flip swaps the values of a unit between the groups
+                        if self.func(np.where(flips, b, a), np.where(flips, a, b))[2] >= observed_delta:
+                            past_observed += 1
+                else:
+                    perm_delta = signs @ differences / n
+                    past_observed += np.sum(self._directed(perm_delta) >= observed - 1e-12 * abs(observed))
+                total += len(signs)
+            p = past_observed / total
 
         results = pd.DataFrame({
-            'A': [0],
-            'B': [1],
+            'A': [self.groups[0]],
+            'B': [self.groups[1]],
             'stat(A)': [a_stat],
             'stat(B)': [b_stat],
             'diff': [observed_delta],
-            'permutations': [self.rounds],
+            'pairs': [n],
+            'permutations': [total],
+            'exact': [exact],
             'p-value': [p]
             })
 
-        if metric not in self.results:
-            self.results[metric] = {}
+        self._store(metric, results, 'Paired permutation tests (sign flips)')
 
-        self.results[metric]['permutation-tests'] = results
+    def _contrast_pairs(self, n_groups):
+        if self.contrasts == 'all':
+            return np.triu_indices(n_groups, k=1)
+        return np.zeros(n_groups - 1, dtype=int), np.arange(1, n_groups)
 
-        pretty_results(results, title=metric, subtitle='Permutation tests')
+    @instrumented('k-sample-permutation-test', per_metric=True)
+    def _ksample_perm(self, metric):
 
-    def run(self):
+        df = self.data.data[[self.treatment, metric]].dropna()
+        labels = np.searchsorted(self.groups, df[self.treatment].to_numpy())
+        values = df[metric].to_numpy(dtype=float)
 
-        if self.paired:
-            print('paired permutations not implemented yet')
+        # centering leaves the statistics unchanged and the sums of squares numerically stable
+        centre = values.mean()
+        values = values - centre
+
+        n, k = len(values), len(self.groups)
+        counts = np.bincount(labels, minlength=k).astype(float)
+        a, b = self._contrast_pairs(k)
+        total_squares = np.sum(values ** 2)
+
+        def statistics(sums):
+            # the within-group sum of squares is the (fixed) total minus the between-group sum of squares
+            ssb = np.sum(sums ** 2 / counts, axis=-1)
+            pooled = (total_squares - ssb) / (n - k)
+            means = sums / counts
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t_stat = (means[..., a] - means[..., b]) / np.sqrt(pooled[..., None] * (1 / counts[a] + 1 / counts[b]))
+            return ssb, t_stat
 
-        elif not self.paired:
+        observed_sums = np.bincount(labels, weights=values, minlength=k)
+        observed_ssb, observed_t = statistics(observed_sums)
+        observed_directed = self._directed(observed_t)
+        tolerance = 1e-12 * max(1., abs(observed_ssb))
 
-            for metric in self.metrics:
+        rng = np.random.default_rng(self.seed)
+        shuffled = labels.copy()
+        sums = np.empty((self.rounds, k))
+
+        for i in range(self.rounds):
+            # shuffling the small vector of group codes in place and summing the fixed values per group
+            rng.shuffle(shuffled)
+            sums[i] = np.bincount(shuffled, weights=values, minlength=k)
+
+        ssb, t_stat = statistics(sums)
+        directed = self._directed(t_stat)
+        exceeding_ssb = np.sum(ssb >= observed_ssb - tolerance)
+        exceeding_t = np.sum(directed >= observed_directed - 1e-12, axis=0)
+        exceeding_max = np.sum(directed.max(axis=1)[:, None] >= observed_directed - 1e-12, axis=0)
+
+        f_stat = (observed_ssb / (k - 1)) / ((total_squares - observed_ssb) / (n - k))
+
+        omnibus = pd.DataFrame({
+            'Source': [self.treatment],
+            'f-stat': [f_stat],
+            'dof': [k - 1],
+            'permutations': [self.rounds],
+            'p-value': [exceeding_ssb / self.rounds]
+            })
+
+        means = observed_sums / counts + centre
+        contrasts = pd.DataFrame({
+            'A': self.groups[a],
+            'B': self.groups[b],
+            'mean(A)': means[a],
+            'mean(B)': means[b],
+            'diff': means[a] - means[b],
+            't-stat': observed_t,
+            'permutations': self.rounds,
+            'p-value': exceeding_t / self.rounds,
+            'p-value (adj)': exceeding_max / self.rounds
+            })
+
+        self.results.setdefault(metric, {})['permutation-anova'] = omnibus
+        with measure(self, 'formatting', metric):
+            pretty_results(omnibus, title=metric, subtitle='Permutation test of equal means (F):')
+
+        self.results[metric]['permutation-tests'] = contrasts
+        with measure(self, 'formatting', metric):
+            pretty_results(contrasts, subtitle='Permutation contrasts:',
+                           note='Info: p-value (adj) controls the family-wise error rate with the max-T method.')
+
+    def run(self):
+
+        for metric in self.metrics:
+            if len(self.groups) > 2:
+                self._ksample_perm(metric)
+            elif self.paired:
+                self._paired_perm(metric)
+            else:
                 self._unpaired_perm(metric)
@@ -1,7 +1,12 @@
 from typing import Any
-from dexter.stats_func import trim_outliers, winsorize_outliers, check_multiple_proportion
+import numpy as np
+import pandas as pd
+
+from dexter.stats_func import trim_outliers, winsorize_outliers, check_multiple_proportion, chisquare_from_counts, \
+    padjust
 from numpy import round, mean, sum, ndarray, sort
-from dexter.utils import indent, print_nested_dict
+from dexter.instrumentation import instrumented
+from dexter.utils import echo, indent, print_nested_dict, pretty_results, time_buckets
 from tabulate import tabulate
 from pandas import DataFrame, concat
 from itertools import product
@@ -10,7 +15,7 @@ from typing import Callable
 
 def print_status_message(status_dict, exclude_keys=[]):
     print_nested_dict(status_dict, indent=0, exclude_keys=exclude_keys)
-    print('')
+    echo('')
 
 
 class ExperimentChecker:
@@ -18,6 +23,7 @@ class ExperimentChecker:
 
         self._experiment = experiment
         self._crossover_mask = None
+        self._outlier_mask = None
         self._log = {
             'group_balance': {
                 'assumption': 'the group sizes have the pre-defined proportions',
@@ -69,13 +75,14 @@ class ExperimentChecker:
     def get_log(self):
         return self._log
 
+    @instrumented('check_groups_balance')
     def check_groups_balance(self):
         experiment = self._experiment
         data = experiment.data
 
         treatment = data.treatment
         expected_proportions = data.expected_proportions
-        n_treatment = data[treatment].value_counts().sort_index()
+        n_treatment = data.group_sizes()
         n_total = data.shape[0]
         observed_prop = round(n_treatment / n_total, 3).tolist()
         test_res = check_multiple_proportion(n_total, n_treatment, expected_proportions)
@@ -92,6 +99,68 @@ class ExperimentChecker:
 
         print_status_message(self._log.get('group_balance'))
 
+    @instrumented('check_srm_over_time')
+    def check_srm_over_time(self, freq='D', alpha=.05, padjust_method='bonf'):
+        """
+        Sample ratio mismatch per time bucket (e.g. 'D' for days, 'h' for hours) and cumulatively over time, so that
+        an imbalance that starts during the experiment is not averaged away. All counts come from a single bincount
+        over (time bucket x group), and the per-bucket p-values are adjusted for the number of buckets.
+
+        Requires the timestamp column of the ExperimentDataFrame.
+        """
+        data = self._experiment.data
+
+        if data.timestamp is None:
+            raise Exception('The ExperimentDataFrame has no timestamp column. See the timestamp argument.')
+
+        bucket_codes, buckets = time_buckets(data[data.timestamp], freq)
+        group_codes, groups = pd.factorize(data[data.treatment], sort=True)
+        n_buckets, n_groups = len(buckets), len(groups)
+
+        valid = (bucket_codes >= 0) & (group_codes >= 0)
+        counts = np.bincount(
+            bucket_codes[valid] * n_groups + group_codes[valid],
+            minlength=n_buckets * n_groups
+            ).reshape(n_buckets, n_groups)
+        cumulative = counts.cumsum(axis=0)
+
+        expected_proportions = data.expected_proportions
+        stat, p = chisquare_from_counts(counts, expected_proportions)
+        cumulative_stat, cumulative_p = chisquare_from_counts(cumulative, expected_proportions)
+        p_adjusted = padjust(p, padjust_method)
+
+        res = pd.DataFrame(counts, index=buckets, columns=[f'n({g})' for g in groups])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            observed_prop = counts / counts.sum(axis=1, keepdims=True)
+        for g, prop in zip(groups, observed_prop.T):
+            res[f'prop({g})'] = prop
+        res['chi2'] = stat
+        res['p-value'] = p
+        res['p-value (adj)'] = p_adjusted
+        res['cumulative chi2'] = cumulative_stat
+        res['cumulative p-value'] = cumulative_p
+        res.index.name = 'bucket'
+
+        flagged = res.index[res['p-value (adj)'] <= alpha]
+        first_flagged = flagged[0] if len(flagged) > 0 else None
+
+        diagnostics = self._log['group_balance']['diagnostics']
+        diagnostics['over time'] = res
+        diagnostics['first imbalanced bucket'] = first_flagged
+        diagnostics['imbalanced buckets'] = len(flagged)
+
+        echo('• Sample ratio mismatch over time:')
+        if first_flagged is None:
+            echo(indent(f'No {freq} bucket out of {n_buckets} shows a significant imbalance ({padjust_method} '
+                         f'adjusted).' + '\n'))
+        else:
+            echo(indent(f'{len(flagged)} out of {n_buckets} buckets show a significant imbalance ({padjust_method} '
+                         f'adjusted). The first one starts at {first_flagged}.'))
+            pretty_results(res.loc[flagged].head(10), floatfmt='.3g')
+
+        return res
+
+    @instrumented('check_crossover')
     def check_crossover(self):
         experiment = self._experiment
         experiment_unit = experiment.data.experiment_unit
@@ -114,6 +183,7 @@ class ExperimentChecker:
 
         print_status_message(self._log.get('crossover'))
 
+    @instrumented('check_outliers')
     def check_outliers(self, is_outlier, metrics, func: Callable):
 
         data = self._experiment.data
@@ -143,40 +213,60 @@ class ExperimentChecker:
 
         self._log['outliers']['status']['checked'] = True
         self._log['outliers']['diagnostics']['stats'] = aggr_df.to_dict()
-        self._crossover_mask = is_outlier
+        self._outlier_mask = is_outlier
 
         print_status_message(self._log.get('outliers'), exclude_keys=['stats'])
 
         headers = [aggr_df.index.name] + list(map('\n '.join, aggr_df.columns.tolist()))
 
-        print(
+        echo(
             'Stats:\n',
             indent(tabulate(aggr_df, headers=headers, showindex=True, floatfmt='.3f', tablefmt='simple'), 1),
             '\n'
             )
 
-        print('The check_outliers() method will not affect the diagnostics for this assumption. '
+        echo('The check_outliers() method will not affect the diagnostics for this assumption. '
               'Only handling it will.' + '\n')
 
+    def undo(self):
+        """
+        Undoes the last handling step (of cross-overs or outliers) and any later changes to the data, restoring the data
+        as it was before.
+        """
+        versions = self._experiment.data.versions
+        handling = versions['name'].isin(['handle_crossover', 'handle_outliers'])
+        if not handling.any():
+            raise Exception('There is no handling step to undo.')
+
+        steps = len(versions) - np.flatnonzero(handling)[-1]
+        removed = self._experiment.data.undo(steps)
+
+        assumption = removed[0].replace('handle_', '')
+        remaining = self._experiment.data.versions['name'].tolist()
+        self._log[assumption]['status']['handled'] = removed[0] in remaining
+
+        echo(f'• Undid: {", ".join(removed)}.' + '\n')
+
     def get_status(self, detailed=False):
         if detailed:
             print_status_message(self._log)
         else:
             print_status_message(self._log, exclude_keys=['assumption', 'info', 'diagnostics', 'stats'])
 
+    @instrumented('handle_crossover')
     def handle_crossover(self, threshold=.01, force=False):
 
         if self._log['crossover']['status']['checked'] is False:
             self.check_crossover()
 
-        print('• Handling cross-overs...')
+        echo('• Handling cross-overs...')
 
         if self._crossover_mask is None:
-            print(indent('Nothing to take care of. Have you ran the check for this assumption first?'+'\n'))
+            echo(indent('Nothing to take care of. Have you ran the check for this assumption first?'+'\n'))
             return
 
-        if sum(self._crossover_mask == 0):
-            print(indent('There are no cross-over cases to handle. You are good to go.'+'\n'))
+        if not self._crossover_mask.any():
+            echo(indent('There are no cross-over cases to handle. You are good to go.'+'\n'))
             return
 
         if mean(self._crossover_mask) > threshold:
@@ -186,12 +276,16 @@ class ExperimentChecker:
 
         affected = sum(self._crossover_mask)
 
-        print(f'{affected} units were removed from the working dataset.')
+        # the mask is indexed by unit, so the rows of the crossed-over units are looked up by their unit
+        data = self._experiment.data
+        crossed_over_units = self._crossover_mask.index[self._crossover_mask.to_numpy()]
+        removed = data.filter(~data[data.experiment_unit].isin(crossed_over_units), name='handle_crossover')
 
-        self._experiment.data.data = self._experiment.data.loc[~self._crossover_mask]
+        echo(f'{affected} units ({removed} rows) were removed from the working dataset.')
 
         self._log['crossover']['status']['handled'] = True
 
+    @instrumented('handle_outliers')
     def handle_outliers(self, metrics, method, is_outlier=None, func=None):
         experiment = self._experiment
 
@@ -204,13 +298,15 @@ class ExperimentChecker:
         if is_outlier is None and self._log['outliers']['status']['checked'] is False:
             raise Exception('Provide a boolean mask that identifies outliers.')
 
+        is_outlier = self._outlier_mask if is_outlier is None else is_outlier
+
         if self._log['outliers']['status']['checked'] is False:
             self.check_outliers(is_outlier=is_outlier, metrics=metrics, func=func)
 
-        print('• Handling outliers...')
+        echo('• Handling outliers...')
 
         if metrics is None:
-            print(indent('All success and learning metrics are affected by default. See the "metrics" argument.'))
+            echo(indent('All success and learning metrics are affected by default. See the "metrics" argument.'))
 
         # choose a method to remove outliers
         method_dict = {
@@ -220,7 +316,11 @@ class ExperimentChecker:
 
         outlier_fun = method_dict[method]
 
-        experiment.data.data = outlier_fun(dataframe=self._experiment.data, outlier_mask=is_outlier, metrics=metrics)
+        handled = outlier_fun(dataframe=experiment.data, outlier_mask=is_outlier, metrics=metrics)
+        if method == 'trim':
+            experiment.data.filter(handled, name='handle_outliers')
+        else:
+            experiment.data.override(handled, name='handle_outliers')
 
         total_affected = is_outlier.sum()
         percent_affected = is_outlier.mean()
@@ -230,5 +330,5 @@ class ExperimentChecker:
         self._log['outliers']['diagnostics']['affected metrics'] = metrics
         self._log['outliers']['diagnostics']['number of affected units'] = total_affected
 
-        print(indent('{} experiment units were affected: {}% of the total sample.\n'
+        echo(indent('{} experiment units were affected: {}% of the total sample.\n'
                      .format(total_affected, round(percent_affected * 100, 3))))
\ No newline at end of file
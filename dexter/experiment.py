@@ -1,27 +1,133 @@
 from collections import namedtuple
+from itertools import count
 
+import numpy as np
 import pandas
 from numpy import sort, mean
 
 import dexter.validation as validation
 from dexter.analyser import ExperimentAnalyser
 from dexter.assumptions import ExperimentChecker
+from dexter.instrumentation import Instrumentation, instrumented, measure
+from dexter.pipeline import Pipeline, default_pipeline
+from dexter.planning import unique_unit_curve, days_to_power
+from dexter.simulation import simulate_aa, simulate_power
+from dexter.sql import summarise_sql
 from dexter.stats_func import mde, required_n, actual_power
+from dexter.summary import ExperimentSummary
+from dexter.sweep import robustness_sweep
 from dexter.utils import *
 from dexter.visualisations import ExperimentVisualiser
 
 
+_forbidden = ['treatment', 'groups', 'n_groups', 'success_metric', 'learning_metrics',
+              'health_metric', 'experiment_unit', 'expected_proportions', 'dataframe']
+
+
+class ExperimentSchema:
+    """
+    The roles of the columns of an experiment (metrics, unit, treatment, timestamp) without the data. The roles are
+    validated when the schema is created, and the checks on the data itself are cached per data fingerprint, so that
+    the same snapshot is validated once, also when the schema is pickled to worker processes.
+
+    The fingerprint covers the number of rows, the columns, their dtypes and a hash of an evenly spaced sample of the
+    unit, treatment and timestamp columns. It detects a different snapshot, not every change to a snapshot: use it for
+    trusted data that is not modified in place.
+    """
+    success_metric = validation._TestMetric(_forbidden)
+    health_metrics = validation._TestMetric(_forbidden)
+    learning_metrics = validation._Metric(_forbidden)
+    experiment_unit = validation._ColumnIdentifier(_forbidden)
+    treatment = validation._ColumnIdentifier(_forbidden)
+    timestamp = validation._ColumnIdentifier(_forbidden)
+    expected_proportions = validation._ExpectedProportions()
+
+    _sample_size = 1024
+
+    def __init__(
+            self,
+            success_metric: list[str],
+            health_metric: list[str],
+            learning_metrics: list[str],
+            experiment_unit: str,
+            treatment: str,
+            expected_proportions: list[float],
+            timestamp: str = None
+            ):
+        self.success_metric = success_metric
+        self.health_metrics = health_metric
+        self.learning_metrics = learning_metrics
+        self.experiment_unit = experiment_unit
+        self.treatment = treatment
+        self.expected_proportions = expected_proportions
+        self.timestamp = timestamp
+        self._validated = set()
+
+    def fingerprint(self, dataframe):
+        n_rows = dataframe.shape[0]
+        keys = [col for col in (self.experiment_unit, self.treatment, self.timestamp)
+                if col is not None and col in dataframe.columns]
+
+        sample = np.unique(np.linspace(0, n_rows - 1, min(n_rows, self._sample_size)).astype(int))
+        sample_hash = int(pandas.util.hash_pandas_object(dataframe[keys].iloc[sample], index=False).sum())
+
+        return n_rows, tuple(dataframe.columns), tuple(map(str, dataframe.dtypes)), sample_hash
+
+    def validate(self, dataframe):
+        """
+        Runs the checks on the data, unless this snapshot has been validated before.
+
+        :return:
+        whether the checks ran
+        """
+        missing = set(self.success_metric + self.health_metrics + self.learning_metrics +
+                      [self.experiment_unit, self.treatment]) - set(dataframe.columns)
+        if missing:
+            raise ValueError(f'The following columns are not in the DataFrame: {", ".join(map(str, missing))}.')
+
+        fingerprint = self.fingerprint(dataframe)
+        if fingerprint in self._validated:
+            return False
+
+        validation._post_validate_experiment_dataframe(self, data=dataframe)
+        self._validated.add(fingerprint)
+
+        return True
+
+
+def _roles(obj):
+    # the arguments of an ExperimentSchema with the roles of a schema or an ExperimentDataFrame
+    return dict(
+        success_metric=obj.success_metric,
+        health_metric=obj.health_metrics,
+        learning_metrics=obj.learning_metrics,
+        experiment_unit=obj.experiment_unit,
+        treatment=obj.treatment,
+        expected_proportions=obj.expected_proportions,
+        timestamp=obj.timestamp
+        )
+
+
+def _frame_attribute(name):
+    # looked up on the class, so that hot pandas attributes skip the __getattr__ fallback
+    return property(lambda self: getattr(self.data, name))
+
+
+DataVersion = namedtuple('DataVersion', ['name', 'keep', 'overrides'])
+
+_revisions = count()
+
+
 class ExperimentDataFrame:
-    _forbidden = ['treatment', 'groups', 'n_groups', 'success_metric', 'learning_metrics',
-                  'health_metric', 'experiment_unit', 'expected_proportions', 'dataframe']
+    _forbidden = _forbidden
 
     success_metric = validation._TestMetric(_forbidden)
     health_metrics = validation._TestMetric(_forbidden)
     learning_metrics = validation._Metric(_forbidden)
     experiment_unit = validation._ColumnIdentifier(_forbidden)
     treatment = validation._ColumnIdentifier(_forbidden)
+    timestamp = validation._ColumnIdentifier(_forbidden)
     expected_proportions = validation._ExpectedProportions()
-    data = validation._DataFrame()
 
     def __init__(
             self,
@@ -31,8 +137,22 @@ class ExperimentDataFrame:
             experiment_unit: str,
             treatment: str,
             expected_proportions: list[float],
-            dataframe: pandas.DataFrame
+            dataframe: pandas.DataFrame,
+            timestamp: str = None,
+            instrumentation: Instrumentation = None,
+            compact: bool = False
             ):
+        """
+        The DataFrame is the immutable base of the data. Handling steps (e.g. removing cross-overs or winsorizing
+        outliers) do not replace it with a filtered copy, but push a version: a boolean row mask, sparse value
+        overrides in positions of the base rows, or whole columns of the data. The data that analyses see (.data) is
+        the composition of the base and all versions, which is cached and updated with every new version. Versions can
+        be undone, and the data at any version can be rebuilt with view(), e.g. to compare results before and after
+        handling outliers.
+
+        With compact=True, binary and count metrics are stored as small integers (see compact()).
+        """
+        self.instrumentation = instrumentation
         self.data = dataframe
         self.success_metric = success_metric
         self.health_metrics = health_metric
@@ -40,21 +160,292 @@ class ExperimentDataFrame:
         self.experiment_unit = experiment_unit
         self.treatment = treatment
         self.expected_proportions = expected_proportions
+        self.timestamp = timestamp
         self._post_validate()
+        self._schema = None
+        self._validated_base = self._base
+
+        if compact:
+            self.compact()
+
+    @classmethod
+    def from_trusted(cls, schema: ExperimentSchema, dataframe: pandas.DataFrame,
+                     instrumentation: Instrumentation = None):
+        """
+        Fast construction from a trusted snapshot: the DataFrame is used as is (no copy), the roles come from the
+        already validated schema, and the checks on the data only run if the schema has not seen this snapshot yet.
+        """
+        validation._DataFrame().validate(dataframe)
+
+        obj = cls.__new__(cls)
+        obj.instrumentation = instrumentation
+        obj._reset(dataframe)
+        obj._success_metric = schema.success_metric
+        obj._health_metrics = schema.health_metrics
+        obj._learning_metrics = schema.learning_metrics
+        obj._experiment_unit = schema.experiment_unit
+        obj._treatment = schema.treatment
+        obj._expected_proportions = schema.expected_proportions
+        obj._timestamp = schema.timestamp
+
+        with measure(obj, 'validation'):
+            schema.validate(dataframe)
+        obj._schema = schema
+        obj._validated_base = dataframe
+
+        return obj
 
+    @property
+    def schema(self):
+        """
+        The roles as an ExperimentSchema, built once (and again when the roles change). The schema knows the
+        fingerprint of the data that was validated when the data was set, so from_trusted(df.schema, ...) on the same
+        snapshot skips the checks.
+        """
+        roles = _roles(self)
+        schema = self._schema
+        if schema is None or _roles(schema) != roles:
+            schema = ExperimentSchema(**roles)
+            if self._validated_base is self._base:
+                schema._validated.add(schema.fingerprint(self._base))
+            self._schema = schema
+
+        return schema
+
+    @instrumented('validation')
     def _post_validate(self):
         validation._post_validate_experiment_dataframe(self)
 
+    def _reset(self, dataframe):
+        self._base = dataframe
+        self._versions = []
+        self._view = None
+        self._positions = None
+        self._revision = next(_revisions)
+
+    @property
+    def data(self):
+        if self._view is None:
+            self._view, self._positions = self._compose(len(self._versions))
+        return self._view
+
+    @data.setter
+    def data(self, dataframe):
+        # a new DataFrame is a new base, without versions
+        validation._DataFrame().validate(dataframe)
+        self._reset(dataframe)
+
+    @property
+    def base(self):
+        return self._base
+
+    @property
+    def revision(self):
+        """Identifies the current data: it changes with every new base, version, undo and compaction."""
+        return self._revision
+
+    @property
+    def positions(self):
+        """Positions of the rows of the data in the base DataFrame."""
+        self.data
+        return np.arange(len(self._base)) if self._positions is None else self._positions
+
+    @property
+    def versions(self):
+        return pandas.DataFrame([{
+            'version': i + 1,
+            'name': version.name,
+            'rows removed': 0 if version.keep is None else int(len(version.keep) - version.keep.sum()),
+            'values overridden': sum(len(values) for _, values in (version.overrides or {}).values())
+            } for i, version in enumerate(self._versions)], columns=['version', 'name', 'rows removed',
+                                                                      'values overridden'])
+
+    def _compose(self, n_versions):
+        view, positions = self._base, None
+        for version in self._versions[:n_versions]:
+            view, positions = self._apply(view, positions, version)
+        return view, positions
+
+    @staticmethod
+    def _apply(view, positions, version):
+        """The data and the positions of its rows in the base after one more version."""
+        if version.overrides:
+            # a shallow copy shares the columns that are not overridden with the previous data
+            view = view.copy(deep=False)
+            for column, (at, values) in version.overrides.items():
+                if at is None:
+                    # a value for each row of the data
+                    view[column] = values
+                    continue
+
+                rows = at if positions is None else np.searchsorted(positions, at)
+                current = view[column].to_numpy(copy=True) if column in view.columns \
+                    else np.full(len(view), np.nan, dtype=np.result_type(values.dtype, float))
+                if not np.can_cast(values.dtype, current.dtype, casting='safe'):
+                    current = current.astype(np.result_type(current, values))
+                current[rows] = values
+                view[column] = current
+
+        if version.keep is not None:
+            rows = np.flatnonzero(version.keep if positions is None else version.keep[positions])
+            positions = rows if positions is None else positions[rows]
+            view = view.iloc[rows]
+
+        return view, positions
+
+    def _to_base(self, rows):
+        return rows if self._positions is None else self._positions[rows]
+
+    def _mask_positions(self, mask):
+        """Positions in the base of the rows of the data for which a boolean mask (aligned with the data) is True."""
+        data = self.data
+        if isinstance(mask, pandas.Series) and not mask.index.equals(data.index):
+            mask = mask.reindex(data.index, fill_value=False)
+        mask = np.asarray(mask, dtype=bool)
+        if len(mask) != len(data):
+            raise ValueError(f'the mask should have a value for each of the {len(data)} rows of the data.')
+        return self._to_base(np.flatnonzero(mask))
+
+    def _label_positions(self, values):
+        """Positions in the base of the rows of the data that index a Series."""
+        data = self.data
+        if values.index.equals(data.index):
+            return self._to_base(np.arange(len(data)))
+        rows = data.index.get_indexer(values.index)
+        if np.any(rows < 0):
+            raise ValueError('the values are indexed by rows that are not in the data.')
+        return self._to_base(rows)
+
+    def filter(self, keep, name='filter'):
+        """
+        Pushes a version that removes the rows of the data for which keep is False.
+
+        :return:
+        number of removed rows
+        """
+        n_rows = len(self.data)
+        mask = np.zeros(len(self._base), dtype=bool)
+        mask[self._mask_positions(keep)] = True
+        self._push(DataVersion(name, mask, None))
+        return n_rows - len(self.data)
+
+    def override(self, values, name='override'):
+        """
+        Pushes a version that overrides values of the data: a dict of column to either a Series indexed like (a subset
+        of) the data, or a value for each of its rows. Values for all rows replace the column and are stored without
+        positions.
+        """
+        data = self.data
+        overrides = {}
+        for column, column_values in values.items():
+            if isinstance(column_values, pandas.Series) and not column_values.index.equals(data.index):
+                overrides[column] = (self._label_positions(column_values), column_values.to_numpy())
+            else:
+                overrides[column] = (None, np.broadcast_to(np.asarray(column_values), (len(data),)))
+        self._push(DataVersion(name, None, overrides))
+
+    def _push(self, version):
+        self._versions.append(version)
+        self._revision = next(_revisions)
+        # the new version is applied on top of the current data, instead of composing all versions again
+        if self._view is not None:
+            self._view, self._positions = self._apply(self._view, self._positions, version)
+
+    def undo(self, steps=1):
+        """
+        Removes the last versions of the data.
+
+        :return:
+        names of the removed versions
+        """
+        if steps > len(self._versions):
+            raise ValueError(f'there are only {len(self._versions)} versions to undo.')
+        removed = [version.name for version in self._versions[len(self._versions) - steps:]]
+        del self._versions[len(self._versions) - steps:]
+        self._view = None
+        self._revision = next(_revisions)
+        return removed
+
+    def view(self, version=None):
+        """The data after the given number of versions (0 is the base), without changing the current data."""
+        if version is None or version == len(self._versions):
+            return self.data
+        return self._compose(version)[0]
+
+    @property
+    def metrics(self):
+        return [*self.success_metric, *self.health_metrics, *self.learning_metrics]
+
+    def group_sizes(self):
+        return self.data[self.treatment].value_counts().sort_index()
+
+    def group_summary(self, metrics=None):
+        return group_summary(self.data, self.treatment, self.metrics if metrics is None else metrics)
+
+    def summarise(self, metrics=None, sketch=False, precision=12):
+        """
+        Sufficient statistics of the data (see dexter.summary.ExperimentSummary), e.g. of a shard, to be merged with
+        the summaries of other shards.
+        """
+        return ExperimentSummary.from_frame(self.data, self, metrics=metrics, sketch=sketch, precision=precision)
+
+    def metric_types(self, metrics=None):
+        metrics = self.metrics if metrics is None else metrics
+        return {metric: metric_type(self.data[metric]) for metric in metrics}
+
+    @instrumented('compact')
+    def compact(self):
+        """
+        Stores binary and count metrics of the base as the smallest signed integers that hold them (e.g. int8 instead
+        of int64 or float64). The compacted columns are copies in a new base, which no longer shares them with the
+        DataFrame that was passed in: that DataFrame is left as is. Versions that override these columns with values
+        that do not fit keep a wider dtype.
+
+        :return:
+        the types of the metrics
+        """
+        types = {metric: metric_type(self._base[metric]) for metric in self.metrics}
+
+        columns = {}
+        for metric, kind in types.items():
+            compacted = compact_metric(self._base[metric], kind)
+            if compacted.dtype != self._base[metric].dtype:
+                columns[metric] = compacted
+
+        if columns:
+            self._base = self._base.assign(**columns)
+            self._view = None
+            self._revision = next(_revisions)
+
+        return types
+
+    shape = _frame_attribute('shape')
+    columns = _frame_attribute('columns')
+    index = _frame_attribute('index')
+    dtypes = _frame_attribute('dtypes')
+    loc = _frame_attribute('loc')
+    iloc = _frame_attribute('iloc')
+    groupby = _frame_attribute('groupby')
+    value_counts = _frame_attribute('value_counts')
+    describe = _frame_attribute('describe')
+    drop = _frame_attribute('drop')
+    query = _frame_attribute('query')
+
+    def __len__(self):
+        return len(self.data)
+
     def __getattr__(self, attr):
-        if attr in self.__dict__:
-            return getattr(self, attr)
+        # private and special attributes are never proxied, e.g. when unpickling before the data is set
+        if attr.startswith('_'):
+            raise AttributeError(f'{type(self).__name__} object has no attribute {attr}')
         return getattr(self.data, attr)
 
     def __getitem__(self, item):
         return self.data[item]
 
     def __setitem__(self, item, data):
-        self.data[item] = data
+        # assignments are versions as well, so that the base is left as is and they can be undone
+        self.override({item: data}, name=f'set {item}')
 
 
 class Experiment:
@@ -82,12 +473,20 @@ class Experiment:
             end: str,
             expected_delta: float,
             roll_out_percent: float,
-            experiment_df: ExperimentDataFrame = None
+            experiment_df: ExperimentDataFrame = None,
+            instrumentation: Instrumentation = None
             ):
         """
         This method creates a new experiment object.
+
+        Pass an enabled Instrumentation object to record the time and memory spent in each stage of the workflow.
+        Passing the same object to the ExperimentDataFrame records its validation as well.
         """
 
+        if instrumentation is None:
+            instrumentation = getattr(experiment_df, 'instrumentation', None) or Instrumentation()
+        self.instrumentation = instrumentation
+
         self.experiment_name = experiment_name
         self.start = start
         self.end = end
@@ -103,10 +502,57 @@ class Experiment:
             pinfo('you initialised the experiment, but there is no data to analyse yet. '
                   'See the .read_out() method.', color='warning')
 
+    @classmethod
+    def from_summaries(
+            cls,
+            experiment_name: str,
+            start: str,
+            end: str,
+            expected_delta: float,
+            roll_out_percent: float,
+            summaries: list,
+            instrumentation: Instrumentation = None
+            ):
+        """
+        Experiment on the merged summaries of shards of the data (see ExperimentDataFrame.summarise), which supports
+        the group balance check, parametric compare(), mde(), required_n() and actual_power().
+        """
+        summaries = [summaries] if isinstance(summaries, ExperimentSummary) else summaries
+
+        return cls(
+            experiment_name, start, end, expected_delta, roll_out_percent,
+            experiment_df=ExperimentSummary.combine(summaries),
+            instrumentation=instrumentation
+            )
+
+    @classmethod
+    def from_sql(
+            cls,
+            experiment_name: str,
+            start: str,
+            end: str,
+            expected_delta: float,
+            roll_out_percent: float,
+            connection,
+            table: str,
+            schema: ExperimentSchema,
+            metrics: list = None,
+            where: str = None,
+            instrumentation: Instrumentation = None
+            ):
+        """
+        Experiment on a table in a database (any DB-API connection), whose sufficient statistics are aggregated by the
+        database, so that no rows are fetched (see dexter.sql). Supports the same analyses as from_summaries.
+        """
+        return cls.from_summaries(
+            experiment_name, start, end, expected_delta, roll_out_percent,
+            summaries=summarise_sql(connection, table, schema, metrics=metrics, where=where),
+            instrumentation=instrumentation
+            )
+
     @property
     def groups(self):
-        data = self.data
-        return sort(data[data.treatment].unique())
+        return self.data.group_sizes().index.to_numpy()
 
     @property
     def n_groups(self):
@@ -116,7 +562,30 @@ class Experiment:
     def sample_size(self):
         return self.data.shape[0]
 
-    def mde(self, metrics=None, alpha=.05, beta=1 - .8, alternative='two-sided'):
+    def _summary_arguments(self, metrics, clustered=False):
+        """
+        Means, variances and sizes of the control and the smallest variant from group summaries: of an
+        ExperimentSummary, or per unit for repeated experiment units (clustered=True).
+        """
+        data = self.data
+        if clustered:
+            summary = cluster_summary(data.data, data.treatment, data.experiment_unit, metrics)
+        else:
+            summary = data.group_summary(metrics)
+
+        smallest = summary.n[1:].min(axis=1).argmin() + 1
+
+        return [
+            {
+                'xmean': summary.mean[0, i], 'ymean': summary.mean[smallest, i],
+                'xvar': summary.var[0, i], 'yvar': summary.var[smallest, i],
+                'xn': summary.n[0, i], 'yn': summary.n[smallest, i]
+                }
+            for i in range(len(metrics))
+            ]
+
+    @instrumented('mde')
+    def mde(self, metrics=None, alpha=.05, beta=1 - .8, alternative='two-sided', clustered=False):
         """
         Minimum detectable effect given observed sample sizes, variances, and provided type I and type II levels.
 
@@ -126,6 +595,9 @@ class Experiment:
         And so, post-hoc power analysis may reinforce the mistaken belief that the obtained p-value adheres to the
         overall set levels of type I error.
 
+        With clustered=True, repeated rows per experiment unit are analysed with the units as clusters (see
+        dexter.utils.cluster_summary), and the sizes are numbers of units.
+
         :return:
         minimum detectable effect: list[tuple(metric, mde)]
         """
@@ -135,19 +607,36 @@ class Experiment:
         metrics = default_metrics(self) + data.learning_metrics if metrics is None else metrics
         metrics = [metrics] if not isinstance(metrics, list) else metrics
 
-        _tmp = data.value_counts(treatment).sort_index()
-        control_idx = 0
-        smallest_n_testgroup_idx = _tmp[1:].argmin() + 1
+        if clustered or isinstance(data, ExperimentSummary):
+            arguments = self._summary_arguments(metrics, clustered)
+
+            types = {} if clustered else data.metric_types(metrics)
+            for args, metric in zip(arguments, metrics):
+                if types.get(metric) == 'binary':
+                    # variance of a proportion under the null hypothesis: the control proportion in both groups
+                    args['xvar'] = args['yvar'] = args['xmean'] * (1 - args['xmean'])
 
-        count_df = _tmp.iloc[[control_idx, smallest_n_testgroup_idx]].rename('var')
+            arguments = [{key: args[key] for key in ('xvar', 'yvar', 'xn', 'yn')} for args in arguments]
+        else:
+            _tmp = data.value_counts(treatment).sort_index()
+            control_idx = 0
+            smallest_n_testgroup_idx = _tmp[1:].argmin() + 1
+
+            count_df = _tmp.iloc[[control_idx, smallest_n_testgroup_idx]].rename('var')
+
+            stats_df = data.groupby(treatment)[metrics].agg(['var']).transpose()
 
-        stats_df = data.groupby(treatment)[metrics].agg(['var']).transpose()
+            stats_df.columns = ['xvar', 'yvar']
 
-        stats_df.columns = ['xvar', 'yvar']
+            binary = [metric_type(data[metric]) == 'binary' for metric in metrics]
+            if any(binary):
+                # variance of a proportion under the null hypothesis: the control proportion in both groups
+                p_control = data.loc[data[treatment] == _tmp.index[control_idx], metrics].mean().to_numpy()
+                stats_df.loc[binary, 'xvar'] = stats_df.loc[binary, 'yvar'] = (p_control * (1 - p_control))[binary]
 
-        stats_df[['xn', 'yn']] = count_df
+            stats_df[['xn', 'yn']] = count_df
 
-        arguments = stats_df.to_dict(orient='records')
+            arguments = stats_df.to_dict(orient='records')
 
         min_det_effect = namedtuple('mde', ['metric', 'mde'])
 
@@ -158,7 +647,8 @@ class Experiment:
 
         return results
 
-    def required_n(self, metrics=None, alpha=.05, beta=1 - .8, alternative='two-sided'):
+    @instrumented('required_n')
+    def required_n(self, metrics=None, alpha=.05, beta=1 - .8, alternative='two-sided', clustered=False):
         """
         Minimum detectable effect given observed sample sizes, variances, and provided type I and type II levels.
 
@@ -168,6 +658,9 @@ class Experiment:
         And so, post-hoc power analysis may reinforce the mistaken belief that the obtained p-value adheres to the
         overall set levels of type I error.
 
+        With clustered=True, repeated rows per experiment unit are analysed with the units as clusters (see
+        dexter.utils.cluster_summary), and the sizes are numbers of units.
+
         :return:
         minimum detectable effect: list[tuple(metric, mde)]
         """
@@ -177,13 +670,29 @@ class Experiment:
         metrics = default_metrics(self) + data.learning_metrics if metrics is None else metrics
         metrics = [metrics] if not isinstance(metrics, list) else metrics
 
-        stats_df = data.groupby(treatment)[metrics].agg([mean, 'var']).transpose()
+        if clustered or isinstance(data, ExperimentSummary):
+            arguments = self._summary_arguments(metrics, clustered)
+
+            types = {} if clustered else data.metric_types(metrics)
+            for args, metric in zip(arguments, metrics):
+                if types.get(metric) == 'binary':
+                    args['xvar'] = args['xmean'] * (1 - args['xmean'])
+                    args['yvar'] = args['ymean'] * (1 - args['ymean'])
+
+            arguments = [{key: args[key] for key in ('xmean', 'ymean', 'xvar', 'yvar')} for args in arguments]
+        else:
+            stats_df = data.groupby(treatment)[metrics].agg([mean, 'var']).transpose()
+
+            stats_df = stats_df.unstack()
 
-        stats_df = stats_df.unstack()
+            stats_df.columns = ['xmean', 'xvar', 'ymean', 'yvar']
 
-        stats_df.columns = ['xmean', 'xvar', 'ymean', 'yvar']
+            binary = [metric_type(data[metric]) == 'binary' for metric in metrics]
+            if any(binary):
+                stats_df.loc[binary, 'xvar'] = stats_df.loc[binary, 'xmean'] * (1 - stats_df.loc[binary, 'xmean'])
+                stats_df.loc[binary, 'yvar'] = stats_df.loc[binary, 'ymean'] * (1 - stats_df.loc[binary, 'ymean'])
 
-        arguments = stats_df.to_dict(orient='records')
+            arguments = stats_df.to_dict(orient='records')
 
         sample_size = namedtuple('sample_size', ['metric', 'n'])
 
@@ -198,6 +707,7 @@ class Experiment:
 
         return results
 
+    @instrumented('actual_power')
     def actual_power(self, metrics=None, alpha=.05, alternative='two-sided'):
         """
         Minimum detectable effect given observed sample sizes, variances, and provided type I and type II levels.
@@ -217,7 +727,10 @@ class Experiment:
         metrics = default_metrics(self) + data.learning_metrics if metrics is None else metrics
         metrics = [metrics] if not isinstance(metrics, list) else metrics
 
-        arguments_df = prep_actual_power(data=data, treatment_col=treatment, metrics=metrics)
+        if isinstance(data, ExperimentSummary):
+            arguments_df = pairwise_moments(data.group_summary(metrics))
+        else:
+            arguments_df = prep_actual_power(data=data, treatment_col=treatment, metrics=metrics)
 
         arguments_df['power'] = arguments_df.apply(
             lambda row:
@@ -233,6 +746,174 @@ class Experiment:
 
         return arguments_df
 
+    @instrumented('simulate_aa')
+    def simulate_aa(self, metrics=None, n_simulations=1000, alpha=.05, equal_var=False, alternative='two-sided',
+                    seed=None):
+        """
+        Validates the false-positive rate of the metrics with A/A simulations on the experiment data: the units are
+        randomly re-assigned with the expected proportions n_simulations times, and every variant is t-tested against
+        the control. All simulations are computed in batches of matrix products, without constructing experiments.
+
+        :return:
+        AASimulation(report: DataFrame, p_values: ndarray of shape (n_simulations, variants, metrics))
+        """
+
+        data = self.data
+        metrics = default_metrics(self) + data.learning_metrics if metrics is None else metrics
+        metrics = [metrics] if not isinstance(metrics, list) else metrics
+
+        values = data[metrics].dropna().to_numpy(dtype=float)
+
+        return simulate_aa(
+            values,
+            metrics=metrics,
+            proportions=data.expected_proportions,
+            n_simulations=n_simulations,
+            alpha=alpha,
+            equal_var=equal_var,
+            alternative=alternative,
+            seed=seed
+            )
+
+    @instrumented('simulate_power')
+    def simulate_power(self, metric, lifts, sample_sizes=None, lift_type='multiplicative', test='ttest',
+                       n_simulations=1000, alpha=.05, alternative='two-sided', permutations=1000, seed=None):
+        """
+        Simulation-based power for metrics that are far from normal (e.g. skewed revenue), as an alternative to the
+        normal approximations of mde(), required_n() and actual_power(). The control group is resampled to generate
+        both groups of each simulated experiment, and the lift is injected in the treatment group.
+
+        By default, the power is simulated at the observed size of the control group.
+
+        :return:
+        power curves: DataFrame with a row per sample size and lift
+        """
+
+        data = self.data
+        control = data.loc[data[data.treatment] == self.groups[0], metric]
+
+        sample_sizes = [len(control)] if sample_sizes is None else sample_sizes
+
+        power = simulate_power(
+            control.to_numpy(dtype=float),
+            lifts=lifts,
+            sample_sizes=sample_sizes,
+            lift_type=lift_type,
+            test=test,
+            n_simulations=n_simulations,
+            alpha=alpha,
+            alternative=alternative,
+            permutations=permutations,
+            seed=seed
+            )
+        power.insert(0, 'metric', metric)
+
+        return power
+
+    @instrumented('plan_duration')
+    def plan_duration(self, traffic, unit_col=None, date_col=None, metrics=None, allocations=None, lift=None,
+                      lift_type='relative', alpha=.05, beta=1 - .8, alternative='two-sided', freq='D', max_days=365):
+        """
+        Forecasts how long the experiment has to run until every variant reaches the requested power, for every metric
+        and allocation, from the unique units in historical traffic (see dexter.planning). The experiment gets
+        roll_out_percent of the units, split by the allocation, and the metric means and variances are those of the
+        control group in the data.
+
+        :param traffic: historical exposures, with a unit and a date column (by default, those of the data roles)
+        :param allocations: proportions per group, one list per allocation; by default the expected proportions
+        :param lift: expected lift, by default expected_delta (relative, 0.05 is +5%)
+
+        :return:
+        DataFrame with a row per metric, allocation and variant, with the required units and periods and the end date
+        """
+        data = self.data
+        metrics = default_metrics(self) + data.learning_metrics if metrics is None else metrics
+        metrics = [metrics] if not isinstance(metrics, list) else metrics
+        unit_col = data.experiment_unit if unit_col is None else unit_col
+        date_col = data.timestamp if date_col is None else date_col
+        allocations = [data.expected_proportions] if allocations is None else allocations
+        lift = self.expected_delta if lift is None else lift
+
+        if date_col is None:
+            raise ValueError('date_col is needed to forecast the duration, as the data has no timestamp column.')
+
+        if any(len(allocation) != self.n_groups for allocation in allocations):
+            raise ValueError(f'every allocation should have a proportion for each of the {self.n_groups} groups.')
+
+        summary = data.group_summary(metrics)
+        types = data.metric_types(metrics)
+
+        required, days = days_to_power(
+            unique_unit_curve(traffic[unit_col], traffic[date_col], freq=freq),
+            mean=summary.mean[0],
+            var=summary.var[0],
+            allocations=allocations,
+            roll_out_percent=self.roll_out_percent,
+            lift=lift,
+            lift_type=lift_type,
+            binary=[types[metric] == 'binary' for metric in metrics],
+            alpha=alpha,
+            beta=beta,
+            alternative=alternative,
+            max_days=max_days
+            )
+
+        m, a, g = np.meshgrid(np.arange(len(metrics)), np.arange(len(allocations)), np.arange(1, self.n_groups),
+                              indexing='ij')
+        res = pandas.DataFrame({
+            'metric': np.asarray(metrics)[m.ravel()],
+            'allocation': [str(list(allocations[i])) for i in a.ravel()],
+            'A': summary.groups[0],
+            'B': summary.groups[g.ravel()],
+            'required n': required.ravel(),
+            'periods': days.ravel()
+            })
+
+        start = pandas.Period(self.start, freq=freq)
+        res['end'] = [None if np.isnan(d) else str(start + int(d) - 1) for d in res['periods']]
+
+        return res
+
+    @instrumented('robustness_sweep')
+    def robustness_sweep(self, metrics=None, caps=(None, .99, .999), handling=('trim', 'winsorize'),
+                         transforms=('raw', 'log'), tests=('welch', 'mannwhitney'), alpha=.05, alternative='two-sided',
+                         log_offset=1., executor='thread', max_workers=None):
+        """
+        Checks whether the results survive other analysis choices: every combination of outlier cap (quantile of the
+        pooled values), trimming or winsorizing, raw or log values and test is evaluated on the current data, without
+        changing it (see dexter.sweep).
+
+        :return:
+        specification curve: DataFrame with a row per metric, variant and combination of choices
+        """
+        data = self.data
+        metrics = default_metrics(self) + data.learning_metrics if metrics is None else metrics
+        metrics = [metrics] if not isinstance(metrics, list) else metrics
+
+        return robustness_sweep(
+            data.data,
+            treatment_col=data.treatment,
+            metrics=metrics,
+            caps=caps,
+            handling=handling,
+            transforms=transforms,
+            tests=tests,
+            alpha=alpha,
+            alternative=alternative,
+            log_offset=log_offset,
+            executor=executor,
+            max_workers=max_workers
+            )
+
+    def pipeline(self, executor='thread', max_workers=None, default=True, **kwargs):
+        """
+        Workflow of stages that runs independent checks and per-metric analyses concurrently. By default, the pipeline
+        holds the standard checks and comparisons (see dexter.pipeline.default_pipeline, which takes the kwargs), and
+        further stages can be added with Pipeline.add(). Run it with Pipeline.run().
+        """
+        if default:
+            return default_pipeline(self, executor=executor, max_workers=max_workers, **kwargs)
+        return Pipeline(self, executor=executor, max_workers=max_workers)
 
     def read_out(self, data: ExperimentDataFrame):
         self.data = data
@@ -241,31 +922,21 @@ class Experiment:
         self.visualiser = ExperimentVisualiser(self)
         pinfo('experiment dataframe has been read.', color='okgreen')
 
-    #  todo: re-write describe_data() so that it does not make a copy of the original data
+    @instrumented('describe_data')
     def describe_data(self, by: str = None, q: int = 3):
 
-        df = self.data.data.copy()
-
-        high_cardinality = df[by].nunique() > 7
-
-        if by is not None:
-            if high_cardinality:
-                df['stratum'] = pandas.qcut(df[by], q, precision=3)
-                df.drop([by], inplace=True, axis=1)
-
-            df.rename({by: 'stratum'}, axis=1, inplace=True)
+        if by is None:
+            pretty_results(self.data.describe())
+            return
 
-            strata = sort(df['stratum'].reset_index(drop=True).unique())
+        strata = stratify(self.data[by], q)
 
-            for stratum in strata:
-                title = f'{by}: {stratum}'
-                frame = '\n' + '=' * (len(title) + 1) + '\n'
-                print(
-                    frame,
-                    title,
-                    frame
-                    )
-                mask = df['stratum'] == stratum
-                pretty_results(self.data.loc[mask].describe())
-        else:
-            pretty_results(self.data.describe())
+        for stratum, frame in self.data.data.groupby(strata, observed=True, sort=True):
+            title = f'{by}: {stratum}'
+            line = '\n' + '=' * (len(title) + 1) + '\n'
+            echo(
+                line,
+                title,
+                line
+                )
+            pretty_results(frame.describe())
@@ -0,0 +1,265 @@
+import functools
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+
+import pandas
+
+StageRecord = namedtuple(
+    'StageRecord',
+    ['stage', 'component', 'metric', 'wall_time', 'cpu_time', 'peak_memory', 'frame_copies', 'depth']
+    )
+
+
+class _CopyCounter:
+    """
+    Counts DataFrames that pandas derives from another DataFrame (copies, filtered frames, column selections) by
+    temporarily wrapping DataFrame.__finalize__, which pandas calls on every frame it builds from an existing one.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self._users = 0
+        self._original = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self._start()
+
+    def stop(self):
+        with self._lock:
+            self._stop()
+
+    def _start(self):
+        if self._users == 0:
+            self._original = pandas.DataFrame.__finalize__
+            original = self._original
+            counter = self
+
+            @functools.wraps(original)
+            def __finalize__(frame, other, method=None, **kwargs):
+                if isinstance(other, pandas.DataFrame):
+                    counter.count += 1
+                return original(frame, other, method=method, **kwargs)
+
+            pandas.DataFrame.__finalize__ = __finalize__
+        self._users += 1
+
+    def _stop(self):
+        self._users -= 1
+        if self._users == 0:
+            pandas.DataFrame.__finalize__ = self._original
+            self._original = None
+
+
+_copy_counter = _CopyCounter()
+
+
+class Instrumentation:
+    """
+    Records wall time, CPU time, peak memory and DataFrame copies for every instrumented stage of an experiment
+    workflow. Stages can be nested (e.g. a per-metric t-test inside compare), in which case the outer stage includes
+    the cost of the inner ones.
+
+    Instrumentation is disabled by default, so that instrumented methods only pay for an attribute lookup. Hooks are
+    callables that receive every StageRecord as soon as the stage finishes.
+
+    Note: memory is traced with tracemalloc and copies are counted by patching pandas globally, so the figures of
+    stages that run concurrently in several threads are not separable.
+    """
+
+    def __init__(self, enabled=False, track_memory=True, track_copies=True):
+        self.enabled = enabled
+        self.track_memory = track_memory
+        self.track_copies = track_copies
+        self.records = []
+        self._hooks = []
+        self._local = threading.local()
+
+    @property
+    def _stack(self):
+        # stages are nested per thread, so that concurrently running stages do not become each other's parents
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def __getstate__(self):
+        # copies in worker processes record for themselves, without the (possibly unpicklable) hooks
+        state = self.__dict__.copy()
+        del state['_local']
+        state['_hooks'] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def enable(self, track_memory=None, track_copies=None):
+        self.enabled = True
+        self.track_memory = self.track_memory if track_memory is None else track_memory
+        self.track_copies = self.track_copies if track_copies is None else track_copies
+
+    def disable(self):
+        self.enabled = False
+
+    def register_hook(self, hook):
+        if not callable(hook):
+            raise ValueError('hook has to be a callable that takes a single StageRecord argument.')
+        self._hooks.append(hook)
+        return hook
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def clear(self):
+        self.records = []
+
+    @contextmanager
+    def stage(self, name, component=None, metric=None):
+        if not self.enabled:
+            yield
+            return
+
+        frame = self._enter()
+        try:
+            yield
+        finally:
+            record = self._exit(frame, name, component, metric)
+            self.records.append(record)
+            for hook in self._hooks:
+                hook(record)
+
+    def _enter(self):
+        frame = {'peak': 0, 'memory_start': 0, 'copies_start': 0, 'owns_tracing': False}
+
+        if self.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                frame['owns_tracing'] = True
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent['peak'] = max(parent['peak'], peak - parent['memory_start'])
+            tracemalloc.reset_peak()
+            frame['memory_start'] = current
+
+        if self.track_copies:
+            _copy_counter.start()
+            frame['copies_start'] = _copy_counter.count
+
+        frame['wall_start'] = time.perf_counter()
+        frame['cpu_start'] = time.process_time()
+        self._stack.append(frame)
+
+        return frame
+
+    def _exit(self, frame, name, component, metric):
+        wall_time = time.perf_counter() - frame['wall_start']
+        cpu_time = time.process_time() - frame['cpu_start']
+        self._stack.pop()
+
+        peak_memory = None
+        if self.track_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            peak_memory = max(frame['peak'], peak - frame['memory_start'])
+            if self._stack:
+                parent = self._stack[-1]
+                parent['peak'] = max(parent['peak'], peak - parent['memory_start'])
+            if frame['owns_tracing']:
+                tracemalloc.stop()
+            else:
+                tracemalloc.reset_peak()
+
+        frame_copies = None
+        if self.track_copies:
+            frame_copies = _copy_counter.count - frame['copies_start']
+            _copy_counter.stop()
+
+        return StageRecord(
+            stage=name,
+            component=component,
+            metric=metric,
+            wall_time=wall_time,
+            cpu_time=cpu_time,
+            peak_memory=peak_memory,
+            frame_copies=frame_copies,
+            depth=len(self._stack)
+            )
+
+    def to_frame(self):
+        return pandas.DataFrame(self.records, columns=StageRecord._fields)
+
+    def summary(self, by=('component', 'stage')):
+        """
+        Aggregates the records per stage (and component), sorted by total wall time, to spot the hot paths.
+        """
+        df = self.to_frame()
+        by = list(by)
+
+        summary = df.groupby(by, dropna=False).agg(
+            calls=('wall_time', 'size'),
+            wall_time=('wall_time', 'sum'),
+            cpu_time=('cpu_time', 'sum'),
+            peak_memory=('peak_memory', 'max'),
+            frame_copies=('frame_copies', 'sum')
+            )
+
+        return summary.sort_values('wall_time', ascending=False)
+
+    def export(self, path):
+        """
+        Writes the records to disk. The format follows the extension of the path: .csv, .json or .jsonl.
+        """
+        df = self.to_frame()
+        path = str(path)
+
+        if path.endswith('.csv'):
+            df.to_csv(path, index=False)
+        elif path.endswith('.jsonl'):
+            df.to_json(path, orient='records', lines=True)
+        elif path.endswith('.json'):
+            df.to_json(path, orient='records')
+        else:
+            raise ValueError('path should have one of the following extensions: .csv, .json, .jsonl.')
+
+
+def get_instrumentation(obj):
+    """Finds the Instrumentation that applies to an experiment, its data or one of its components."""
+    for owner in (obj, getattr(obj, '_experiment', None), getattr(obj, 'experiment', None)):
+        instrumentation = getattr(owner, 'instrumentation', None) if owner is not None else None
+        if isinstance(instrumentation, Instrumentation):
+            return instrumentation
+    return None
+
+
+@contextmanager
+def measure(obj, stage, metric=None):
+    instrumentation = get_instrumentation(obj)
+
+    if instrumentation is None or not instrumentation.enabled:
+        yield
+        return
+
+    with instrumentation.stage(stage, component=type(obj).__name__, metric=metric):
+        yield
+
+
+def instrumented(stage, per_metric=False):
+    """
+    Decorates a method of an experiment component so that its calls are recorded as the given stage. With
+    per_metric=True, the first argument of the method is recorded as the metric.
+    """
+
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            metric = (args[0] if args else kwargs.get('metric')) if per_metric else None
+            with measure(self, stage, metric=metric):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,215 @@
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from scipy.stats import chi2, norm
+
+from dexter.stats_func import chisquare_from_counts, padjust
+from dexter.utils import pretty_results
+
+
+def unit_keys(units):
+    """
+    Sortable integer keys of experiment units: integer units are their own key, other units (e.g. strings) are
+    hashed to 64 bits. Experiments can only be joined on units of the same type.
+    """
+    units = np.asarray(units)
+    if np.issubdtype(units.dtype, np.integer):
+        return units.astype(np.int64)
+    return pd.util.hash_array(units.astype(str).astype(object))
+
+
+class UnitAssignments:
+    """
+    The assignment of every unit of an experiment, as a sorted array of unit keys and the group code of each unit.
+    Units that appear in more than one group (crossovers) get code -1 and are left out of the overlap analyses.
+    Metrics are averaged per unit with the same index.
+    """
+
+    def __init__(self, experiment):
+        data = experiment.data
+        self.name = experiment.experiment_name
+        self.groups = experiment.groups
+        self.expected_proportions = data.expected_proportions
+        self.frame = data.data
+        self.unit = data.experiment_unit
+        self.treatment = data.treatment
+
+        self.keys, self._rows = np.unique(unit_keys(self.frame[self.unit].to_numpy()), return_inverse=True)
+        codes = np.searchsorted(self.groups, self.frame[self.treatment].to_numpy()).astype(float)
+
+        # a unit is in a single group when its codes do not vary
+        rows = np.bincount(self._rows, minlength=len(self.keys))
+        mean = np.bincount(self._rows, weights=codes, minlength=len(self.keys)) / rows
+        squares = np.bincount(self._rows, weights=codes ** 2, minlength=len(self.keys)) / rows
+        self.codes = np.where(squares - mean ** 2 > 0, -1, mean).astype(np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def crossovers(self):
+        return int(np.sum(self.codes < 0))
+
+    def unit_means(self, metric):
+        """The mean of a metric per unit, NaN for units without a value."""
+        values = self.frame[metric].to_numpy(dtype=float)
+        observed = ~np.isnan(values)
+        n = np.bincount(self._rows[observed], minlength=len(self.keys))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.bincount(self._rows[observed], weights=values[observed], minlength=len(self.keys)) / n
+
+
+def join(a, b):
+    """
+    The units of two experiments that are in both, from a merge of the sorted unit keys, without crossovers.
+
+    :return:
+    positions of the shared units in a and in b
+    """
+    _, in_a, in_b = np.intersect1d(a.keys, b.keys, assume_unique=True, return_indices=True)
+    clean = (a.codes[in_a] >= 0) & (b.codes[in_b] >= 0)
+    return in_a[clean], in_b[clean]
+
+
+def assignment_independence(codes_a, codes_b, k_a, k_b):
+    """
+    Chi-square test of independence of the assignments of two experiments on their shared units, from the
+    contingency table of the group codes.
+
+    :return:
+    contingency table (k_a x k_b), chi-square statistic, dof and p-value
+    """
+    table = np.bincount(codes_a * k_b + codes_b, minlength=k_a * k_b).reshape(k_a, k_b).astype(float)
+    expected = table.sum(axis=1, keepdims=True) * table.sum(axis=0, keepdims=True) / table.sum()
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stat = np.nansum((table - expected) ** 2 / expected)
+
+    dof = (k_a - 1) * (k_b - 1)
+
+    return table, stat, dof, chi2.sf(stat, dof)
+
+
+def interaction_contrasts(values, codes_a, codes_b, k_a, k_b):
+    """
+    Interaction effects of two experiments on a metric: for every variant i of A and j of B, the difference between
+    the effect of i in variant j of B and in the control of B, (m_ij - m_i0) - (m_0j - m_00). The cell means and
+    variances come from sums per cell, with z-tests on the sum of the four squared standard errors.
+
+    :return:
+    DataFrame with a row per pair of variants
+    """
+    observed = ~np.isnan(values)
+    cells = (codes_a * k_b + codes_b)[observed]
+    # centering keeps the sums-of-squares variance numerically stable
+    values = values[observed] - values[observed].mean()
+
+    n = np.bincount(cells, minlength=k_a * k_b).astype(float)
+    sums = np.bincount(cells, weights=values, minlength=k_a * k_b)
+    squares = np.bincount(cells, weights=values ** 2, minlength=k_a * k_b)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = (sums / n).reshape(k_a, k_b)
+        var = ((squares - sums ** 2 / n) / (n - 1)).reshape(k_a, k_b)
+        sq_err = var / n.reshape(k_a, k_b)
+
+    i, j = (x.ravel() for x in np.meshgrid(np.arange(1, k_a), np.arange(1, k_b), indexing='ij'))
+    interaction = (mean[i, j] - mean[i, 0]) - (mean[0, j] - mean[0, 0])
+    se = np.sqrt(sq_err[i, j] + sq_err[i, 0] + sq_err[0, j] + sq_err[0, 0])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = interaction / se
+
+    return pd.DataFrame({
+        'variant A': i,
+        'variant B': j,
+        'n': n.reshape(k_a, k_b)[i, j],
+        'interaction': interaction,
+        'stderr': se,
+        'z-stat': z,
+        'p-value': 2 * norm.sf(np.abs(z))
+        })
+
+
+def overlap_analysis(experiments, metrics=None, padjust_method='none', verbose=True):
+    """
+    Checks experiments that run on the same units at the same time (sharing experiment_unit) for interference: for
+    every pair of experiments, the size of the overlap, the independence of the assignments on the overlap (a sample
+    ratio mismatch of one experiment within the groups of the other) and the interaction effects on the metrics.
+
+    The assignments are joined on sorted unit keys, without a cross-join, so that tens of millions of units fit in
+    memory. Metrics are averaged per unit; a metric is taken from the first experiment of the pair that has it.
+
+    :return:
+    dict with the DataFrames 'overlap', 'independence' and 'interactions'
+    """
+    assignments = [UnitAssignments(experiment) for experiment in experiments]
+
+    if len(assignments) < 2:
+        raise ValueError('at least two experiments are needed to analyse their overlap.')
+
+    overlap, independence, interactions = [], [], []
+    for a, b in combinations(assignments, 2):
+        in_a, in_b = join(a, b)
+        codes_a, codes_b = a.codes[in_a], b.codes[in_b]
+        k_a, k_b = len(a.groups), len(b.groups)
+
+        overlap.append({
+            'A': a.name,
+            'B': b.name,
+            'units(A)': len(a),
+            'units(B)': len(b),
+            'overlap': len(in_a),
+            'share(A)': len(in_a) / len(a),
+            'share(B)': len(in_b) / len(b),
+            'crossovers(A)': a.crossovers,
+            'crossovers(B)': b.crossovers
+            })
+
+        if len(in_a) == 0:
+            continue
+
+        table, stat, dof, p = assignment_independence(codes_a, codes_b, k_a, k_b)
+        _, srm_a = chisquare_from_counts(table.sum(axis=1), a.expected_proportions)
+        _, srm_b = chisquare_from_counts(table.sum(axis=0), b.expected_proportions)
+        independence.append({
+            'A': a.name,
+            'B': b.name,
+            'chi2': stat,
+            'dof': dof,
+            'p-value': p,
+            'srm p-value(A)': srm_a,
+            'srm p-value(B)': srm_b
+            })
+
+        if metrics is None:
+            excluded = {a.unit, a.treatment, b.unit, b.treatment}
+            shared = [m for m in a.frame.columns.intersection(b.frame.columns)
+                      if m not in excluded and pd.api.types.is_numeric_dtype(a.frame[m])]
+        else:
+            shared = metrics
+
+        for metric in shared:
+            source, rows = (a, in_a) if metric in a.frame.columns else (b, in_b)
+            res = interaction_contrasts(source.unit_means(metric)[rows], codes_a, codes_b, k_a, k_b)
+            res['variant A'], res['variant B'] = a.groups[res['variant A']], b.groups[res['variant B']]
+            res.insert(0, 'metric', metric)
+            res.insert(1, 'A', a.name)
+            res.insert(3, 'B', b.name)
+            interactions.append(res)
+
+    overlap = pd.DataFrame(overlap)
+    independence = pd.DataFrame(independence)
+    interactions = pd.concat(interactions, ignore_index=True) if interactions else pd.DataFrame()
+    if len(interactions):
+        interactions['p-value (adj)'] = padjust(interactions['p-value'].to_numpy(), padjust_method)
+
+    if verbose:
+        pretty_results(overlap, title='Overlapping experiments', subtitle='Shared units:')
+        pretty_results(independence, subtitle='Independence of the assignments:',
+                       note='Info: a low p-value means that the assignment of one experiment depends on the other.')
+        if len(interactions):
+            pretty_results(interactions, subtitle='Interaction effects:')
+
+    return {'overlap': overlap, 'independence': independence, 'interactions': interactions}
@@ -0,0 +1,283 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from dexter.utils import capture_output, default_metrics
+
+
+class Stage:
+    """
+    A step of an experiment workflow: func(experiment, **kwargs), or func(experiment, metric, **kwargs) for stages
+    that run once per metric.
+
+    mutates: the stage changes the experiment data (e.g. handling outliers), so it runs on its own.
+    exclusive: the stage runs on its own in the main thread, without changing the data (e.g. plotting).
+    collect: optional callable(experiment, result) that runs in the main thread when the stage has finished, to store
+    its result on the experiment (needed for stages that run in another process).
+    """
+
+    def __init__(self, name, func, depends_on=None, mutates=False, exclusive=False, per_metric=False, metrics=None,
+                 collect=None, kwargs=None):
+        if not callable(func):
+            raise ValueError(f'the function of stage {name} has to be a callable.')
+
+        depends_on = [] if depends_on is None else depends_on
+        self.name = name
+        self.func = func
+        self.depends_on = [depends_on] if not isinstance(depends_on, list) else depends_on
+        self.mutates = mutates
+        self.exclusive = exclusive or mutates
+        self.per_metric = per_metric
+        self.metrics = metrics
+        self.collect = collect
+        self.kwargs = {} if kwargs is None else kwargs
+
+
+# the experiment of a worker process, set once when the worker starts
+_worker_experiment = None
+
+
+def _init_worker(experiment):
+    global _worker_experiment
+    _worker_experiment = experiment
+
+
+def _run_captured(func, args, kwargs, experiment=None):
+    """Runs a task and returns its result with everything it printed, by default on the experiment of the worker."""
+    with capture_output() as output:
+        result = func(_worker_experiment if experiment is None else experiment, *args, **kwargs)
+    return result, output.getvalue()
+
+
+class Pipeline:
+    """
+    Declarative experiment workflow that runs independent stages concurrently.
+
+    Every stage sees the data as left by the mutating stages that were added before it, as if the stages ran one by
+    one in the order they were added. On top of that, a stage waits for the stages listed in depends_on. Stages
+    between two mutating stages share the experiment without copies and run concurrently, per metric for per_metric
+    stages; mutating and exclusive stages run alone in the main thread.
+
+    Results are returned per stage (per metric for per_metric stages) in the order in which the stages were added,
+    and the printed output of every stage is replayed in that order as well, so that runs are deterministic. The output
+    is captured per task with dexter.utils.capture_output, without replacing sys.stdout, so custom stages should print
+    with dexter.utils.echo to have their output captured as well.
+
+    executor: 'thread' (NumPy, SciPy and pandas release the GIL in their kernels), 'process' or 'serial'. In a process
+    pool, stages run against a copy of the experiment that is sent to every worker once, when the pool starts (and
+    again after a mutating stage), so their effect on the experiment has to go through their return value and
+    collect.
+    """
+
+    def __init__(self, experiment, executor='thread', max_workers=None):
+        if executor not in ('thread', 'process', 'serial'):
+            raise ValueError(f'executor should be either thread, process or serial. Got {executor} instead.')
+
+        self.experiment = experiment
+        self.executor = executor
+        self.max_workers = max_workers
+        self.stages = {}
+        self.results = {}
+        self.outputs = {}
+
+    def add(self, name, func, depends_on=None, mutates=False, exclusive=False, per_metric=False, metrics=None,
+            collect=None, **kwargs):
+        if name in self.stages:
+            raise ValueError(f'there is already a stage called {name}.')
+
+        self.stages[name] = Stage(name, func, depends_on, mutates, exclusive, per_metric, metrics, collect, kwargs)
+
+        return self
+
+    def _dependencies(self):
+        dependencies = {}
+        last_mutation = None
+        added = []
+
+        for name, stage in self.stages.items():
+            unknown = set(stage.depends_on) - set(self.stages)
+            if unknown:
+                raise ValueError(f'stage {name} depends on unknown stages: {", ".join(sorted(unknown))}.')
+
+            deps = set(stage.depends_on)
+            if stage.exclusive:
+                # every earlier stage has to finish before the data changes
+                deps.update(added)
+            elif last_mutation is not None:
+                deps.add(last_mutation)
+
+            dependencies[name] = deps
+            added.append(name)
+            if stage.exclusive:
+                last_mutation = name
+
+        self._check_cycles(dependencies)
+
+        return dependencies
+
+    @staticmethod
+    def _check_cycles(dependencies):
+        state = {}
+
+        def visit(name, path):
+            if state.get(name) == 'done':
+                return
+            if state.get(name) == 'visiting':
+                raise ValueError(f'the stages have a circular dependency: {" -> ".join(path + [name])}.')
+            state[name] = 'visiting'
+            for dep in dependencies[name]:
+                visit(dep, path + [name])
+            state[name] = 'done'
+
+        for name in dependencies:
+            visit(name, [])
+
+    def _tasks(self, stage):
+        if not stage.per_metric:
+            return [((), None)]
+
+        metrics = stage.metrics
+        if metrics is None:
+            metrics = default_metrics(self.experiment) + self.experiment.data.learning_metrics
+
+        return [((metric,), metric) for metric in metrics]
+
+    def run(self):
+        dependencies = self._dependencies()
+        order = list(self.stages)
+
+        self.results = {}
+        self.outputs = {}
+
+        pending = {name: len(tasks) for name in order for tasks in [self._tasks(self.stages[name])]}
+        task_results = {name: {} for name in order}
+        task_outputs = {name: {} for name in order}
+        finished = set()
+        started = set()
+        printed = 0
+
+        pool = None
+        if self.executor == 'thread':
+            pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        def process_pool():
+            # workers get the experiment once, and a new pool is started when the data has changed
+            nonlocal pool
+            if pool is None:
+                pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                           initargs=(self.experiment,))
+            return pool
+
+        def finish(name):
+            stage = self.stages[name]
+            keys = [key for _, key in self._tasks(stage)]
+            self.results[name] = {key: task_results[name][key] for key in keys} if stage.per_metric \
+                else task_results[name][None]
+            self.outputs[name] = ''.join(task_outputs[name][key] for key in keys)
+            if stage.collect is not None:
+                stage.collect(self.experiment, self.results[name])
+            finished.add(name)
+
+        futures = {}
+        try:
+            while len(finished) < len(order):
+                ready = [name for name in order
+                         if name not in started and dependencies[name] <= finished]
+
+                for name in ready:
+                    stage = self.stages[name]
+
+                    if stage.exclusive or self.executor == 'serial':
+                        if futures:
+                            # exclusive stages wait until nothing else is running
+                            continue
+                        started.add(name)
+                        for args, key in self._tasks(stage):
+                            task_results[name][key], task_outputs[name][key] = \
+                                _run_captured(stage.func, args, stage.kwargs, self.experiment)
+                        finish(name)
+                        if stage.mutates and self.executor == 'process' and pool is not None:
+                            pool.shutdown(wait=True)
+                            pool = None
+                        break
+
+                    started.add(name)
+                    for args, key in self._tasks(stage):
+                        if self.executor == 'process':
+                            future = process_pool().submit(_run_captured, stage.func, args, stage.kwargs)
+                        else:
+                            future = pool.submit(_run_captured, stage.func, args, stage.kwargs, self.experiment)
+                        futures[future] = (name, key)
+
+                if futures:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        name, key = futures.pop(future)
+                        task_results[name][key], task_outputs[name][key] = future.result()
+                        pending[name] -= 1
+                        if pending[name] == 0:
+                            finish(name)
+
+                # replay the output of the finished stages in the order in which they were added
+                while printed < len(order) and order[printed] in finished:
+                    sys.stdout.write(self.outputs[order[printed]])
+                    printed += 1
+        finally:
+            if pool is not None:
+                pool.shutdown(wait=True, cancel_futures=True)
+
+        # in the order in which the stages were added, not in which they finished
+        self.results = {name: self.results[name] for name in order}
+        self.outputs = {name: self.outputs[name] for name in order}
+
+        return self.results
+
+
+def check_groups_balance(experiment):
+    experiment.assumptions.check_groups_balance()
+    return experiment.assumptions.get_log()['group_balance']
+
+
+def check_crossover(experiment):
+    experiment.assumptions.check_crossover()
+    return experiment.assumptions.get_log()['crossover']
+
+
+def handle_crossover(experiment, **kwargs):
+    experiment.assumptions.handle_crossover(**kwargs)
+
+
+def compare_metric(experiment, metric, **kwargs):
+    """Runs compare() for a single metric and returns its results, without touching the analyses log."""
+    analyser = type(experiment.analyser)(experiment)
+    return analyser.compare(metrics=[metric], **kwargs)[metric]
+
+
+def _store_assumption(assumption):
+    def collect(experiment, result):
+        experiment.assumptions.get_log()[assumption] = result
+    return collect
+
+
+def _store_analyses(experiment, results):
+    experiment.analyser.get_log()['analyses'] = results
+
+
+def default_pipeline(experiment, metrics=None, executor='thread', max_workers=None, handle_crossover_kwargs=None,
+                     **compare_kwargs):
+    """
+    The standard workflow: group balance and cross-over checks run concurrently, after which cross-overs can be
+    handled (pass handle_crossover_kwargs, e.g. {'force': True}), and finally every metric is compared concurrently.
+    Further stages (outlier handling, transformations, plots) can be added to the returned pipeline.
+    """
+    pipeline = Pipeline(experiment, executor=executor, max_workers=max_workers)
+
+    pipeline.add('check_groups_balance', check_groups_balance, collect=_store_assumption('group_balance'))
+    pipeline.add('check_crossover', check_crossover, collect=_store_assumption('crossover'))
+
+    if handle_crossover_kwargs is not None:
+        pipeline.add('handle_crossover', handle_crossover, mutates=True, **handle_crossover_kwargs)
+
+    pipeline.add('compare', compare_metric, per_metric=True, metrics=metrics, collect=_store_analyses,
+                 **compare_kwargs)
+
+    return pipeline
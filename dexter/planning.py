@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+
+def unique_unit_curve(units, dates, freq='D'):
+    """
+    Cumulative number of unique units per period (e.g. day) of historical traffic, in which a returning unit only
+    counts on the first period in which it appears. Periods without traffic are kept, so that the curve has a value
+    per period from the first to the last one. Exposures with a missing unit or timestamp are dropped.
+
+    :param units: unit identifier of every exposure (e.g. a visit)
+    :param dates: timestamp of every exposure
+
+    :return:
+    cumulative unique units: ndarray with a value per period
+    """
+    dates = pd.to_datetime(pd.Series(dates).reset_index(drop=True))
+    units = pd.Series(units).reset_index(drop=True)
+
+    # exposures without a timestamp or a unit are not traffic of a known unit in a known period
+    known = dates.notna() & units.notna()
+    if not known.any():
+        raise ValueError('there are no exposures with both a unit and a timestamp.')
+
+    ordinals = dates[known].dt.to_period(freq).array.asi8
+    period = ordinals - ordinals.min()
+    unit_codes, _ = pd.factorize(units[known])
+
+    # the first period of every unit, from a stable sort on the period
+    order = np.argsort(period, kind='stable')
+    _, first_seen = np.unique(unit_codes[order], return_index=True)
+    new_units = np.bincount(period[order][first_seen], minlength=period.max() + 1)
+
+    return np.cumsum(new_units).astype(float)
+
+
+def fit_accumulation(curve):
+    """
+    Power-law fit of the accumulation of unique units over time, U(d) = a * d^b, by least squares on the log-log scale.
+    With returning units, unique units grow sublinearly (b < 1); b = 1 means that every unit is new.
+
+    :return:
+    a, b
+    """
+    curve = np.asarray(curve, dtype=float)
+    days = np.arange(1, len(curve) + 1)
+    observed = curve > 0
+
+    if observed.sum() < 2:
+        raise ValueError('at least two periods with traffic are needed to fit the accumulation of unique units.')
+
+    b, log_a = np.polyfit(np.log(days[observed]), np.log(curve[observed]), deg=1)
+
+    return np.exp(log_a), float(np.clip(b, 0, 1))
+
+
+def project_units(curve, periods):
+    """
+    Cumulative unique units over the given number of periods: the observed curve, extrapolated with the fitted power
+    law beyond the history. The extrapolation starts from the last observed value, so that the projection is
+    continuous.
+    """
+    curve = np.asarray(curve, dtype=float)
+    if periods <= len(curve):
+        return curve[:periods]
+
+    _, b = fit_accumulation(curve)
+    days = np.arange(len(curve) + 1, periods + 1)
+
+    return np.concatenate([curve, curve[-1] * (days / len(curve)) ** b])
+
+
+def days_to_power(curve, mean, var, allocations, roll_out_percent=1., lift=.05, lift_type='relative', binary=None,
+                  alpha=.05, beta=1 - .8, alternative='two-sided', max_days=365):
+    """
+    Number of periods until every variant reaches the requested power against the control (first group), for every
+    metric and allocation at once. The experiment gets roll_out_percent of the projected unique units, which are
+    split over the groups by the allocation.
+
+    With allocation proportions p, the units needed are N = (z_alpha + z_beta)^2 * (var_A / p_A + var_B / p_B) /
+    delta^2, and the duration is the first period at which the projected units in the experiment reach N.
+
+    :param curve: cumulative unique units per period of the historical traffic (see unique_unit_curve)
+    :param mean: control mean per metric
+    :param var: control variance per metric
+    :param allocations: proportions per group, one row per allocation
+    :param lift: relative (0.05 is +5%) for lift_type='relative', absolute for 'absolute'; a value per metric or one
+    :param binary: per metric, whether it is a proportion, whose variance under the alternative follows from the mean
+
+    :return:
+    required units and periods, arrays with shape (metrics, allocations, variants); NaN periods when the power is not
+    reached within max_days
+    """
+    assert alternative in ['two-sided', 'one-sided']
+
+    if lift_type not in ('relative', 'absolute'):
+        raise ValueError(f'lift_type should be either relative or absolute. Got {lift_type} instead.')
+
+    allocations = np.atleast_2d(np.asarray(allocations, dtype=float))
+    if not np.allclose(allocations.sum(axis=1), 1):
+        raise ValueError('The provided proportions should sum up to 1.')
+
+    mean, var = np.asarray(mean, dtype=float)[:, None, None], np.asarray(var, dtype=float)[:, None, None]
+    lift = np.broadcast_to(np.asarray(lift, dtype=float), mean.shape[:1])[:, None, None]
+    binary = np.zeros(mean.shape[0], dtype=bool) if binary is None else np.asarray(binary, dtype=bool)
+
+    treated_mean = mean * (1 + lift) if lift_type == 'relative' else mean + lift
+    treated_var = np.where(binary[:, None, None], treated_mean * (1 - treated_mean), var)
+
+    alpha = alpha / 2 if alternative == 'two-sided' else alpha
+    z = norm.ppf(1 - alpha) + norm.ppf(1 - beta)
+
+    control, variants = allocations[None, :, :1], allocations[None, :, 1:]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        required = z ** 2 * (var / control + treated_var / variants) / (treated_mean - mean) ** 2
+
+    units = roll_out_percent * project_units(curve, max_days)
+    days = np.searchsorted(units, required, side='left') + 1.
+    days[(days > max_days) | ~np.isfinite(required)] = np.nan
+
+    return np.ceil(required), days
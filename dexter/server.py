@@ -0,0 +1,450 @@
+import argparse
+import hmac
+import ipaddress
+import json
+import os
+import socket
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from dexter.experiment import Experiment, ExperimentDataFrame
+from dexter.summary import ExperimentSummary
+from dexter.utils import capture_output
+
+_CHECKS = {
+    'groups_balance': 'group_balance',
+    'srm_over_time': 'group_balance',
+    'crossover': 'crossover'
+    }
+
+_SPEC_ROLES = ('success_metric', 'health_metric', 'learning_metrics', 'experiment_unit', 'treatment',
+               'expected_proportions', 'timestamp')
+
+
+def _jsonable(obj):
+    """Converts results (nested dicts of DataFrames, NumPy values, namedtuples) into plain JSON types."""
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        obj = obj.reset_index() if isinstance(obj, pd.DataFrame) and not isinstance(obj.index, pd.RangeIndex) \
+            else obj
+        return _jsonable(obj.to_dict())
+    if isinstance(obj, dict):
+        return {str(key): _jsonable(value) for key, value in obj.items()}
+    if isinstance(obj, tuple) and hasattr(obj, '_asdict'):
+        return _jsonable(obj._asdict())
+    if isinstance(obj, (list, tuple, set, np.ndarray)):
+        return [_jsonable(value) for value in obj]
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, float) and not np.isfinite(obj):
+        return None
+    if isinstance(obj, (str, int, float, bool)) or obj is None:
+        return obj
+    return str(obj)
+
+
+def _memory(data):
+    if isinstance(data, ExperimentSummary):
+        return sum(value.nbytes for value in vars(data).values() if isinstance(value, np.ndarray))
+    return int(data.data.memory_usage(deep=True).sum())
+
+
+def resolve_path(path, data_dir):
+    """The real path of a data file, which should be inside data_dir (relative paths are relative to data_dir)."""
+    root = os.path.realpath(data_dir)
+    path = os.path.realpath(os.path.join(root, str(path)))
+    if os.path.commonpath([root, path]) != root:
+        raise ValueError(f'the data should be in {root}.')
+    return path
+
+
+def load_experiment(spec):
+    """
+    Builds an experiment from a load specification: its name, start, end, expected_delta, roll_out_percent, the path
+    of the data (.csv or .parquet, or the .json of an ExperimentSummary) and, for data files, the roles of the
+    ExperimentDataFrame (success_metric, health_metric, learning_metrics, experiment_unit, treatment,
+    expected_proportions and optionally timestamp). Pickles are not read, since unpickling runs arbitrary code.
+    """
+    path = str(spec['path'])
+    arguments = [spec['name'], spec['start'], spec['end'], spec['expected_delta'], spec['roll_out_percent']]
+
+    if path.endswith('.json'):
+        with open(path) as f:
+            return Experiment.from_summaries(*arguments, summaries=ExperimentSummary.from_json(f.read()))
+
+    if path.endswith('.csv'):
+        df = pd.read_csv(path)
+    elif path.endswith('.parquet'):
+        df = pd.read_parquet(path)
+    else:
+        raise ValueError('path should have one of the following extensions: .csv, .parquet, .json.')
+
+    exp_df = ExperimentDataFrame(dataframe=df, **{role: spec[role] for role in _SPEC_ROLES if role in spec})
+
+    return Experiment(*arguments, experiment_df=exp_df)
+
+
+class _Entry:
+    def __init__(self, name, experiment=None, spec=None):
+        self.name = name
+        self.experiment = experiment
+        self.spec = spec
+        self.summary = None
+        self.summary_key = None
+        self.memory = 0
+        self.last_used = time.time()
+        self.lock = threading.RLock()
+
+    def measure(self):
+        self.memory = 0 if self.experiment is None else _memory(self.experiment.data)
+        if self.summary is not None:
+            self.memory += _memory(self.summary)
+
+
+class ExperimentRegistry:
+    """
+    Experiments kept in memory by name, each with its own lock, so that requests on different experiments run
+    concurrently and requests on the same experiment one at a time.
+
+    When the data of the loaded experiments takes more than memory_limit bytes, the least recently used experiments
+    that are not in use are evicted. Experiments that were loaded from a specification are reloaded on their next
+    request; experiments that were added as objects are dropped. Names are unique: an experiment has to be removed
+    before another one is registered under its name, so that requests never see it replaced while they use it.
+    """
+
+    def __init__(self, memory_limit=2 ** 30):
+        self.memory_limit = memory_limit
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def add(self, experiment):
+        return self._register(_Entry(experiment.experiment_name, experiment=experiment))
+
+    def load(self, spec):
+        if spec['name'] in self:
+            raise ValueError(f'there is already an experiment called {spec["name"]}. Remove it first.')
+        return self._register(_Entry(spec['name'], experiment=load_experiment(spec), spec=dict(spec)))
+
+    def _register(self, entry):
+        entry.measure()
+        with self._lock:
+            if entry.name in self._entries:
+                raise ValueError(f'there is already an experiment called {entry.name}. Remove it first.')
+            self._entries[entry.name] = entry
+            self._entries.move_to_end(entry.name)
+        self._evict(keep=entry.name)
+        return entry
+
+    def remove(self, name):
+        with self._lock:
+            if self._entries.pop(name, None) is None:
+                raise KeyError(f'there is no experiment called {name}.')
+
+    @contextmanager
+    def use(self, name):
+        """Locks an experiment for a request, loading it again if it was evicted."""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                raise KeyError(f'there is no experiment called {name}.')
+            self._entries.move_to_end(name)
+
+        with entry.lock:
+            if entry.experiment is None:
+                entry.experiment = load_experiment(entry.spec)
+            entry.last_used = time.time()
+            try:
+                yield entry
+            finally:
+                entry.measure()
+
+        self._evict(keep=name)
+
+    def _evict(self, keep=None):
+        with self._lock:
+            for name, entry in list(self._entries.items()):
+                if self.memory <= self.memory_limit:
+                    break
+                if name == keep or entry.experiment is None or not entry.lock.acquire(blocking=False):
+                    continue
+                try:
+                    entry.experiment, entry.summary, entry.memory = None, None, 0
+                    if entry.spec is None:
+                        del self._entries[name]
+                finally:
+                    entry.lock.release()
+
+    @property
+    def memory(self):
+        return sum(entry.memory for entry in self._entries.values())
+
+    def status(self):
+        return [{
+            'name': entry.name,
+            'loaded': entry.experiment is not None,
+            'reloadable': entry.spec is not None,
+            'memory': entry.memory,
+            'last used': entry.last_used
+            } for entry in list(self._entries.values())]
+
+
+def _run_action(entry, action, kwargs):
+    experiment = entry.experiment
+
+    if action == 'compare':
+        result = experiment.analyser.compare(**kwargs)
+    elif action in ('mde', 'required_n'):
+        result = {res.metric: res[1] for res in getattr(experiment, action)(**kwargs)}
+    elif action == 'actual_power':
+        result = experiment.actual_power(**kwargs)
+    elif action == 'check':
+        assumption = kwargs.pop('assumption', None)
+        if assumption not in _CHECKS:
+            raise ValueError(f'assumption should be one of {", ".join(_CHECKS)}. Got {assumption} instead.')
+        getattr(experiment.assumptions, f'check_{assumption}')(**kwargs)
+        result = experiment.assumptions.get_log()[_CHECKS[assumption]]
+    elif action == 'summary':
+        # the summary is kept until the data changes (e.g. when handling cross-overs) or other arguments are given
+        key = (getattr(experiment.data, 'revision', None), repr(sorted(kwargs.items())))
+        if entry.summary is None or entry.summary_key != key:
+            entry.summary = experiment.data if isinstance(experiment.data, ExperimentSummary) \
+                else experiment.data.summarise(**kwargs)
+            entry.summary_key = key
+        return entry.summary.to_dict()
+    else:
+        raise ValueError(f'unknown action {action}.')
+
+    return result
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = 'Dexter'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        content = json.dumps(_jsonable(body)).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _authorised(self):
+        token = self.server.token
+        if token is None:
+            return True
+        given = self.headers.get('Authorization', '')
+        return hmac.compare_digest(given.encode(), f'Bearer {token}'.encode())
+
+    def _handle(self, method):
+        registry = self.server.registry
+
+        if not self._authorised():
+            return self._reply(401, {'error': 'a valid token is required.'})
+        parts = [part for part in self.path.split('?')[0].split('/') if part]
+
+        if not parts or parts[0] != 'experiments' or len(parts) > 3:
+            return self._reply(404, {'error': f'unknown path {self.path}.'})
+
+        try:
+            if len(parts) == 1 and method == 'GET':
+                return self._reply(200, {'experiments': registry.status()})
+
+            if len(parts) == 1 and method == 'POST':
+                if self.server.data_dir is None:
+                    return self._reply(403, {'error': 'loading data is disabled. Start the server with a data_dir.'})
+                spec = self._body()
+                spec['path'] = resolve_path(spec['path'], self.server.data_dir)
+                entry = registry.load(spec)
+                return self._reply(201, {'name': entry.name, 'memory': entry.memory})
+
+            if len(parts) == 1:
+                return self._reply(405, {'error': f'{method} is not supported on {self.path}.'})
+
+            name = urllib.request.unquote(parts[1])
+            if name not in registry:
+                return self._reply(404, {'error': f'there is no experiment called {name}.'})
+
+            if len(parts) == 2 and method == 'DELETE':
+                registry.remove(name)
+                return self._reply(200, {'name': name})
+
+            if len(parts) == 3 and method == 'POST':
+                kwargs = self._body()
+                # what is printed in the request thread goes to the reply of the request
+                with registry.use(name) as entry, capture_output() as output:
+                    result = _run_action(entry, parts[2], kwargs)
+                return self._reply(200, {'result': result, 'output': output.getvalue()})
+
+            return self._reply(405, {'error': f'{method} is not supported on {self.path}.'})
+        except (ValueError, AttributeError, KeyError, TypeError, AssertionError) as e:
+            return self._reply(400, {'error': f'{type(e).__name__}: {e}'})
+        except Exception as e:
+            return self._reply(500, {'error': f'{type(e).__name__}: {e}'})
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+
+def _loopback(host):
+    try:
+        return all(ipaddress.ip_address(info[4][0]).is_loopback for info in socket.getaddrinfo(host, None))
+    except (socket.gaierror, ValueError):
+        return False
+
+
+class ExperimentServer(ThreadingHTTPServer):
+    """
+    Long-running local server that keeps experiments, their data and cached summaries in memory, so that analyses
+    skip importing Dexter, reading the data and building the experiment. Requests are handled concurrently, one
+    thread per request, and answered in JSON:
+
+    GET /experiments: the experiments and their memory use
+    POST /experiments: loads an experiment from a specification (see load_experiment)
+    DELETE /experiments/<name>: drops an experiment
+    POST /experiments/<name>/<action>: runs compare, mde, required_n, actual_power, check (with an assumption:
+    groups_balance, srm_over_time or crossover) or summary, with the JSON body as keyword arguments. The reply holds
+    the result and the printed output of the action.
+
+    Experiments can be added in-process as well, with server.registry.add(experiment).
+
+    The server has no users or roles. Data is only loaded over HTTP from files inside data_dir (loading is disabled
+    without it), and a server on a host other than the loopback interface requires a token, which clients send as
+    'Authorization: Bearer <token>'.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, memory_limit=2 ** 30, data_dir=None, token=None):
+        if token is None and not _loopback(host):
+            raise ValueError(f'serving on {host} is only possible with a token.')
+
+        super().__init__((host, port), _Handler)
+        self.data_dir = data_dir
+        self.token = token
+        self.registry = ExperimentRegistry(memory_limit=memory_limit)
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Serves in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class DexterClient:
+    """Client of an ExperimentServer, which prints the output of every action as if it ran in-process."""
+
+    def __init__(self, url='http://127.0.0.1:8765', timeout=None, echo=True, token=None):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.echo = echo
+        self.token = token
+
+    def _request(self, method, path, body=None):
+        data = None if body is None else json.dumps(_jsonable(body)).encode()
+        headers = {'Content-Type': 'application/json'}
+        if self.token is not None:
+            headers['Authorization'] = f'Bearer {self.token}'
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            error = json.loads(e.read()).get('error', str(e))
+            raise (KeyError if e.code == 404 else ValueError)(error) from None
+
+    def experiments(self):
+        return self._request('GET', '/experiments')['experiments']
+
+    def load(self, name, path, start, end, expected_delta, roll_out_percent, **roles):
+        spec = dict(name=name, path=str(path), start=start, end=end, expected_delta=expected_delta,
+                    roll_out_percent=roll_out_percent, **roles)
+        return self._request('POST', '/experiments', spec)
+
+    def remove(self, name):
+        return self._request('DELETE', f'/experiments/{urllib.request.quote(name)}')
+
+    def run(self, name, action, **kwargs):
+        res = self._request('POST', f'/experiments/{urllib.request.quote(name)}/{action}', kwargs)
+        if self.echo and res['output']:
+            sys.stdout.write(res['output'])
+        return res['result']
+
+    def compare(self, name, **kwargs):
+        return self.run(name, 'compare', **kwargs)
+
+    def mde(self, name, **kwargs):
+        return self.run(name, 'mde', **kwargs)
+
+    def required_n(self, name, **kwargs):
+        return self.run(name, 'required_n', **kwargs)
+
+    def actual_power(self, name, **kwargs):
+        return self.run(name, 'actual_power', **kwargs)
+
+    def check(self, name, assumption, **kwargs):
+        return self.run(name, 'check', assumption=assumption, **kwargs)
+
+    def summary(self, name, **kwargs):
+        return ExperimentSummary.from_dict(self.run(name, 'summary', **kwargs))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serves Dexter experiments from memory.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--memory-limit', type=int, default=2 ** 30, help='bytes of data to keep in memory')
+    parser.add_argument('--data-dir', default=None, help='directory of the data files that clients can load')
+    parser.add_argument('--token', default=os.environ.get('DEXTER_TOKEN'),
+                        help='token that clients have to send (default: $DEXTER_TOKEN); required off loopback')
+    args = parser.parse_args(argv)
+
+    server = ExperimentServer(args.host, args.port, memory_limit=args.memory_limit, data_dir=args.data_dir,
+                              token=args.token)
+    print(f'serving experiments on {server.url}', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
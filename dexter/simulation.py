@@ -0,0 +1,261 @@
+import functools
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from scipy.stats import kstest, mannwhitneyu, norm
+
+from dexter.stats_func import ttest_from_moments
+
+AASimulation = namedtuple('AASimulation', ['report', 'p_values'])
+
+
+def _chunk_size(n_rows, bytes_per_row, memory_budget, total):
+    return int(max(1, min(total, memory_budget // max(1, n_rows * bytes_per_row))))
+
+
+def simulate_group_moments(values, proportions, n_simulations, rng, memory_budget=2 ** 28):
+    """
+    Draws n_simulations random assignments of the rows of values to len(proportions) groups and yields, per chunk of
+    simulations, the group sizes, means and variances of every column.
+
+    The group sums of a chunk are a single product of a sparse indicator matrix, with one row per simulation and
+    group and one column per unit, and the (n x m) matrix of values.
+
+    :return:
+    generator of (n, mean, var) arrays with shape (chunk, groups, metrics)
+    """
+    values = np.asarray(values, dtype=float)
+    values = values.reshape(len(values), -1)
+    n_rows, n_metrics = values.shape
+    n_groups = len(proportions)
+
+    # centering keeps the sums-of-squares variance numerically stable
+    values = values - values.mean(axis=0)
+    squares = values ** 2
+
+    cumulative = np.cumsum(proportions)[:-1]
+
+    # uniform draws, row indices and indicator data (8 bytes each) per unit and simulation
+    chunk = _chunk_size(n_rows, 24, memory_budget, n_simulations)
+
+    done = 0
+    while done < n_simulations:
+        size = min(chunk, n_simulations - done)
+
+        # one column per unit holding one entry per simulation, so the CSC arrays are built without sorting
+        draws = rng.random((n_rows, size))
+        rows = np.broadcast_to(np.arange(size) * n_groups, (n_rows, size)).copy()
+        for threshold in cumulative:
+            rows += draws >= threshold
+        rows = rows.ravel()
+
+        indicator = sparse.csc_matrix(
+            (np.ones(rows.size), rows, np.arange(0, rows.size + 1, size)),
+            shape=(size * n_groups, n_rows)
+            )
+
+        n = np.bincount(rows, minlength=size * n_groups).reshape(size, n_groups, 1).astype(float)
+        sums = (indicator @ values).reshape(size, n_groups, n_metrics)
+        sums_sq = (indicator @ squares).reshape(size, n_groups, n_metrics)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = sums / n
+            var = (sums_sq - n * mean ** 2) / (n - 1)
+
+        yield n, mean, var
+
+        done += size
+
+
+def simulate_aa(values, metrics, proportions, n_simulations=1000, alpha=.05, equal_var=False,
+                alternative='two-sided', seed=None, memory_budget=2 ** 28):
+    """
+    A/A simulation: randomly re-assigns the existing units to groups with the given proportions many times and tests
+    every variant against the control (first group) for every metric. Since there is no true effect, the share of
+    significant tests estimates the false-positive rate, and the p-values should be uniformly distributed.
+
+    :return:
+    AASimulation(report: DataFrame, p_values: ndarray of shape (n_simulations, variants, metrics))
+    """
+    if not np.isclose(sum(proportions), 1):
+        raise ValueError('The provided proportions should sum up to 1.')
+
+    rng = np.random.default_rng(seed)
+
+    p_values = []
+    for n, mean, var in simulate_group_moments(values, proportions, n_simulations, rng, memory_budget):
+        _, _, p = ttest_from_moments(
+            mean[:, 1:], mean[:, [0]],
+            var[:, 1:], var[:, [0]],
+            n[:, 1:], n[:, [0]],
+            equal_var=equal_var,
+            alternative=alternative
+            )
+        p_values.append(p)
+
+    p_values = np.concatenate(p_values)
+
+    z = norm.ppf(1 - .05 / 2)
+    records = []
+    for g in range(len(proportions) - 1):
+        for i, metric in enumerate(metrics):
+            p = p_values[:, g, i]
+            p = p[~np.isnan(p)]
+            sims = len(p)
+            fpr = np.mean(p <= alpha)
+            # Wilson score interval of the false-positive rate
+            centre = (fpr + z ** 2 / (2 * sims)) / (1 + z ** 2 / sims)
+            margin = z * np.sqrt(fpr * (1 - fpr) / sims + z ** 2 / (4 * sims ** 2)) / (1 + z ** 2 / sims)
+            ks = kstest(p, 'uniform')
+            records.append({
+                'metric': metric,
+                'A': 0,
+                'B': g + 1,
+                'simulations': sims,
+                'alpha': alpha,
+                'false positive rate': fpr,
+                'ci low': centre - margin,
+                'ci high': centre + margin,
+                'ks-stat': ks.statistic,
+                'ks p-value': ks.pvalue,
+                'calibrated': centre - margin <= alpha <= centre + margin and ks.pvalue > .05
+                })
+
+    return AASimulation(pd.DataFrame(records), p_values)
+
+
+def _apply_lift(values, lift, lift_type):
+    if lift_type == 'multiplicative':
+        return values * (1 + lift)
+    return values + lift
+
+
+def _relabelings(seed, permutations, n, block):
+    """
+    Random relabelings of 2n pooled units into two groups of n, as treatment indicators in blocks of at most block
+    relabelings. The same seed gives the same relabelings at every call, without keeping them in memory.
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, permutations, block):
+        size = min(block, permutations - start)
+        # the treatment group of a relabeling: the n smallest of random keys
+        treated = np.argpartition(rng.random((size, 2 * n), dtype=np.float32), n - 1, axis=1)[:, :n]
+        indicator = np.zeros((size, 2 * n))
+        np.put_along_axis(indicator, treated, 1., axis=1)
+        yield indicator
+
+
+def _p_values(control, treatment, test, alternative, relabel):
+    n_control = control.shape[1]
+
+    if test == 'ttest':
+        _, _, p = ttest_from_moments(
+            treatment.mean(axis=1), control.mean(axis=1),
+            treatment.var(axis=1, ddof=1), control.var(axis=1, ddof=1),
+            treatment.shape[1], n_control,
+            alternative=alternative
+            )
+        return p
+
+    if test == 'mannwhitney':
+        scipy_alternative = {'two-sided': 'two-sided', 'greater': 'greater', 'smaller': 'less'}[alternative]
+        return mannwhitneyu(treatment, control, axis=1, method='asymptotic', alternative=scipy_alternative).pvalue
+
+    # permutation test of the mean difference; the same random relabelings are applied to every simulated
+    # experiment, so that the permuted treatment sums of a block of relabelings are a single matrix product
+    pooled = np.hstack([treatment, control])
+    n_treatment = treatment.shape[1]
+    totals = pooled.sum(axis=1, keepdims=True)
+    observed = treatment.mean(axis=1, keepdims=True) - control.mean(axis=1, keepdims=True)
+
+    exceeding = np.zeros(len(pooled))
+    permutations = 0
+    for indicator in relabel():
+        permutations += len(indicator)
+        perm_sums = pooled @ indicator.T
+        perm_delta = perm_sums / n_treatment - (totals - perm_sums) / n_control
+
+        if alternative == 'two-sided':
+            exceeding += np.sum(np.abs(perm_delta) >= np.abs(observed), axis=1)
+        elif alternative == 'greater':
+            exceeding += np.sum(perm_delta >= observed, axis=1)
+        else:
+            exceeding += np.sum(perm_delta <= observed, axis=1)
+
+    return exceeding / permutations
+
+
+def simulate_power(values, lifts, sample_sizes, lift_type='multiplicative', test='ttest', n_simulations=1000,
+                   alpha=.05, alternative='two-sided', permutations=1000, seed=None, memory_budget=2 ** 28):
+    """
+    Simulation-based power that does not assume normality. Each simulated experiment resamples both groups from the
+    observed values, injects the lift in the treatment group and runs the chosen test. All simulations of a chunk
+    are tested at once, and the same resamples are reused across lifts so that the power curves are smooth.
+
+    :param values: observed metric values, e.g. from the control group or from the pre-experiment period
+    :param lifts: effect sizes; relative (0.05 is +5%) for lift_type='multiplicative', absolute for 'additive'
+    :param sample_sizes: number of units per group
+    :param test: 'ttest' (Welch), 'mannwhitney' or 'permutation'
+
+    :return:
+    power curves: DataFrame with a row per sample size and lift
+    """
+    if lift_type not in ('multiplicative', 'additive'):
+        raise ValueError(f'lift_type should be either multiplicative or additive. Got {lift_type} instead.')
+
+    if test not in ('ttest', 'mannwhitney', 'permutation'):
+        raise ValueError(f'test should be either ttest, mannwhitney or permutation. Got {test} instead.')
+
+    if alternative not in ('two-sided', 'greater', 'smaller'):
+        raise ValueError(f'alternative should be either two-sided, greater or smaller. Got {alternative} instead.')
+
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    lifts = np.atleast_1d(lifts)
+    sample_sizes = np.atleast_1d(sample_sizes).astype(int)
+
+    rng = np.random.default_rng(seed)
+
+    records = []
+    for n in sample_sizes:
+        relabel, block = None, 0
+        if test == 'permutation':
+            # half of the budget for a block of relabelings (keys, indices and indicators), regenerated per chunk
+            block = _chunk_size(2 * n, 20, memory_budget // 2, permutations)
+            seed_n = rng.integers(2 ** 63)
+            relabel = functools.partial(_relabelings, seed_n, permutations, n, block)
+
+        # both groups, plus a block of permuted sums for the permutation test
+        bytes_per_simulation = 2 * n * 8 + block * 8
+        chunk = _chunk_size(1, bytes_per_simulation, memory_budget // (2 if test == 'permutation' else 1),
+                            n_simulations)
+
+        significant = np.zeros(len(lifts))
+        done = 0
+        while done < n_simulations:
+            size = min(chunk, n_simulations - done)
+
+            control = values[rng.integers(0, len(values), size=(size, n))]
+            resampled = values[rng.integers(0, len(values), size=(size, n))]
+
+            for i, lift in enumerate(lifts):
+                treatment = _apply_lift(resampled, lift, lift_type)
+                p = _p_values(control, treatment, test, alternative, relabel)
+                significant[i] += np.sum(p <= alpha)
+
+            done += size
+
+        power = significant / n_simulations
+        for lift, pw in zip(lifts, power):
+            records.append({
+                'n': n,
+                'lift': lift,
+                'power': pw,
+                'stderr': np.sqrt(pw * (1 - pw) / n_simulations),
+                'test': test,
+                'simulations': n_simulations
+                })
+
+    return pd.DataFrame(records)
@@ -0,0 +1,109 @@
+import numpy as np
+
+from dexter.summary import ExperimentSummary
+
+
+def quote(identifier):
+    """Quotes a column or table name as an SQL identifier."""
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+def _table(table):
+    # schema-qualified tables (schema.table) are quoted per part
+    return '.'.join(quote(part) for part in table.split('.'))
+
+
+def _where(where):
+    return f' WHERE {where}' if where else ''
+
+
+def centre_query(table, metrics, where=None):
+    """SQL for the overall mean of every metric, around which the power sums are taken."""
+    columns = ', '.join(f'AVG({quote(metric)})' for metric in metrics)
+    return f'SELECT {columns} FROM {_table(table)}{_where(where)}'
+
+
+def summary_query(table, treatment, unit, metrics, centre=None, where=None):
+    """
+    SQL for the sufficient statistics of an experiment per group: the number of rows and distinct units and, per
+    metric, the number of values, the sums of the values and squared values (minus centre), the extremes and whether
+    all values are integers, plus the number of rows without missing values with their sums and cross-products.
+
+    :return:
+    query with one row per group, ordered by group, and columns treatment, rows, units, then n, sum, squares, min, max
+    and non-integers per metric, then complete rows, their sums per metric and the cross-products of metrics i <= j
+    """
+    centre = np.zeros(len(metrics)) if centre is None else np.nan_to_num(np.asarray(centre, dtype=float))
+    shifted = [f'({quote(metric)} - {float(c)!r})' for metric, c in zip(metrics, centre)]
+    complete = ' AND '.join(f'{quote(metric)} IS NOT NULL' for metric in metrics)
+
+    columns = [quote(treatment), 'COUNT(*)', f'COUNT(DISTINCT {quote(unit)})']
+    for metric, x in zip(metrics, shifted):
+        column = quote(metric)
+        columns += [f'COUNT({column})', f'SUM({x})', f'SUM({x} * {x})', f'MIN({column})', f'MAX({column})',
+                    f'SUM(CASE WHEN {column} <> CAST({column} AS INTEGER) THEN 1 ELSE 0 END)']
+
+    columns.append(f'SUM(CASE WHEN {complete} THEN 1 ELSE 0 END)')
+    columns += [f'SUM(CASE WHEN {complete} THEN {x} END)' for x in shifted]
+    columns += [f'SUM(CASE WHEN {complete} THEN {shifted[i]} * {shifted[j]} END)'
+                for i in range(len(metrics)) for j in range(i, len(metrics))]
+
+    return (f'SELECT {", ".join(columns)} FROM {_table(table)}{_where(where)} '
+            f'GROUP BY {quote(treatment)} ORDER BY {quote(treatment)}')
+
+
+def _fetch(connection, query):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(query)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+def summarise_sql(connection, table, roles, metrics=None, where=None):
+    """
+    Summarises an experiment in a database, from a DB-API connection, without fetching the rows: two aggregate
+    queries compute the overall means and then the power sums per group around them (see summary_query). roles is
+    anything with the column roles of an experiment, e.g. an ExperimentSchema. where is an optional SQL condition
+    (e.g. a date range) and is inserted as is, so it should not come from untrusted input.
+
+    :return:
+    ExperimentSummary
+    """
+    roles = {role: getattr(roles, role, None) for role in ExperimentSummary._roles}
+    if metrics is None:
+        metrics = [*roles['success_metric'], *roles['health_metrics'], *roles['learning_metrics']]
+
+    treatment, unit = roles['treatment'], roles['experiment_unit']
+    m = len(metrics)
+
+    centre = np.array(_fetch(connection, centre_query(table, metrics, where))[0], dtype=float)
+    rows = _fetch(connection, summary_query(table, treatment, unit, metrics, centre, where))
+
+    if len(rows) == 0:
+        raise ValueError(f'There is no data in {table} to summarise.')
+
+    groups = np.array([row[0] for row in rows])
+    values = np.array([row[1:] for row in rows], dtype=float)
+
+    per_metric = values[:, 2:2 + 6 * m].reshape(len(rows), m, 6)
+    n, sums, squares, minimum, maximum, non_integral = np.moveaxis(per_metric, 2, 0)
+    complete_n = values[:, 2 + 6 * m]
+    complete_sums = np.nan_to_num(values[:, 3 + 6 * m:3 + 7 * m])
+
+    # the cross-products of metrics i <= j fill both triangles of the matrix
+    i, j = np.triu_indices(m)
+    cross_products = np.zeros((len(rows), m, m))
+    cross_products[:, i, j] = np.nan_to_num(values[:, 3 + 7 * m:])
+    cross_products[:, j, i] = cross_products[:, i, j]
+
+    return ExperimentSummary.from_sums(
+        groups, metrics, roles,
+        rows=values[:, 0], units=values[:, 1], n=n,
+        sums=np.nan_to_num(sums), squares=np.nan_to_num(squares),
+        minimum=np.where(np.isnan(minimum), np.inf, minimum), maximum=np.where(np.isnan(maximum), -np.inf, maximum),
+        integral=np.nansum(non_integral, axis=0) == 0,
+        complete_n=complete_n, complete_sums=complete_sums, cross_products=cross_products,
+        centre=centre
+        )
@@ -1,24 +1,47 @@
+import numpy as np
+import pandas as pd
 from numpy import round, sqrt
-from scipy.stats import chisquare, t, norm
+from scipy.stats import chisquare, chi2, t, norm, f, studentized_range, fisher_exact
 
 
 def trim_outliers(dataframe, outlier_mask, metrics=None):
-    return dataframe.loc[~outlier_mask]
+    """Rows to keep: a boolean mask of the rows that are not outliers."""
+    return ~outlier_mask
 
 
 def winsorize_outliers(dataframe, outlier_mask, metrics):
+    """New values of the outliers, without changing the data: a dict of metric to a Series of the outlier rows."""
     metrics = [metrics] if type(metrics) is not list else metrics
-    max_val = dataframe.loc[outlier_mask, metrics].min().values
-    dataframe.loc[outlier_mask, metrics] = max_val
-    return dataframe
+    outliers = dataframe.loc[outlier_mask, metrics]
+    max_val = outliers.min()
+    return {metric: pd.Series(max_val[metric], index=outliers.index) for metric in metrics}
 
 
 def check_multiple_proportion(n_total, n_treatment, expected_proportion):
-    observed_prop = n_treatment / n_total
-    res = chisquare(expected_proportion, observed_prop)
+    # the test has to run on counts: on proportions, the statistic shrinks by a factor n_total and hides real
+    # sample ratio mismatches in large samples
+    expected_counts = np.asarray(expected_proportion, dtype=float) * n_total
+    res = chisquare(np.asarray(n_treatment, dtype=float), expected_counts)
     return round(res, 3)
 
 
+def chisquare_from_counts(counts, expected_proportion):
+    """
+    Chi-square goodness-of-fit test of group counts against the expected proportions, vectorized over all leading
+    axes of counts (the groups are along the last axis). Rows without any count get a NaN p-value.
+
+    :return:
+    chi-square statistic, p-value
+    """
+    counts = np.asarray(counts, dtype=float)
+    expected = counts.sum(axis=-1, keepdims=True) * np.asarray(expected_proportion, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        stat = np.sum((counts - expected) ** 2 / expected, axis=-1)
+
+    return stat, chi2.sf(stat, counts.shape[-1] - 1)
+
+
 def mde(xn, yn, yvar, xvar, alpha, beta, alternative):
     assert alternative in ['two-sided', 'one-sided']
 
@@ -59,3 +82,429 @@ def actual_power(xmean, ymean, xvar, yvar, xn, yn, alpha, alternative):
     print(delta, dsd, t_critical, dof, t_critical - delta/dsd)
 
     return 1 - t_beta
+
+
+def ttest_from_moments(xmean, ymean, xvar, yvar, xn, yn, equal_var=False, alternative='two-sided'):
+    """
+    Student's or Welch's t-test computed from group means, variances and sizes. All arguments broadcast, so that
+    many tests (simulations, metrics, contrasts) are computed at once.
+
+    :return:
+    t-statistic, degrees of freedom and p-value, with the shape of the broadcast arguments
+    """
+    assert alternative in ['two-sided', 'greater', 'smaller']
+
+    xmean, ymean, xvar, yvar, xn, yn = (np.asarray(x, dtype=float) for x in (xmean, ymean, xvar, yvar, xn, yn))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if equal_var:
+            dof = xn + yn - 2
+            pooled_var = ((xn - 1) * xvar + (yn - 1) * yvar) / dof
+            se = np.sqrt(pooled_var * (1 / xn + 1 / yn))
+        else:
+            xse2 = xvar / xn
+            yse2 = yvar / yn
+            se = np.sqrt(xse2 + yse2)
+            dof = (xse2 + yse2) ** 2 / (xse2 ** 2 / (xn - 1) + yse2 ** 2 / (yn - 1))
+
+        tstat = (xmean - ymean) / se
+
+    if alternative == 'two-sided':
+        p = 2 * t.sf(np.abs(tstat), dof)
+    elif alternative == 'greater':
+        p = t.sf(tstat, dof)
+    else:
+        p = t.cdf(tstat, dof)
+
+    return tstat, dof, p
+
+
+def padjust(pvals, method='none', axis=-1):
+    """
+    Vectorized multiple-testing correction along an axis of an array of p-values. Methods follow pingouin's naming:
+    'none', 'bonf', 'sidak', 'holm', 'fdr_bh' (Benjamini-Hochberg) and 'fdr_by' (Benjamini-Yekutieli).
+    NaN p-values are ignored and do not count as tests.
+    """
+    methods = ['none', 'bonf', 'sidak', 'holm', 'fdr_bh', 'fdr_by']
+    if method not in methods:
+        raise ValueError(f'padjust should be one of: {", ".join(methods)}. Got {method} instead.')
+
+    pvals = np.moveaxis(np.asarray(pvals, dtype=float), axis, -1)
+
+    if method == 'none':
+        return np.moveaxis(pvals.copy(), -1, axis)
+
+    missing = np.isnan(pvals)
+    m = np.sum(~missing, axis=-1, keepdims=True)
+
+    if method == 'bonf':
+        adjusted = pvals * m
+    elif method == 'sidak':
+        adjusted = 1 - (1 - pvals) ** m
+    else:
+        # NaNs are sorted last, so that the ranks of the observed p-values run from 1 to m
+        order = np.argsort(np.where(missing, np.inf, pvals), axis=-1)
+        ranked = np.take_along_axis(pvals, order, axis=-1)
+        rank = np.arange(1, pvals.shape[-1] + 1)
+
+        if method == 'holm':
+            ranked = np.fmax.accumulate((m - rank + 1) * ranked, axis=-1)
+        else:
+            factor = 1
+            if method == 'fdr_by':
+                factor = np.cumsum(1 / rank)[np.maximum(m - 1, 0)]
+            ranked = ranked * m * factor / rank
+            # the step-up minimum runs from the largest observed p-value downwards
+            ranked = np.where(rank <= m, ranked, np.inf)
+            ranked = np.fmin.accumulate(ranked[..., ::-1], axis=-1)[..., ::-1]
+
+        adjusted = np.empty_like(pvals)
+        np.put_along_axis(adjusted, order, ranked, axis=-1)
+
+    adjusted = np.where(missing, np.nan, np.clip(adjusted, 0, 1))
+
+    return np.moveaxis(adjusted, -1, axis)
+
+
+def anova_from_moments(n, mean, var):
+    """
+    One-way ANOVA from group sizes, means and variances, given as arrays with the groups along the first axis. Any
+    further axes (e.g. metrics) are tested at once.
+
+    :return:
+    ss_between, ss_within, dof_between, dof_within, f-statistic, p-value
+    """
+    n, mean, var = (np.asarray(x, dtype=float) for x in (n, mean, var))
+    k = n.shape[0]
+
+    total = n.sum(axis=0)
+    grand_mean = (n * mean).sum(axis=0) / total
+
+    ss_between = (n * (mean - grand_mean) ** 2).sum(axis=0)
+    ss_within = ((n - 1) * var).sum(axis=0)
+    dof_between = k - 1
+    dof_within = total - k
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fstat = (ss_between / dof_between) / (ss_within / dof_within)
+
+    return ss_between, ss_within, dof_between, dof_within, fstat, f.sf(fstat, dof_between, dof_within)
+
+
+def welch_anova_from_moments(n, mean, var):
+    """
+    Welch's ANOVA from group sizes, means and variances, with the groups along the first axis.
+
+    :return:
+    dof_between, dof_within, f-statistic, p-value
+    """
+    n, mean, var = (np.asarray(x, dtype=float) for x in (n, mean, var))
+    k = n.shape[0]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weights = n / var
+        sum_weights = weights.sum(axis=0)
+        weighted_mean = (weights * mean).sum(axis=0) / sum_weights
+
+        between = (weights * (mean - weighted_mean) ** 2).sum(axis=0) / (k - 1)
+        lam = 3 * ((1 - weights / sum_weights) ** 2 / (n - 1)).sum(axis=0) / (k ** 2 - 1)
+
+        fstat = between / (1 + 2 * lam * (k - 2) / 3)
+        dof_within = 1 / lam
+
+    return k - 1, dof_within, fstat, f.sf(fstat, k - 1, dof_within)
+
+
+def pairwise_from_moments(n, mean, var, a, b, method='tukey'):
+    """
+    Pairwise contrasts between the groups with indices a and b, computed from group sizes, means and variances with
+    the groups along the first axis.
+
+    method: 'tukey' (Tukey-HSD, equal variances), 'gameshowell' (Games-Howell, unequal variances) or 'welch'
+    (unadjusted Welch t-tests). Tukey and Games-Howell p-values come from the studentized range distribution with as
+    many groups as the first axis, so they are adjusted for all pairwise comparisons, even when a and b only hold
+    many-to-one contrasts (e.g. variants vs. control), for which they are conservative.
+
+    :return:
+    delta, stderr, t-statistic, dof, p-value and Cohen's d, with the contrasts along the first axis
+    """
+    assert method in ['tukey', 'gameshowell', 'welch']
+
+    n, mean, var = (np.asarray(x, dtype=float) for x in (n, mean, var))
+    k = n.shape[0]
+    a, b = np.asarray(a), np.asarray(b)
+
+    na, nb, ma, mb, va, vb = n[a], n[b], mean[a], mean[b], var[a], var[b]
+    delta = ma - mb
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if method == 'tukey':
+            _, ss_within, _, dof, _, _ = anova_from_moments(n, mean, var)
+            mse = ss_within / dof
+            se = np.sqrt(mse * (1 / na + 1 / nb))
+            dof = np.broadcast_to(dof, delta.shape)
+        else:
+            se = np.sqrt(va / na + vb / nb)
+            dof = (va / na + vb / nb) ** 2 / ((va / na) ** 2 / (na - 1) + (vb / nb) ** 2 / (nb - 1))
+
+        tstat = delta / se
+        cohen = delta / np.sqrt(((na - 1) * va + (nb - 1) * vb) / (na + nb - 2))
+
+    if method == 'welch':
+        p = 2 * t.sf(np.abs(tstat), dof)
+    else:
+        # the studentized range cdf is a double integral for finite dof; beyond 10^5 dof the single integral of the
+        # limiting distribution differs by less than 10^-5 and is two orders of magnitude faster
+        dof_range = np.where(dof > 10 ** 5, np.inf, dof)
+        p = studentized_range.sf(np.abs(tstat) * np.sqrt(2), k, dof_range)
+
+    return delta, se, tstat, dof, p, cohen
+
+
+def _normal_p_value(z, alternative):
+    if alternative == 'two-sided':
+        return 2 * norm.sf(np.abs(z))
+    if alternative == 'greater':
+        return norm.sf(z)
+    return norm.cdf(z)
+
+
+def proportions_ztest(xs, xn, ys, yn, alternative='two-sided'):
+    """
+    Two-proportion z-test from the number of successes and the sizes of two groups, with the pooled proportion under
+    the null hypothesis. All arguments broadcast.
+
+    :return:
+    delta, stderr, z-statistic, p-value and Cohen's h
+    """
+    assert alternative in ['two-sided', 'greater', 'smaller']
+
+    xs, xn, ys, yn = (np.asarray(x, dtype=float) for x in (xs, xn, ys, yn))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xp, yp = xs / xn, ys / yn
+        pooled = (xs + ys) / (xn + yn)
+        se = np.sqrt(pooled * (1 - pooled) * (1 / xn + 1 / yn))
+        z = (xp - yp) / se
+        cohen_h = 2 * np.arcsin(np.sqrt(xp)) - 2 * np.arcsin(np.sqrt(yp))
+
+    return xp - yp, se, z, _normal_p_value(z, alternative), cohen_h
+
+
+def chisquare_proportions(successes, n):
+    """
+    Pearson's chi-square test of homogeneity of the (groups x 2) table of successes and failures, with the groups along
+    the first axis. Any further axes (e.g. metrics) are tested at once.
+
+    :return:
+    chi-square statistic, dof, p-value and the smallest expected cell count
+    """
+    successes, n = np.asarray(successes, dtype=float), np.asarray(n, dtype=float)
+    observed = np.stack([successes, n - successes])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = n * (observed.sum(axis=1, keepdims=True) / n.sum(axis=0))
+        stat = np.sum((observed - expected) ** 2 / expected, axis=(0, 1))
+
+    dof = n.shape[0] - 1
+
+    return stat, dof, chi2.sf(stat, dof), expected.min(axis=(0, 1))
+
+
+def fisher_exact_proportions(xs, xn, ys, yn, alternative='two-sided'):
+    """
+    Fisher's exact test of a (2 x 2) table of successes and failures, for small expected counts.
+
+    :return:
+    p-value
+    """
+    scipy_alternative = {'two-sided': 'two-sided', 'greater': 'greater', 'smaller': 'less'}[alternative]
+    table = np.array([[xs, xn - xs], [ys, yn - ys]], dtype=int)
+    return fisher_exact(table, alternative=scipy_alternative).pvalue
+
+
+def poisson_rate_test(xsum, xn, ysum, yn, alternative='two-sided'):
+    """
+    Score test of the ratio of two Poisson rates (events per unit), from the total events and the number of units of
+    two groups, with the pooled rate under the null hypothesis. All arguments broadcast.
+
+    :return:
+    delta, stderr, z-statistic, p-value and the rate ratio
+    """
+    assert alternative in ['two-sided', 'greater', 'smaller']
+
+    xsum, xn, ysum, yn = (np.asarray(x, dtype=float) for x in (xsum, xn, ysum, yn))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        xrate, yrate = xsum / xn, ysum / yn
+        pooled = (xsum + ysum) / (xn + yn)
+        se = np.sqrt(pooled * (1 / xn + 1 / yn))
+        z = (xrate - yrate) / se
+
+    return xrate - yrate, se, z, _normal_p_value(z, alternative), xrate / yrate
+
+
+def dispersion_test(n, mean, var):
+    """
+    Test of overdispersion of count data: under a Poisson distribution, (n - 1) * var / mean follows a chi-square
+    distribution with n - 1 degrees of freedom.
+
+    :return:
+    dispersion index (var / mean) and the one-sided p-value of overdispersion
+    """
+    n, mean, var = (np.asarray(x, dtype=float) for x in (n, mean, var))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        index = var / mean
+
+    return index, chi2.sf((n - 1) * index, n - 1)
+
+
+def poisson_homogeneity_test(sums, n):
+    """
+    Chi-square test of equal Poisson rates across groups, from the total events and the number of units per group,
+    with the groups along the first axis.
+
+    :return:
+    chi-square statistic, dof and p-value
+    """
+    sums, n = np.asarray(sums, dtype=float), np.asarray(n, dtype=float)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = n * sums.sum(axis=0) / n.sum(axis=0)
+        stat = np.sum((sums - expected) ** 2 / expected, axis=0)
+
+    dof = n.shape[0] - 1
+
+    return stat, dof, chi2.sf(stat, dof)
+
+
+def normal_posterior_comparison(mean_a, se_a, mean_b, se_b, ci=.95):
+    """
+    Comparison of the Normal posteriors of the means of two groups, in closed form: the posterior of the lift B - A is
+    Normal as well. All arguments broadcast.
+
+    :return:
+    lift, lower and upper bounds of its credible interval, P(B > A) and the expected loss of choosing B when A is
+    better, E[max(A - B, 0)]
+    """
+    mean_a, se_a, mean_b, se_b = (np.asarray(x, dtype=float) for x in (mean_a, se_a, mean_b, se_b))
+
+    lift = mean_b - mean_a
+    sd = np.sqrt(se_a ** 2 + se_b ** 2)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = lift / sd
+
+    half_width = norm.ppf(.5 + ci / 2) * sd
+    loss = sd * norm.pdf(z) - lift * norm.cdf(-z)
+
+    return lift, lift - half_width, lift + half_width, norm.cdf(z), loss
+
+
+def meta_analysis(delta, se, ci=.95):
+    """
+    Inverse-variance pooling of the effects of several experiments: the fixed effect estimate, and the random effects
+    estimate with the between-experiment variance (tau^2) of DerSimonian and Laird.
+
+    :return:
+    fixed and random effects (estimate, stderr, ci low, ci high, z-statistic, p-value), Cochran's Q, its p-value, tau^2
+    and I^2
+    """
+    delta, se = np.asarray(delta, dtype=float), np.asarray(se, dtype=float)
+    k = len(delta)
+    z_crit = norm.ppf(.5 + ci / 2)
+
+    def pool(weights):
+        estimate = np.sum(weights * delta) / np.sum(weights)
+        stderr = 1 / np.sqrt(np.sum(weights))
+        z = estimate / stderr
+        return estimate, stderr, estimate - z_crit * stderr, estimate + z_crit * stderr, z, 2 * norm.sf(np.abs(z))
+
+    weights = 1 / se ** 2
+    fixed = pool(weights)
+
+    q = np.sum(weights * (delta - fixed[0]) ** 2)
+    tau2 = max(0., (q - (k - 1)) / (np.sum(weights) - np.sum(weights ** 2) / np.sum(weights))) if k > 1 else 0.
+    i2 = max(0., (q - (k - 1)) / q) if q > 0 else 0.
+
+    return fixed, pool(1 / (se ** 2 + tau2)), q, chi2.sf(q, k - 1) if k > 1 else np.nan, tau2, i2
+
+
+def _integers(values):
+    values = np.asarray(values, dtype=float)
+    if not np.array_equal(values, np.round(values)):
+        raise ValueError('exact permutation distributions are only available for integer values.')
+    return values.astype(np.int64)
+
+
+def subset_sum_distribution(values, size, max_cells=2 ** 26):
+    """
+    Exact distribution of the sum of a random subset of size values (e.g. the sum of a group under permutation of the
+    group labels) of integer values. The sum is the coefficient of x^size in the generating function prod_v
+    (1 - p + p x y^v)^c_v over the distinct values v with counts c_v, evaluated on the roots of unity and inverted
+    with an FFT. With p = size / n, all terms are probabilities and the subset sizes are binomial around size, so
+    the count axis only needs to cover 12 standard deviations of them before the wrapped terms fall below the
+    rounding error. The cost grows with the number of values and the range of the subset sum, limited by max_cells.
+
+    :return:
+    sums, probabilities
+    """
+    values = _integers(values)
+    n = len(values)
+    offset = values.min()
+    shifted = np.sort(values - offset)
+
+    p = size / n
+    n_counts = min(n + 1, 2 * int(np.ceil(12 * np.sqrt(n * p * (1 - p)))) + 1)
+
+    # the largest subset sum bounds the support, so that the sums do not wrap around
+    width = int(shifted[n - size:].sum()) + 1
+    if n_counts * width > max_cells:
+        raise ValueError(f'the exact distribution needs {n_counts * width} cells, more than max_cells ({max_cells}). '
+                         f'Use approximate permutations instead.')
+
+    distinct, counts = np.unique(shifted, return_counts=True)
+    # the coefficients are real, so the transform at -y is the conjugate of the one at y
+    half = np.arange(width // 2 + 1)
+
+    coefficient = np.zeros(len(half), dtype=complex)
+    chunk = max(1, 2 ** 20 // len(half))
+    for start in range(0, n_counts, chunk):
+        x = np.exp(2j * np.pi * np.arange(start, min(start + chunk, n_counts)) / n_counts)[:, None]
+        log_generating = np.zeros((len(x), len(half)), dtype=complex)
+        with np.errstate(divide='ignore'):
+            for v, c in zip(distinct, counts):
+                log_generating += c * np.log(1 - p + p * x * np.exp(2j * np.pi * (v * half % width) / width))
+        # the coefficient of x^size, as an inverse DFT over the count axis
+        coefficient += np.sum(np.exp(log_generating) * np.conj(x) ** size, axis=0)
+
+    probabilities = np.clip(np.fft.irfft(np.conj(coefficient), n=width), 0, None)
+
+    return offset * size + np.arange(width), probabilities / probabilities.sum()
+
+
+def sign_flip_distribution(values, max_cells=2 ** 26):
+    """
+    Exact distribution of the sum of integer values with random signs (e.g. within-unit differences under the null
+    hypothesis of a paired test), from the generating function prod_v ((1 + y^v) / 2)^c_v of the flipped magnitudes.
+
+    :return:
+    sums, probabilities
+    """
+    magnitudes = np.abs(_integers(values))
+    total = int(magnitudes.sum())
+    width = total + 1
+    if width > max_cells:
+        raise ValueError(f'the exact distribution needs {width} cells, more than max_cells ({max_cells}). '
+                         f'Use approximate permutations instead.')
+
+    distinct, counts = np.unique(magnitudes[magnitudes > 0], return_counts=True)
+    generating = np.ones(width, dtype=complex)
+    for v, c in zip(distinct, counts):
+        generating *= ((1 + np.exp(2j * np.pi * ((v * np.arange(width)) % width) / width)) / 2) ** c
+
+    probabilities = np.clip(np.fft.fft(generating).real / width, 0, None)
+
+    # flipping magnitudes that sum to f changes the sum of the magnitudes to total - 2f
+    return total - 2 * np.arange(width), probabilities / probabilities.sum()
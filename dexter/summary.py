@@ -0,0 +1,340 @@
+import functools
+import json
+
+import numpy as np
+import pandas as pd
+
+from dexter.utils import GroupSummary
+
+
+class HyperLogLog:
+    """
+    Sketch of the number of distinct values (e.g. experiment units) in a few kilobytes, with a relative error of about
+    1.04 / sqrt(2 ** precision). Sketches of shards are merged by taking the register-wise maximum, so units that
+    appear in several shards are counted once.
+    """
+
+    def __init__(self, precision=12, registers=None):
+        if not 4 <= precision <= 18:
+            raise ValueError(f'precision should be between 4 and 18. Got {precision} instead.')
+
+        self.precision = precision
+        self.registers = np.zeros(2 ** precision, dtype=np.uint8) if registers is None \
+            else np.asarray(registers, dtype=np.uint8)
+
+    def update(self, values):
+        p = self.precision
+        hashes = pd.util.hash_array(np.asarray(values))
+
+        index = (hashes >> np.uint64(64 - p)).astype(np.intp)
+        # the remaining bits, with a guard bit that bounds the rank
+        rest = (hashes << np.uint64(p)) | np.uint64(1 << (p - 1))
+
+        # leading zeros of 64-bit integers by binary search
+        zeros = np.zeros(len(rest), dtype=np.uint8)
+        for shift in (32, 16, 8, 4, 2, 1):
+            small = rest < np.uint64(1 << (64 - shift))
+            zeros += (shift * small).astype(np.uint8)
+            rest = np.where(small, rest << np.uint64(shift), rest)
+
+        np.maximum.at(self.registers, index, zeros + 1)
+
+        return self
+
+    def merge(self, other):
+        if self.precision != other.precision:
+            raise ValueError('only sketches with the same precision can be merged.')
+        return HyperLogLog(self.precision, np.maximum(self.registers, other.registers))
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = .7213 / (1 + 1.079 / m)
+        estimate = alpha * m ** 2 / np.sum(2. ** -self.registers.astype(float))
+
+        empty = np.sum(self.registers == 0)
+        if estimate <= 2.5 * m and empty > 0:
+            # linear counting for small cardinalities
+            estimate = m * np.log(m / empty)
+
+        return estimate
+
+
+class ExperimentSummary:
+    """
+    Sufficient statistics of an experiment, to analyse data that is spread over shards (e.g. dates or unit hashes) on
+    several machines without moving the rows. Per group, the summary holds the number of rows and units and, per
+    metric, the number of values, mean, sum of squared deviations (M2), minimum and maximum, plus the co-moment matrix
+    of the metrics over the rows without missing values. Optionally, a HyperLogLog sketch per group counts the distinct
+    units across shards.
+
+    Summaries of shards are merged with Chan's parallel update of the means and (co-)moments, which is associative and
+    numerically stable, so that shards can be merged in any order, e.g. in a tree of processes. An Experiment built from
+    a summary (Experiment.from_summaries) runs the group balance check, parametric compare(), mde(), required_n() and
+    actual_power().
+
+    The unit counts are exact per shard and summed over shards, so they are exact when the shards partition the units
+    (e.g. by unit hash). Otherwise, use the sketches.
+    """
+
+    _roles = ('success_metric', 'health_metrics', 'learning_metrics', 'experiment_unit', 'treatment',
+              'expected_proportions', 'timestamp')
+
+    def __init__(self, groups, metrics, roles, rows, units, n, mean, m2, minimum, maximum, integral, complete_n,
+                 complete_mean, comoment, sketches=None):
+        self.groups = np.asarray(groups)
+        self.metrics = list(metrics)
+
+        for role in self._roles:
+            setattr(self, role, roles.get(role))
+
+        self.rows = np.asarray(rows, dtype=float)
+        self.units = np.asarray(units, dtype=float)
+        self.n = np.asarray(n, dtype=float)
+        self.mean = np.asarray(mean, dtype=float)
+        self.m2 = np.asarray(m2, dtype=float)
+        self.minimum = np.asarray(minimum, dtype=float)
+        self.maximum = np.asarray(maximum, dtype=float)
+        self.integral = np.asarray(integral, dtype=bool)
+        self.complete_n = np.asarray(complete_n, dtype=float)
+        self.complete_mean = np.asarray(complete_mean, dtype=float)
+        self.comoment = np.asarray(comoment, dtype=float)
+        self.sketches = sketches
+
+    @property
+    def roles(self):
+        return {role: getattr(self, role) for role in self._roles}
+
+    @classmethod
+    def from_frame(cls, dataframe, roles, metrics=None, sketch=False, precision=12):
+        """
+        Summarises a shard of experiment data. roles is anything with the column roles of an experiment, e.g. an
+        ExperimentSchema or an ExperimentDataFrame. By default, all metrics of the roles are summarised.
+        """
+        roles = {role: getattr(roles, role, None) for role in cls._roles}
+        if metrics is None:
+            metrics = [*roles['success_metric'], *roles['health_metrics'], *roles['learning_metrics']]
+
+        treatment, unit = roles['treatment'], roles['experiment_unit']
+
+        stats_df = dataframe.groupby(treatment)[metrics].agg(['count', 'mean', 'var', 'min', 'max']).sort_index()
+        groups = stats_df.index.to_numpy()
+
+        n, mean, var, minimum, maximum = [stats_df.xs(stat, axis=1, level=1)[metrics].to_numpy(dtype=float)
+                                          for stat in ('count', 'mean', 'var', 'min', 'max')]
+        # empty groups hold zeros, so that they do not affect merges
+        mean = np.nan_to_num(mean)
+        m2 = np.nan_to_num(var * (n - 1))
+
+        values = dataframe[metrics].to_numpy(dtype=float)
+        integral = np.array([np.all(np.mod(col[~np.isnan(col)], 1) == 0) for col in values.T], dtype=bool)
+
+        group_codes = pd.Categorical(dataframe[treatment], categories=groups).codes
+        complete = ~np.isnan(values).any(axis=1) & (group_codes >= 0)
+
+        k, m = len(groups), len(metrics)
+        complete_n, complete_mean, comoment = np.zeros(k), np.zeros((k, m)), np.zeros((k, m, m))
+        for g in range(k):
+            block = values[complete & (group_codes == g)]
+            if len(block):
+                complete_n[g] = len(block)
+                complete_mean[g] = block.mean(axis=0)
+                centred = block - complete_mean[g]
+                comoment[g] = centred.T @ centred
+
+        rows = dataframe[treatment].value_counts().reindex(groups, fill_value=0).to_numpy()
+        units = dataframe.groupby(treatment)[unit].nunique().reindex(groups, fill_value=0).to_numpy()
+
+        sketches = None
+        if sketch:
+            sketches = [HyperLogLog(precision).update(dataframe.loc[group_codes == g, unit]) for g in range(k)]
+
+        return cls(groups, metrics, roles, rows, units, n, mean, m2, minimum, maximum, integral, complete_n,
+                   complete_mean, comoment, sketches)
+
+    @classmethod
+    def from_sums(cls, groups, metrics, roles, rows, units, n, sums, squares, minimum, maximum, integral, complete_n,
+                  complete_sums, cross_products, centre=None):
+        """
+        Summary from power sums per group, e.g. aggregated in a database: the sums and sums of squares of every metric,
+        and the sums and cross-products of the metrics over the rows without missing values. The sums are of the values
+        minus centre (one value per metric, zero by default), which should be close to the means to avoid the
+        cancellation of large squares.
+        """
+        n, sums, squares, complete_n, complete_sums, cross_products = (
+            np.asarray(x, dtype=float) for x in (n, sums, squares, complete_n, complete_sums, cross_products))
+        centre = np.zeros(len(metrics)) if centre is None else np.nan_to_num(np.asarray(centre, dtype=float))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(n > 0, centre + sums / n, 0.)
+            m2 = np.where(n > 0, squares - sums ** 2 / n, 0.)
+            complete_shift = np.where(complete_n[:, None] > 0, complete_sums / complete_n[:, None], 0.)
+        comoment = cross_products - complete_shift[:, :, None] * complete_sums[:, None, :]
+
+        return cls(groups, metrics, roles, rows, units, n, mean, np.maximum(m2, 0), minimum, maximum, integral,
+                   complete_n, np.where(complete_n[:, None] > 0, centre + complete_shift, 0.), comoment)
+
+    def _align(self, groups):
+        """The statistics of the summary for the given (super)set of groups, with empty groups where missing."""
+        position = {group: i for i, group in enumerate(self.groups.tolist())}
+        index = np.array([position.get(group, -1) for group in groups.tolist()])
+        present = index >= 0
+
+        def take(array, fill=0.):
+            aligned = np.full((len(groups),) + array.shape[1:], fill, dtype=array.dtype)
+            aligned[present] = array[index[present]]
+            return aligned
+
+        sketches = None
+        if self.sketches is not None:
+            precision = self.sketches[0].precision
+            sketches = [self.sketches[i] if i >= 0 else HyperLogLog(precision) for i in index]
+
+        return {
+            'rows': take(self.rows), 'units': take(self.units), 'n': take(self.n), 'mean': take(self.mean),
+            'm2': take(self.m2), 'minimum': take(self.minimum, np.inf), 'maximum': take(self.maximum, -np.inf),
+            'complete_n': take(self.complete_n), 'complete_mean': take(self.complete_mean),
+            'comoment': take(self.comoment), 'sketches': sketches
+            }
+
+    def merge(self, other):
+        if self.metrics != other.metrics:
+            raise ValueError('only summaries of the same metrics can be merged.')
+
+        if self.roles != other.roles:
+            raise ValueError('only summaries with the same column roles can be merged.')
+
+        if (self.sketches is None) != (other.sketches is None):
+            raise ValueError('either all or none of the merged summaries should have sketches.')
+
+        groups = np.union1d(self.groups, other.groups)
+        a, b = self._align(groups), other._align(groups)
+
+        def combine(n_a, mean_a, m2_a, n_b, mean_b, m2_b, outer=False):
+            n = n_a + n_b
+            with np.errstate(divide='ignore', invalid='ignore'):
+                weight = np.where(n > 0, n_a * n_b / n, 0)
+                share = np.where(n > 0, n_b / n, 0)
+            delta = mean_b - mean_a
+            if outer:
+                correction = delta[:, :, None] * delta[:, None, :] * weight[:, None, None]
+                share = share[:, None]
+            else:
+                correction = delta ** 2 * weight
+            return n, mean_a + delta * share, m2_a + m2_b + correction
+
+        n, mean, m2 = combine(a['n'], a['mean'], a['m2'], b['n'], b['mean'], b['m2'])
+        complete_n, complete_mean, comoment = combine(
+            a['complete_n'], a['complete_mean'], a['comoment'],
+            b['complete_n'], b['complete_mean'], b['comoment'],
+            outer=True
+            )
+
+        sketches = None
+        if a['sketches'] is not None:
+            sketches = [x.merge(y) for x, y in zip(a['sketches'], b['sketches'])]
+
+        return ExperimentSummary(
+            groups, self.metrics, self.roles,
+            rows=a['rows'] + b['rows'],
+            units=a['units'] + b['units'],
+            n=n, mean=mean, m2=m2,
+            minimum=np.fmin(a['minimum'], b['minimum']),
+            maximum=np.fmax(a['maximum'], b['maximum']),
+            integral=self.integral & other.integral,
+            complete_n=complete_n, complete_mean=complete_mean, comoment=comoment,
+            sketches=sketches
+            )
+
+    def __add__(self, other):
+        return self.merge(other)
+
+    @classmethod
+    def combine(cls, summaries):
+        summaries = list(summaries)
+        if len(summaries) == 0:
+            raise ValueError('at least one summary is required.')
+        return functools.reduce(cls.merge, summaries)
+
+    def to_dict(self):
+        """JSON-serialisable representation of the summary."""
+        res = {
+            'groups': self.groups.tolist(),
+            'metrics': self.metrics,
+            'roles': self.roles
+            }
+        for name in ('rows', 'units', 'n', 'mean', 'm2', 'minimum', 'maximum', 'complete_n', 'complete_mean',
+                     'comoment'):
+            # missing and infinite values (e.g. the extremes of empty groups) are stored as None
+            array = getattr(self, name)
+            values = array.astype(object)
+            values[~np.isfinite(array)] = None
+            res[name] = values.tolist()
+        res['integral'] = self.integral.tolist()
+        res['sketches'] = None if self.sketches is None else \
+            {'precision': self.sketches[0].precision, 'registers': [s.registers.tolist() for s in self.sketches]}
+        return res
+
+    def to_json(self):
+        return json.dumps(self.to_dict())
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    @classmethod
+    def from_dict(cls, res):
+        res = dict(res)
+        sketches = res.pop('sketches')
+        if sketches is not None:
+            sketches = [HyperLogLog(sketches['precision'], registers) for registers in sketches['registers']]
+
+        arrays = {name: np.array(value, dtype=float if name != 'integral' else bool)
+                  for name, value in res.items() if name not in ('groups', 'metrics', 'roles')}
+        arrays['minimum'] = np.where(np.isnan(arrays['minimum']), np.inf, arrays['minimum'])
+        arrays['maximum'] = np.where(np.isnan(arrays['maximum']), -np.inf, arrays['maximum'])
+
+        return cls(res['groups'], res['metrics'], res['roles'], sketches=sketches, **arrays)
+
+    @property
+    def shape(self):
+        return int(self.rows.sum()), len(self.metrics)
+
+    @property
+    def var(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.m2 / (self.n - 1)
+
+    def group_sizes(self):
+        return pd.Series(self.rows, index=pd.Index(self.groups, name=self.treatment), name='count')
+
+    def group_summary(self, metrics=None):
+        metrics = self.metrics if metrics is None else metrics
+        index = [self.metrics.index(metric) for metric in metrics]
+        n = self.n[:, index]
+        return GroupSummary(self.groups, list(metrics), n, np.where(n > 0, self.mean[:, index], np.nan),
+                            self.var[:, index])
+
+    def unit_counts(self):
+        """Distinct units per group: estimated from the sketches if there are any, and exact per shard otherwise."""
+        if self.sketches is not None:
+            return pd.Series([s.estimate() for s in self.sketches], index=self.groups)
+        return pd.Series(self.units, index=self.groups)
+
+    def covariance(self, group):
+        """Covariance matrix of the metrics in a group, over the rows without missing values."""
+        g = self.groups.tolist().index(group)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = self.comoment[g] / (self.complete_n[g] - 1)
+        return pd.DataFrame(cov, index=self.metrics, columns=self.metrics)
+
+    def metric_types(self, metrics=None):
+        metrics = self.metrics if metrics is None else metrics
+        types = {}
+        for metric in metrics:
+            i = self.metrics.index(metric)
+            low, high = np.min(self.minimum[:, i]), np.max(self.maximum[:, i])
+            if not self.integral[i] or low < 0:
+                types[metric] = 'continuous'
+            else:
+                types[metric] = 'binary' if high <= 1 else 'count'
+        return types
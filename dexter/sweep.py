@@ -0,0 +1,213 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+
+from dexter.stats_func import ttest_from_moments
+
+_TESTS = ('welch', 'student', 'mannwhitney')
+_HANDLING = ('trim', 'winsorize')
+_TRANSFORMS = ('raw', 'log')
+
+
+class SortedGroups:
+    """
+    The values of a metric per group, sorted once, with prefix sums of the (centered) values and squared values on the
+    raw and log scales. Since outliers are the largest values and the log is monotonic, the moments of every
+    combination of outlier cap, trimming or winsorizing and transformation follow from the prefix sums at the cap,
+    without copying or sorting the data again.
+
+    Outliers are the values above the cap quantile of the pooled values. Winsorizing replaces them with the smallest
+    outlier, as ExperimentChecker.handle_outliers does.
+    """
+
+    def __init__(self, values, log_offset=1.):
+        self.values = [np.sort(np.asarray(v, dtype=float)) for v in values]
+        self.pooled = np.sort(np.concatenate(self.values), kind='mergesort')
+        self.log_offset = log_offset
+
+        self.prefix = {}
+        for transform in _TRANSFORMS:
+            scaled = [self._transform(v, transform) for v in self.values]
+            # centering keeps the sums-of-squares variance numerically stable
+            centre = np.mean(self._transform(self.pooled, transform))
+            self.prefix[transform] = centre, [
+                (np.concatenate([[0.], np.cumsum(v - centre)]), np.concatenate([[0.], np.cumsum((v - centre) ** 2)]))
+                for v in scaled
+                ]
+
+    def _transform(self, values, transform):
+        if transform == 'log':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.log(values + self.log_offset)
+        return values
+
+    def cap(self, quantile):
+        """
+        The cap of the outliers and the value that replaces them when winsorizing.
+
+        :return:
+        cap, replacement
+        """
+        if quantile is None:
+            return np.inf, np.nan
+        cap = np.quantile(self.pooled, quantile)
+        above = np.searchsorted(self.pooled, cap, side='right')
+        return cap, self.pooled[above] if above < len(self.pooled) else np.nan
+
+    def moments(self, quantile, handling, transform):
+        """
+        Sizes, means and variances of the groups after handling the outliers and transforming the values.
+
+        :return:
+        n, mean, var: arrays with a value per group
+        """
+        cap, replacement = self.cap(quantile)
+        centre, prefix = self.prefix[transform]
+        fill = self._transform(replacement, transform) - centre
+
+        n, mean, var = (np.empty(len(self.values)) for _ in range(3))
+        for g, (values, (sums, squares)) in enumerate(zip(self.values, prefix)):
+            k = np.searchsorted(values, cap, side='right')
+            n_fill = len(values) - k if handling == 'winsorize' else 0
+            n[g] = k + n_fill
+            total = sums[k] + (n_fill * fill if n_fill else 0.)
+            total_sq = squares[k] + (n_fill * fill ** 2 if n_fill else 0.)
+            mean[g] = centre + total / n[g]
+            var[g] = (total_sq - total ** 2 / n[g]) / (n[g] - 1)
+
+        return n, mean, var
+
+    def handled(self, group, quantile, handling):
+        """The sorted values of a group after handling the outliers (ranks do not depend on the transformation)."""
+        cap, replacement = self.cap(quantile)
+        values = self.values[group]
+        k = np.searchsorted(values, cap, side='right')
+        if handling == 'winsorize' and k < len(values):
+            return np.concatenate([values[:k], np.full(len(values) - k, replacement)])
+        return values[:k]
+
+
+def mannwhitney_sorted(x, y, alternative='two-sided'):
+    """
+    Mann-Whitney U test of two sorted samples, with the normal approximation, tie correction and continuity
+    correction. U counts the pairs in which x is larger, plus half the ties, from binary searches of x in y.
+
+    :return:
+    U-statistic of x and p-value
+    """
+    assert alternative in ['two-sided', 'greater', 'smaller']
+
+    nx, ny = len(x), len(y)
+    u = np.sum(np.searchsorted(y, x, side='left') + np.searchsorted(y, x, side='right')) / 2
+
+    pooled = np.sort(np.concatenate([x, y]), kind='mergesort')
+    ties = np.diff(np.flatnonzero(np.diff(np.concatenate([[np.nan], pooled, [np.nan]])) != 0))
+    n = nx + ny
+    sigma = np.sqrt(nx * ny / 12 * ((n + 1) - np.sum(ties ** 3 - ties) / (n * (n - 1))))
+
+    centred = u - nx * ny / 2
+    if alternative == 'two-sided':
+        z = (np.abs(centred) - .5) / sigma
+        p = min(1., 2 * norm.sf(z))
+    elif alternative == 'greater':
+        p = norm.sf((centred - .5) / sigma)
+    else:
+        p = norm.cdf((centred + .5) / sigma)
+
+    return u, p
+
+
+def specifications(caps=(None, .99, .999), handling=_HANDLING, transforms=_TRANSFORMS, tests=('welch', 'mannwhitney')):
+    """
+    The combinations of analysis choices. Without a cap, no outliers are handled, so handling does not vary.
+    The Mann-Whitney test is the same on every scale, so it is only run on the raw values.
+    """
+    for choice in (handling, transforms, tests):
+        unknown = set(choice) - set(_HANDLING + _TRANSFORMS + _TESTS)
+        if unknown:
+            raise ValueError(f'unknown analysis choices: {", ".join(sorted(unknown))}.')
+
+    specs = []
+    for cap, how, transform, test in product(caps, handling, transforms, tests):
+        how = 'none' if cap is None else how
+        transform = 'raw' if test == 'mannwhitney' else transform
+        spec = (cap, how, transform, test)
+        if spec not in specs:
+            specs.append(spec)
+
+    return specs
+
+
+def robustness_sweep(data, treatment_col, metrics, caps=(None, .99, .999), handling=_HANDLING, transforms=_TRANSFORMS,
+                     tests=('welch', 'mannwhitney'), alpha=.05, alternative='two-sided', log_offset=1.,
+                     executor='thread', max_workers=None):
+    """
+    Evaluates every combination of analysis choices (outlier cap, trimming or winsorizing, raw or log values,
+    parametric or rank test) for every metric and variant against the control (first group), without changing the
+    data. The values are sorted and summed once per metric and shared by all combinations, which run concurrently.
+
+    :return:
+    specification curve: DataFrame with a row per metric, variant and specification, ranked by delta per metric and
+    variant
+    """
+    if executor not in ('thread', 'serial'):
+        raise ValueError(f'executor should be either thread or serial. Got {executor} instead.')
+
+    groups = np.sort(data[treatment_col].unique())
+    specs = specifications(caps, handling, transforms, tests)
+
+    sorted_groups = {}
+    for metric in metrics:
+        values = data[[treatment_col, metric]].dropna()
+        codes = np.searchsorted(groups, values[treatment_col].to_numpy())
+        metric_values = values[metric].to_numpy(dtype=float)
+        sorted_groups[metric] = SortedGroups([metric_values[codes == g] for g in range(len(groups))], log_offset)
+
+    def evaluate(metric, spec):
+        cap, how, transform, test = spec
+        stats = sorted_groups[metric]
+        n, mean, var = stats.moments(cap, how, transform)
+
+        records = []
+        for b in range(1, len(groups)):
+            if test == 'mannwhitney':
+                stat, p = mannwhitney_sorted(stats.handled(b, cap, how), stats.handled(0, cap, how), alternative)
+            else:
+                stat, _, p = ttest_from_moments(mean[b], mean[0], var[b], var[0], n[b], n[0],
+                                                equal_var=test == 'student', alternative=alternative)
+            records.append({
+                'metric': metric,
+                'A': groups[0],
+                'B': groups[b],
+                'cap': cap,
+                'handling': how,
+                'transform': transform,
+                'test': test,
+                'n(A)': n[0],
+                'n(B)': n[b],
+                'mean(A)': mean[0],
+                'mean(B)': mean[b],
+                'delta': mean[b] - mean[0],
+                'statistic': float(stat),
+                'p-value': float(p)
+                })
+        return records
+
+    tasks = [(metric, spec) for metric in metrics for spec in specs]
+    if executor == 'serial':
+        results = [evaluate(*task) for task in tasks]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(lambda task: evaluate(*task), tasks))
+
+    res = pd.DataFrame([record for records in results for record in records])
+    res['significant'] = res['p-value'] <= alpha
+
+    # the specification curve: the specifications ordered by their estimate, per scale of the estimate
+    res = res.sort_values(['metric', 'B', 'transform', 'delta'], kind='stable').reset_index(drop=True)
+    res['rank'] = res.groupby(['metric', 'B', 'transform']).cumcount() + 1
+
+    return res
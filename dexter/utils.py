@@ -1,10 +1,45 @@
+import contextlib
 import functools
 import builtins
+import io
 import itertools
+import sys
+import threading
+from collections import namedtuple
 
 from tabulate import tabulate
 from pandas.core.frame import DataFrame
 import numpy as np
+import pandas as pd
+
+from dexter.stats_func import anova_from_moments
+
+_output = threading.local()
+
+
+def output():
+    """Where dexter prints: the buffer of capture_output() in the current thread, if any, and sys.stdout otherwise."""
+    return getattr(_output, 'buffer', None) or sys.stdout
+
+
+@contextlib.contextmanager
+def capture_output():
+    """
+    Collects what dexter prints in the current thread in a buffer, without replacing sys.stdout, so that concurrent
+    tasks (e.g. pipeline stages or server requests) each get their own output.
+    """
+    previous = getattr(_output, 'buffer', None)
+    _output.buffer = io.StringIO()
+    try:
+        yield _output.buffer
+    finally:
+        _output.buffer = previous
+
+
+def echo(*values, **kwargs):
+    """print() to the output of the current thread (see capture_output)."""
+    builtins.print(*values, file=output(), **kwargs)
+
 
 def strcol(string, modification=None):
     if modification is None:
@@ -48,16 +83,16 @@ def pretty_results(df, floatfmt=".3f", tablefmt='simple', title=None, subtitle=N
     if title is not None:
         title = title.replace('_', ' ').capitalize()
 
-        print(f'\n==========\n{title}\n==========\n')
+        echo(f'\n==========\n{title}\n==========\n')
 
     if subtitle is not None:
-        print(indent(subtitle))
+        echo(indent(subtitle))
 
-    print(indent(tabulate(df, headers="keys", showindex=True, floatfmt=floatfmt, tablefmt=tablefmt), 2))
-    print('')
+    echo(indent(tabulate(df, headers="keys", showindex=True, floatfmt=floatfmt, tablefmt=tablefmt), 2))
+    echo('')
 
     if note is not None:
-        print(indent(note, 2))
+        echo(indent(note, 2))
 
 
 def indent(txt, indents=1):
@@ -78,10 +113,10 @@ def print_nested_dict(dict_obj, indent=0, exclude_keys=[]):
         key = key.capitalize().replace('_', ' ')
 
         if isinstance(value, dict):
-            print(' ' * indent, key)
+            echo(' ' * indent, key)
             print_nested_dict(value, indent + 4, exclude_keys=exclude_keys)
         else:
-            print(' ' * indent, key, ':', value)
+            echo(' ' * indent, key, ':', value)
 
 
 def _customise_res_table(res):
@@ -89,6 +124,8 @@ def _customise_res_table(res):
         'Source': 'Source',
         'A': 'A',
         'B': 'B',
+        'n(A)': 'n(A)',
+        'n(B)': 'n(B)',
         'mean(A)': 'mean(A)',
         'mean(B)': 'mean(B)',
         'diff': 'delta',
@@ -96,15 +133,20 @@ def _customise_res_table(res):
         'DF': 'dof',
         'dof': 'dof',
         'ddof1': 'dof',
+        'ddof2': 'dof (within)',
         'F': 'f-stat',
         'se': 'stderr',
         'H': 'H-stat',
         'T': 't-stat',
+        'z': 'z-stat',
+        'chi2': 'chi2-stat',
         'U': 'u-stat',
         'p-unc': 'p-value',
         'p-tukey': 'p-value',
         'p-corr': 'p-value (adj)',
-        'cohen': 'effect size (d)'
+        'cohen': 'effect size (d)',
+        'cohen-h': 'effect size (h)',
+        'rate-ratio': 'rate ratio'
         }
 
     res = res.copy()
@@ -148,6 +190,7 @@ def pinfo(*values, color: str = None, do_print=True, **kwargs):
     values = tuple(strcol(value, modification=color) for value in values)
     if not do_print:
         return values
+    kwargs.setdefault('file', output())
     builtins.print(*values, **kwargs)
 
 
@@ -185,3 +228,233 @@ def prep_actual_power(data: DataFrame, treatment_col: str, metrics: list) -> Dat
     df_final = df_joined.drop_duplicates(subset=['abs_delta']).drop(columns=['abs_delta'])
 
     return df_final
+
+
+GroupSummary = namedtuple('GroupSummary', ['groups', 'metrics', 'n', 'mean', 'var'])
+
+
+def group_summary(data: DataFrame, treatment_col: str, metrics: list) -> GroupSummary:
+    """
+    Sizes, means and variances of every metric per group, computed in a single groupby pass over the data.
+    The arrays have shape (groups, metrics), with the groups sorted.
+    """
+    stats_df = data.groupby(treatment_col)[metrics].agg(['count', 'mean', 'var']).sort_index()
+
+    n, mean, var = [stats_df.xs(stat, axis=1, level=1)[metrics].to_numpy(dtype=float)
+                    for stat in ('count', 'mean', 'var')]
+
+    return GroupSummary(stats_df.index.to_numpy(), list(metrics), n, mean, var)
+
+
+ClusterSummary = namedtuple('ClusterSummary', ['groups', 'metrics', 'n', 'mean', 'var', 'rows'])
+
+
+def cluster_summary(data: DataFrame, treatment_col: str, unit_col: str, metrics: list) -> ClusterSummary:
+    """
+    Per-group means of every metric for data with repeated rows per unit (e.g. sessions of users), with the units as
+    clusters. The mean is the ratio of the metric total to the number of rows, and its variance is estimated with the
+    delta method over the per-unit sums and row counts, which are aggregated with bincounts over the factorized units
+    instead of a unit-level DataFrame. A unit that appears in several groups is a separate cluster in each of them.
+
+    n is the number of units and var the variance per unit, so that var / n is the squared standard error of the mean
+    and the summary can be used in place of a GroupSummary. The arrays have shape (groups, metrics).
+    """
+    group_codes, groups = pd.factorize(data[treatment_col], sort=True)
+    unit_codes, _ = pd.factorize(data[unit_col])
+    n_groups = len(groups)
+
+    assigned = (group_codes >= 0) & (unit_codes >= 0)
+    cluster_codes, cluster_keys = pd.factorize(unit_codes[assigned].astype(np.int64) * n_groups + group_codes[assigned])
+    cluster_group = cluster_keys % n_groups
+    n_clusters = len(cluster_keys)
+
+    def by_group(weights):
+        return np.bincount(cluster_group, weights=weights, minlength=n_groups)
+
+    shape = (n_groups, len(metrics))
+    n, mean, var, rows = np.zeros(shape), np.zeros(shape), np.zeros(shape), np.zeros(shape)
+
+    for i, metric in enumerate(metrics):
+        values = data[metric].to_numpy(dtype=float)[assigned]
+        valid = ~np.isnan(values)
+        # centering keeps the sums of squares numerically stable and does not change the ratio's variance
+        centre = values[valid].mean()
+
+        y = np.bincount(cluster_codes[valid], weights=values[valid] - centre, minlength=n_clusters)
+        m = np.bincount(cluster_codes[valid], minlength=n_clusters).astype(float)
+
+        units = by_group((m > 0).astype(float))
+        y_sum, m_sum = by_group(y), by_group(m)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ratio = y_sum / m_sum
+            y_mean, m_mean = y_sum / units, m_sum / units
+            y_var = (by_group(y * y) - units * y_mean ** 2) / (units - 1)
+            m_var = (by_group(m * m) - units * m_mean ** 2) / (units - 1)
+            ym_cov = (by_group(y * m) - units * y_mean * m_mean) / (units - 1)
+
+            var[:, i] = (y_var - 2 * ratio * ym_cov + ratio ** 2 * m_var) / m_mean ** 2
+
+        n[:, i], mean[:, i], rows[:, i] = units, ratio + centre, m_sum
+
+    return ClusterSummary(np.asarray(groups), list(metrics), n, mean, var, rows)
+
+
+def pairwise_moments(summary: GroupSummary) -> DataFrame:
+    """
+    Sizes, means and variances of every pair of groups (A < B) per metric, as in prep_actual_power, from a GroupSummary.
+    """
+    a, b = np.triu_indices(len(summary.groups), k=1)
+    frames = []
+    for i, metric in enumerate(summary.metrics):
+        frames.append(DataFrame({
+            'metric': metric,
+            'xgroup': summary.groups[a],
+            'ygroup': summary.groups[b],
+            'xmean': summary.mean[a, i],
+            'xn': summary.n[a, i],
+            'xvar': summary.var[a, i],
+            'ymean': summary.mean[b, i],
+            'yn': summary.n[b, i],
+            'yvar': summary.var[b, i],
+            'delta': summary.mean[a, i] - summary.mean[b, i]
+            }))
+
+    return pd.concat(frames).set_index(['metric', 'xgroup', 'ygroup'])
+
+
+def levene_by_group(data: DataFrame, treatment_col: str, metrics: list):
+    """
+    Levene's test (median-centred, as in scipy and pingouin) for all metrics at once: a one-way ANOVA on the absolute
+    deviations from the group medians, computed from two grouped passes over the data.
+
+    :return:
+    w-statistic and p-value arrays with one value per metric
+    """
+    medians = data.groupby(treatment_col)[metrics].transform('median')
+    deviations = (data[metrics] - medians).abs()
+    deviations[treatment_col] = data[treatment_col]
+
+    summary = group_summary(deviations, treatment_col, metrics)
+    _, _, _, _, w, p = anova_from_moments(summary.n, summary.mean, summary.var)
+
+    return w, p
+
+
+def stratify(series, q=3, max_levels=7):
+    """
+    Strata of a column, to split the experiment by. Numeric columns with more than max_levels distinct values are
+    binned into q quantiles; any other column is used as is. With q=None, no column is binned (e.g. for integer
+    coded categories).
+    """
+    if q is None:
+        return series
+
+    is_numeric = pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+
+    if is_numeric and series.nunique() > max_levels:
+        return pd.qcut(series, q, precision=3, duplicates='drop')
+
+    return series
+
+
+def time_buckets(series, freq='D'):
+    """
+    Integer codes of the time bucket (a fixed frequency, e.g. 'D' for days, 'h' for hours) of every row, counted from
+    the bucket of the earliest timestamp, so that they can be fed to numpy.bincount without hashing. Missing timestamps
+    get code -1. Timezone-aware timestamps are bucketed in their own timezone.
+
+    :return:
+    codes: ndarray, buckets: DatetimeIndex with the start of every bucket
+    """
+    timestamps = pd.DatetimeIndex(pd.to_datetime(series))
+    tz = timestamps.tz
+    # timezone-aware timestamps are bucketed on the wall clock of their own timezone, not in UTC
+    timestamps = timestamps.tz_localize(None).to_numpy().astype('datetime64[ns]')
+    missing = np.isnat(timestamps)
+
+    if missing.all():
+        raise ValueError('there are no timestamps to bucket: all of them are missing.')
+
+    width = pd.tseries.frequencies.to_offset(freq).nanos
+    start = pd.Timestamp(timestamps[~missing].min()).floor(freq)
+
+    codes = (timestamps.view('i8') - start.value) // width
+    codes[missing] = -1
+
+    buckets = pd.date_range(start, periods=int(codes.max()) + 1, freq=freq)
+    if tz is not None:
+        buckets = buckets.tz_localize(tz, ambiguous=np.ones(len(buckets), dtype=bool), nonexistent='shift_forward')
+
+    return codes, buckets
+
+
+def metric_type(series):
+    """
+    'binary' for 0/1 (or boolean) metrics, 'count' for other non-negative integer metrics, 'continuous' otherwise.
+    Missing values are ignored.
+    """
+    if pd.api.types.is_bool_dtype(series):
+        return 'binary'
+
+    if not pd.api.types.is_numeric_dtype(series):
+        return 'continuous'
+
+    values = series.to_numpy()
+    if not pd.api.types.is_integer_dtype(values.dtype):
+        values = values[~np.isnan(values)]
+        if len(values) == 0 or not np.all(np.mod(values, 1) == 0):
+            return 'continuous'
+
+    if len(values) == 0 or values.min() < 0:
+        return 'continuous'
+
+    return 'binary' if values.max() <= 1 else 'count'
+
+
+def compact_metric(series, kind):
+    """
+    Smallest signed integer representation of a binary or count metric without missing values, so that differences
+    of the values do not wrap around. Any other metric is returned as is.
+    """
+    if kind not in ('binary', 'count') or series.isna().any() or pd.api.types.is_bool_dtype(series):
+        return series
+
+    return pd.to_numeric(series, downcast='integer')
+
+
+def popcount(packed):
+    """Number of set bits in an array of bytes, e.g. from numpy.packbits."""
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(packed).sum(dtype=np.int64))
+    return int(_POPCOUNT_TABLE[packed].sum(dtype=np.int64))
+
+
+_POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+BinaryCounts = namedtuple('BinaryCounts', ['groups', 'metrics', 'n', 'successes'])
+
+
+def binary_counts(data: DataFrame, treatment_col: str, metrics: list) -> BinaryCounts:
+    """
+    Sizes and numbers of successes of binary metrics per group. The group memberships and the metrics are bit-packed
+    (one bit per row), so that every count is the popcount of the AND of two packed arrays.
+    The arrays have shape (groups, metrics), with the groups sorted.
+    """
+    codes, groups = pd.factorize(data[treatment_col], sort=True)
+    group_bits = [np.packbits(codes == g) for g in range(len(groups))]
+
+    n = np.zeros((len(groups), len(metrics)))
+    successes = np.zeros((len(groups), len(metrics)))
+
+    for i, metric in enumerate(metrics):
+        values = data[metric].to_numpy(dtype=float)
+        valid_bits = np.packbits(~np.isnan(values))
+        success_bits = np.packbits(values == 1)
+
+        for g, bits in enumerate(group_bits):
+            n[g, i] = popcount(bits & valid_bits)
+            successes[g, i] = popcount(bits & success_bits)
+
+    return BinaryCounts(np.asarray(groups), list(metrics), n, successes)
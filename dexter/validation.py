@@ -2,7 +2,7 @@ import warnings
 import pandas
 from numpy import sort
 
-from dexter.utils import strcol
+from dexter.utils import echo, strcol
 from abc import ABC, abstractmethod
 
 warnings.formatwarning = lambda msg, *args, **kwargs: f'{msg}\n'
@@ -42,8 +42,8 @@ class _DataFrame(_BaseValidator):
 
 class _ExperimentDataFrame(_BaseValidator):
     def validate(self, value):
-        if value.__class__.__name__ != 'ExperimentDataFrame' and value is not None:
-            raise ValueError(f'dataframe should be of type Dexter ExperimentDataFrame, '
+        if value.__class__.__name__ not in ('ExperimentDataFrame', 'ExperimentSummary') and value is not None:
+            raise ValueError(f'dataframe should be of type Dexter ExperimentDataFrame or ExperimentSummary, '
                              f'but got {value.__class__.__name__} instead.')
 
 
@@ -100,11 +100,12 @@ class _Proportion(_Number):
             raise ValueError('Input should be a proportion: a number between, and including, 0 and 1.')
 
 
-def _post_validate_experiment_dataframe(obj):
-    groups = sort(obj.data[obj.treatment].unique())
+def _post_validate_experiment_dataframe(obj, data=None):
+    data = obj.data if data is None else data
+    groups = sort(data[obj.treatment].unique())
 
-    if obj.data.shape[0] > 2 * 10 ** 6:
-        print(strcol('Info: it is recommended to delete the original DataFrame after initialising it as '
+    if data.shape[0] > 2 * 10 ** 6:
+        echo(strcol('Info: it is recommended to delete the original DataFrame after initialising it as '
                      'an ExperimentDataFrame, to save working memory', 'warning'))
 
     groups_threshold = 7
@@ -117,7 +118,11 @@ def _post_validate_experiment_dataframe(obj):
         raise ValueError('The number of expected proportions provided does not match'
                          'the number of groups in the treatment column.')
 
-    if obj.data[obj.experiment_unit].nunique() < obj.data.shape[0]:
+    if obj.timestamp is not None and obj.timestamp not in data.columns:
+        raise ValueError(f'The timestamp column {obj.timestamp} is not in the DataFrame.')
+
+    if data[obj.experiment_unit].nunique() < data.shape[0]:
         warnings.warn('There seems to be repeating experiment units. This causes a problem for most statistical '
                       'analyses. Consider investigating the cause for this. If reasonable, you can handle this case'
-                      'with the Experiment.handle_crossover() method.')
+                      'with the Experiment.handle_crossover() method, or analyse the units as clusters '
+                      '(clustered=True).')
@@ -1,12 +1,18 @@
 import seaborn as sns
 import pandas as pd
+import numpy as np
+import matplotlib.pyplot as plt
 from numpy import mean
 from itertools import chain, repeat
+from scipy.stats import t
+
+from dexter.instrumentation import instrumented
 
 
 class ExperimentVisualiser:
     def __init__(self, experiment):
         self.experiment = experiment
+        self._bin_edges = {}
 
     def _plot_group_balance(self):
         source = self.experiment.assumptions.get_log()
@@ -44,17 +50,132 @@ class ExperimentVisualiser:
 
         sns.catplot(data=df_melt, x='Statistic', y='Value', hue='Stratum', col='Metric', kind='bar')
 
-    def plot_conditional(self, y, x, group):
+    def _get_bin_edges(self, x, q):
+        """Quantile bin edges of a metric, cached until the data of the experiment changes (see revision)."""
+        data = self.experiment.data
+        key = (x, q, data.revision)
+
+        if key not in self._bin_edges:
+            edges = np.nanquantile(data[x].to_numpy(dtype=float), np.linspace(0, 1, q + 1))
+            self._bin_edges[key] = np.unique(edges)
+
+        return self._bin_edges[key]
+
+    def conditional_aggregates(self, y, x, group, q=10, ci=.95):
+        """
+        Mean of y per group and quantile bin of x, with confidence bands. All statistics come from a single pass of
+        bincounts over the data, so the result is a small frame of (groups x bins) rows.
+
+        :return:
+        DataFrame with the group, bin, mean of x, number of rows, mean of y and its confidence interval
+        """
         source = self.experiment.data
+        edges = self._get_bin_edges(x, q)
+        n_bins = len(edges) - 1
+
+        x_values = source[x].to_numpy(dtype=float)
+        y_values = source[y].to_numpy(dtype=float)
+        group_codes, groups = pd.factorize(source[group], sort=True)
+
+        # right-closed bins with the lowest edge included, as in pandas.qcut
+        bin_codes = np.clip(np.searchsorted(edges, x_values, side='left') - 1, 0, n_bins - 1)
+
+        valid = ~(np.isnan(x_values) | np.isnan(y_values)) & (group_codes >= 0)
+        keys = group_codes[valid] * n_bins + bin_codes[valid]
+        size = len(groups) * n_bins
+
+        n = np.bincount(keys, minlength=size)
+        x_sum = np.bincount(keys, weights=x_values[valid], minlength=size)
+        y_sum = np.bincount(keys, weights=y_values[valid], minlength=size)
+        y_sum_sq = np.bincount(keys, weights=y_values[valid] ** 2, minlength=size)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            y_mean = y_sum / n
+            y_var = (y_sum_sq - n * y_mean ** 2) / (n - 1)
+            margin = t.ppf(.5 + ci / 2, n - 1) * np.sqrt(y_var / n)
+
+        intervals = pd.IntervalIndex.from_breaks(edges, closed='right')
+
+        res = pd.DataFrame({
+            group: np.repeat(groups, n_bins),
+            x: np.tile(intervals.astype(str), len(groups)),
+            f'mean({x})': x_sum / n,
+            'n': n,
+            y: y_mean,
+            'ci low': y_mean - margin,
+            'ci high': y_mean + margin
+            })
+
+        return res.loc[res['n'] > 0].reset_index(drop=True)
+
+    @instrumented('plot_conditional')
+    def plot_conditional(self, y, x, group, q=10, ci=.95, scatter=False, max_points=5000, seed=None, ax=None):
+        """
+        Plots the mean of y per quantile bin of x for every group, with confidence bands. The plot is drawn from
+        conditional_aggregates(), so its cost does not grow with the size of the experiment.
+
+        With scatter=True, a random sample of at most max_points rows is drawn underneath the lines.
+        """
+        res = self.conditional_aggregates(y, x, group, q=q, ci=ci)
+        ax = plt.gca() if ax is None else ax
+
+        if scatter:
+            source = self.experiment.data.data
+            rng = np.random.default_rng(seed)
+            sample = source.iloc[np.sort(rng.choice(len(source), size=min(max_points, len(source)), replace=False))]
+
+            for value, frame in sample.groupby(group, sort=True):
+                ax.scatter(frame[x], frame[y], s=4, alpha=.2)
+            ax.set_prop_cycle(None)
+
+        for value, frame in res.groupby(group, sort=True):
+            ax.plot(frame[f'mean({x})'], frame[y], marker='o', label=str(value))
+            ax.fill_between(frame[f'mean({x})'], frame['ci low'], frame['ci high'], alpha=.2)
+
+        ax.set(xlabel=x, ylabel=y, title=f'Mean {y} by {x} ({ci:.0%} confidence bands)')
+        ax.legend(title=group)
+
+        return ax
+
+    @instrumented('plot_lift_over_time')
+    def plot_lift_over_time(self, metric, kind='cumulative', relative=False, ax=None):
+        """
+        Plots the lift of every variant over the control per time bucket or cumulatively, with its confidence band,
+        from the results of ExperimentAnalyser.lift_over_time() (which is run with its defaults if needed).
+        kind is 'per bucket' or 'cumulative'.
+        """
+        res = self.experiment.analyser.get_log('lift_over_time')
+        if res is None or metric not in set(res['metric']):
+            res = self.experiment.analyser.lift_over_time(metrics=[metric])
+
+        kinds = res['kind'].unique()
+        if kind not in kinds:
+            raise ValueError(f'kind should be one of: {", ".join(kinds)}')
+
+        res = res.loc[(res['metric'] == metric) & (res['kind'] == kind)]
+        prefix = 'relative ' if relative else ''
+        ax = plt.gca() if ax is None else ax
+
+        for variant, frame in res.groupby('B', sort=True):
+            ax.plot(frame['bucket'], frame[f'{prefix}lift'], marker='o', label=str(variant))
+            ax.fill_between(frame['bucket'], frame[f'{prefix}ci low'], frame[f'{prefix}ci high'], alpha=.2)
 
-        bins = pd.qcut(source[x], q=10)
+        ax.axhline(0, color='grey', linestyle='--', linewidth=1)
+        ax.set(xlabel='', ylabel=f'{prefix}lift', title=f'{kind.capitalize()} {prefix}lift of {metric}')
+        ax.legend(title='variant')
 
-        res = source.groupby([group, bins])[y].mean().reset_index()
+        return ax
 
-        res[x] = res[x].astype(str)
+    @instrumented('plot_power_curve')
+    def plot_power_curve(self, power):
+        """Plots the power curves returned by Experiment.simulate_power(), one line per sample size."""
+        power = power.copy()
+        power['n'] = power['n'].astype(str)
 
-        sns.lineplot(y=res[y], x=res[x], hue=res[group])
+        sns.lineplot(data=power, x='lift', y='power', hue='n', marker='o') \
+            .set(title=f'Simulated power ({power["test"].iloc[0]})')
 
+    @instrumented('plot_assumption')
     def plot_assumption(self, assumption):
         source = self.experiment.assumptions.get_log()
         assumptions = source.keys()
@@ -0,0 +1,353 @@
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from numbers import Number
+
+import numpy as np
+import pandas as pd
+
+from dexter.stats_func import meta_analysis
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS experiments (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    start_date TEXT,
+    end_date TEXT,
+    expected_delta REAL,
+    roll_out_percent REAL,
+    stored_at TEXT
+    );
+CREATE TABLE IF NOT EXISTS parameters (
+    experiment_id INTEGER NOT NULL REFERENCES experiments(id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value REAL,
+    text TEXT
+    );
+CREATE TABLE IF NOT EXISTS checks (
+    experiment_id INTEGER NOT NULL REFERENCES experiments(id) ON DELETE CASCADE,
+    assumption TEXT NOT NULL,
+    checked INTEGER,
+    passed INTEGER,
+    handled INTEGER
+    );
+CREATE TABLE IF NOT EXISTS diagnostics (
+    experiment_id INTEGER NOT NULL REFERENCES experiments(id) ON DELETE CASCADE,
+    assumption TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value REAL,
+    text TEXT
+    );
+CREATE TABLE IF NOT EXISTS results (
+    experiment_id INTEGER NOT NULL REFERENCES experiments(id) ON DELETE CASCADE,
+    metric TEXT,
+    analysis TEXT NOT NULL,
+    row TEXT,
+    field TEXT NOT NULL,
+    value REAL,
+    text TEXT
+    );
+CREATE TABLE IF NOT EXISTS group_stats (
+    experiment_id INTEGER NOT NULL REFERENCES experiments(id) ON DELETE CASCADE,
+    metric TEXT NOT NULL,
+    grp TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    n REAL,
+    mean REAL,
+    var REAL
+    );
+CREATE INDEX IF NOT EXISTS parameters_key ON parameters (key, experiment_id);
+CREATE INDEX IF NOT EXISTS checks_assumption ON checks (assumption, experiment_id);
+CREATE INDEX IF NOT EXISTS diagnostics_key ON diagnostics (assumption, key, experiment_id);
+CREATE INDEX IF NOT EXISTS results_metric ON results (metric, analysis, field, experiment_id);
+CREATE INDEX IF NOT EXISTS results_experiment ON results (experiment_id);
+CREATE INDEX IF NOT EXISTS group_stats_metric ON group_stats (metric, position, experiment_id);
+"""
+
+_HISTORY = """
+SELECT e.id AS experiment_id, e.name AS experiment, e.start_date AS start, e.end_date AS end,
+       a.grp AS A, b.grp AS B, a.n AS "n(A)", b.n AS "n(B)", a.mean AS "mean(A)", b.mean AS "mean(B)",
+       a.var AS "var(A)", b.var AS "var(B)"
+FROM group_stats AS b
+JOIN group_stats AS a ON a.experiment_id = b.experiment_id AND a.metric = b.metric AND a.position = 0
+JOIN experiments AS e ON e.id = b.experiment_id
+WHERE b.metric = ? AND b.position > 0
+"""
+
+
+def _value(x):
+    """Splits a value into the numeric and text columns of the warehouse."""
+    if isinstance(x, (bool, np.bool_, Number)) and not isinstance(x, complex):
+        x = float(x)
+        return (None if np.isnan(x) else x), None
+    if x is None or x is pd.NaT:
+        return None, None
+    if isinstance(x, (list, tuple, np.ndarray)):
+        return None, json.dumps(np.asarray(x).tolist())
+    return None, str(x)
+
+
+def _flatten(obj, prefix=''):
+    """Flattens nested dicts, lists and arrays into (key, value) pairs, with the keys joined by slashes."""
+    if isinstance(obj, pd.DataFrame):
+        obj = obj.to_dict()
+    elif isinstance(obj, pd.Series):
+        obj = obj.to_dict()
+
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, (list, tuple, np.ndarray)):
+        items = enumerate(obj)
+    else:
+        yield prefix, obj
+        return
+
+    for key, value in items:
+        yield from _flatten(value, f'{prefix}/{key}' if prefix else str(key))
+
+
+def _table_rows(table, field=None):
+    """
+    (row, field, value) triplets of a result table: a DataFrame, its to_dict() blob of columns, or a dict of scalars
+    (e.g. the probabilities of being best per group).
+    """
+    if isinstance(table, pd.DataFrame):
+        if not isinstance(table.index, pd.RangeIndex):
+            table = table.reset_index()
+        table = table.to_dict()
+
+    if not isinstance(table, dict):
+        yield None, field, table
+        return
+
+    for column, values in table.items():
+        if isinstance(values, dict):
+            for row, value in values.items():
+                yield str(row), str(column), value
+        else:
+            yield str(column), field, values
+
+
+def _result_tables(analyses):
+    """(metric, analysis, table) of the analyses log, in which a table is either stored per metric or on its own."""
+    for key, value in analyses.items():
+        if isinstance(value, dict) and all(isinstance(v, (dict, pd.DataFrame)) for v in value.values()):
+            for analysis, table in value.items():
+                yield key, analysis, table
+        else:
+            yield None, key, value
+
+
+class ResultsWarehouse:
+    """
+    Local store of the results, diagnostics and parameters of experiments in SQLite, for queries across experiments
+    (e.g. the history of a metric or a meta-analysis of its effects) without running the analyses again.
+
+    Results are normalised into indexed tables in long format (one row per value) and written with bulk inserts, in
+    a single transaction per experiment. The sizes, means and variances of every metric per group are stored as well,
+    so that effects and their standard errors can be compared across experiments whatever test was run.
+
+    Storing an experiment with the name of a stored experiment replaces it. A warehouse can be shared by threads,
+    which use its connection one at a time.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.path = str(path)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self._connection.execute('PRAGMA foreign_keys = ON')
+        if self.path != ':memory:':
+            self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return pd.read_sql_query(sql, self._connection, params=params)
+
+    def store(self, experiment, metrics=None, parameters=None):
+        """
+        Writes the experiment, its roles and transformations, the assumption checks, the analyses (as logged by the
+        last compare()) and the group statistics of the metrics. Further parameters, e.g. the arguments of compare(),
+        can be passed as a dict.
+
+        :return:
+        id of the experiment in the warehouse
+        """
+        data = experiment.data
+        metrics = data.metrics if metrics is None else metrics
+
+        params = {
+            'success_metric': data.success_metric,
+            'health_metrics': data.health_metrics,
+            'learning_metrics': data.learning_metrics,
+            'experiment_unit': data.experiment_unit,
+            'treatment': data.treatment,
+            'expected_proportions': data.expected_proportions,
+            'transformations': experiment.analyser.get_log('transformations'),
+            **(parameters or {})
+            }
+
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM experiments WHERE name = ?', (experiment.experiment_name,))
+            cursor = self._connection.execute(
+                'INSERT INTO experiments (name, start_date, end_date, expected_delta, roll_out_percent, stored_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (experiment.experiment_name, experiment.start, experiment.end, experiment.expected_delta,
+                 experiment.roll_out_percent, datetime.now(timezone.utc).isoformat())
+                )
+            experiment_id = cursor.lastrowid
+
+            self._connection.executemany(
+                'INSERT INTO parameters VALUES (?, ?, ?, ?)',
+                ((experiment_id, key, *_value(value)) for key, value in _flatten(params))
+                )
+
+            checks = experiment.assumptions.get_log()
+            self._connection.executemany(
+                'INSERT INTO checks VALUES (?, ?, ?, ?, ?)',
+                ((experiment_id, assumption, *(_value(log['status'][s])[0] for s in ('checked', 'passed', 'handled')))
+                 for assumption, log in checks.items())
+                )
+            self._connection.executemany(
+                'INSERT INTO diagnostics VALUES (?, ?, ?, ?, ?)',
+                ((experiment_id, assumption, key, *_value(value))
+                 for assumption, log in checks.items() for key, value in _flatten(log['diagnostics']))
+                )
+
+            self._connection.executemany(
+                'INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((experiment_id, metric, analysis, row, field, *_value(value))
+                 for metric, analysis, table in _result_tables(experiment.analyser.get_log('analyses'))
+                 for row, field, value in _table_rows(table, analysis))
+                )
+
+            summary = data.group_summary(metrics)
+            self._connection.executemany(
+                'INSERT INTO group_stats VALUES (?, ?, ?, ?, ?, ?, ?)',
+                ((experiment_id, metric, str(group), position, *(_value(x[position, j])[0] for x in
+                                                                  (summary.n, summary.mean, summary.var)))
+                 for j, metric in enumerate(summary.metrics) for position, group in enumerate(summary.groups))
+                )
+
+        return experiment_id
+
+    def delete(self, experiment_name):
+        with self._lock, self._connection:
+            self._connection.execute('DELETE FROM experiments WHERE name = ?', (experiment_name,))
+
+    def experiments(self):
+        return self.query('SELECT * FROM experiments ORDER BY start_date, id')
+
+    def parameters(self, key=None):
+        sql = 'SELECT e.name AS experiment, p.key, p.value, p.text FROM parameters AS p ' \
+              'JOIN experiments AS e ON e.id = p.experiment_id'
+        return self.query(sql + ' WHERE p.key = ?', (key,)) if key is not None else self.query(sql)
+
+    def checks(self, assumption=None):
+        sql = 'SELECT e.name AS experiment, c.assumption, c.checked, c.passed, c.handled FROM checks AS c ' \
+              'JOIN experiments AS e ON e.id = c.experiment_id'
+        if assumption is not None:
+            return self.query(sql + ' WHERE c.assumption = ?', (assumption,))
+        return self.query(sql)
+
+    def diagnostics(self, assumption=None, key=None):
+        sql = 'SELECT e.name AS experiment, d.assumption, d.key, d.value, d.text FROM diagnostics AS d ' \
+              'JOIN experiments AS e ON e.id = d.experiment_id WHERE 1 = 1'
+        params = []
+        for column, value in (('d.assumption', assumption), ('d.key', key)):
+            if value is not None:
+                sql += f' AND {column} = ?'
+                params.append(value)
+        return self.query(sql, params)
+
+    def results(self, metric=None, analysis=None, experiment_name=None, wide=True):
+        """
+        The stored result tables, filtered by metric, analysis and experiment. With wide=True, every result table
+        gets its columns back (one row per experiment, metric, analysis and row of the table).
+        """
+        sql = 'SELECT e.name AS experiment, r.metric, r.analysis, r.row, r.field, r.value, r.text FROM results AS r ' \
+              'JOIN experiments AS e ON e.id = r.experiment_id WHERE 1 = 1'
+        params = []
+        for column, value in (('r.metric', metric), ('r.analysis', analysis), ('e.name', experiment_name)):
+            if value is not None:
+                sql += f' AND {column} = ?'
+                params.append(value)
+
+        res = self.query(sql + ' ORDER BY e.start_date, e.id', params)
+        if not wide:
+            return res
+
+        res['value'] = res['value'].astype(object).where(res['text'].isna(), res['text'])
+        keys = ['experiment', 'metric', 'analysis', 'row']
+        return res.pivot_table(index=keys, columns='field', values='value', aggfunc='first', dropna=False,
+                               sort=False).dropna(how='all').reset_index().rename_axis(columns=None)
+
+    def metric_history(self, metric, last=None, relative=False):
+        """
+        Effect of every variant on a metric over the control (the first group) in the stored experiments, ordered by
+        start date, from the group statistics. The stderr is Welch's; with relative=True the delta is relative to the
+        mean of the control and its stderr follows from the delta method.
+
+        :param last: only the last experiments
+        """
+        sql = _HISTORY + ' ORDER BY e.start_date, e.id, b.position'
+        params = [metric]
+        if last is not None:
+            sql = _HISTORY + ' AND e.id IN (SELECT id FROM experiments ORDER BY start_date DESC, id DESC LIMIT ?)' \
+                             ' ORDER BY e.start_date, e.id, b.position'
+            params.append(int(last))
+
+        res = self.query(sql, params)
+
+        var_a, var_b = res['var(A)'] / res['n(A)'], res['var(B)'] / res['n(B)']
+        res['delta'] = res['mean(B)'] - res['mean(A)']
+        res['stderr'] = np.sqrt(var_a + var_b)
+
+        if relative:
+            res['delta'] = res['delta'] / res['mean(A)']
+            res['stderr'] = np.sqrt(var_b / res['mean(A)'] ** 2 + res['mean(B)'] ** 2 * var_a / res['mean(A)'] ** 4)
+
+        return res.drop(columns=['var(A)', 'var(B)'])
+
+    def meta_analysis(self, metric, variant=None, last=None, relative=False, ci=.95):
+        """
+        Fixed and random effects (DerSimonian-Laird) meta-analysis of the effect of the variants on a metric across the
+        stored experiments. Relative effects (relative=True) can be pooled across experiments whose metric has
+        different scales.
+
+        :param variant: only the given variant (the stored groups are text)
+        """
+        history = self.metric_history(metric, last=last, relative=relative)
+        if variant is not None:
+            history = history[history['B'] == str(variant)]
+        stderr = history['stderr'].astype(float)
+        history = history[np.isfinite(stderr) & (stderr > 0)]
+
+        if history.empty:
+            raise ValueError(f'there are no stored effects of metric {metric} to pool.')
+
+        fixed, random, q, q_p, tau2, i2 = meta_analysis(history['delta'], history['stderr'], ci=ci)
+
+        res = pd.DataFrame(
+            [fixed, random],
+            index=pd.Index(['fixed', 'random'], name='model'),
+            columns=['estimate', 'stderr', 'ci low', 'ci high', 'z-stat', 'p-value']
+            )
+        res['experiments'] = history['experiment_id'].nunique()
+        res['effects'] = len(history)
+        res['Q'] = q
+        res['Q p-value'] = q_p
+        res['tau2'] = [0., tau2]
+        res['I2'] = i2
+
+        return res
@@ -0,0 +1,51 @@
+import pandas as pd
+import pytest
+
+from conftest import make_experiment, make_timed_experiment
+from dexter.utils import time_buckets
+
+
+class TestSampleRatioMismatch(object):
+    def test_balance_check_uses_counts(self):
+        experiment = make_timed_experiment(start_day=10)
+        experiment.assumptions.check_groups_balance()
+
+        assert not experiment.assumptions.get_log()['group_balance']['status']['passed']
+
+    def test_first_imbalanced_bucket(self):
+        experiment = make_timed_experiment(start_day=10)
+        res = experiment.assumptions.check_srm_over_time(freq='D')
+
+        diagnostics = experiment.assumptions.get_log()['group_balance']['diagnostics']
+        assert len(res) == 14
+        assert res[['n(0)', 'n(1)']].to_numpy().sum() == 70000
+        assert diagnostics['first imbalanced bucket'] == pd.Timestamp('2021-01-11')
+        assert res['cumulative p-value'].iloc[9] > res['cumulative p-value'].iloc[-1]
+
+    def test_no_imbalance(self):
+        experiment = make_timed_experiment()
+        res = experiment.assumptions.check_srm_over_time(freq='h')
+
+        assert len(res) == 14 * 24
+        assert experiment.assumptions.get_log()['group_balance']['diagnostics']['first imbalanced bucket'] is None
+
+    def test_requires_timestamp(self, experiment):
+        with pytest.raises(Exception):
+            experiment.assumptions.check_srm_over_time()
+
+    def test_timestamps_in_their_timezone(self):
+        df = make_timed_experiment(n=2000).data.data.rename(columns={'ts': 'timestamp'})
+        df['timestamp'] = df['timestamp'].dt.tz_localize('Europe/Amsterdam')
+        experiment = make_experiment(df, success_metric=['revenue'], health_metric=[], learning_metrics=[],
+                                     timestamp='timestamp')
+
+        res = experiment.assumptions.check_srm_over_time(freq='D')
+        assert len(res) == 14 and res[['n(0)', 'n(1)']].to_numpy().sum() == 2000
+        assert res.index[0] == pd.Timestamp('2021-01-01', tz='Europe/Amsterdam')
+
+    def test_missing_timestamps(self):
+        with pytest.raises(ValueError):
+            time_buckets(pd.Series([pd.NaT, pd.NaT]))
+
+        codes, buckets = time_buckets(pd.Series([pd.NaT, pd.Timestamp('2021-01-02 10:00')]))
+        assert codes.tolist() == [-1, 0] and len(buckets) == 1
@@ -0,0 +1,62 @@
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import beta, norm
+
+from conftest import make_experiment
+
+
+def bayes_experiment(n=20000, n_groups=3, n_metrics=4, seed=0):
+    rng = np.random.default_rng(seed)
+    group = rng.integers(0, n_groups, size=n)
+    df = pd.DataFrame(rng.normal(size=(n, n_metrics)) + .02 * group[:, None],
+                      columns=[f'm{i}' for i in range(n_metrics)])
+    df['converted'] = (rng.random(n) < .1 + .005 * group).astype(int)
+    df['group'] = group
+    df['userid'] = np.arange(n)
+
+    experiment = make_experiment(df, 'bayes', success_metric=['converted'], health_metric=['m0'],
+                                 learning_metrics=[f'm{i}' for i in range(1, n_metrics)],
+                                 expected_proportions=[1 / 8] * 8 if n_groups == 8 else [.3, .3, .4])
+
+    return experiment, df
+
+
+class TestBayesianComparison(object):
+    def test_posteriors(self):
+        experiment, df = bayes_experiment()
+        results = experiment.analyser.compare(metrics=['converted', 'm0'], parametric='bayes', seed=1, draws=40000)
+
+        stats = df.groupby('group').m0.agg(['mean', 'var', 'count'])
+        se = np.sqrt(stats['var'] / stats['count'])
+        lift = stats['mean'][2] - stats['mean'][0]
+        normal = pd.DataFrame(results['m0']['bayes']).set_index('B')
+        assert normal.loc[2, 'P(B beats A)'] == pytest.approx(norm.cdf(lift / np.hypot(se[0], se[2])))
+        assert sum(results['m0']['P(best)'].values()) == pytest.approx(1)
+
+        # Monte Carlo against a direct simulation of the Beta posteriors
+        counts = df.groupby('group').converted.agg(['sum', 'count'])
+        rng = np.random.default_rng(2)
+        a, b = (beta.rvs(1 + counts['sum'][g], 1 + counts['count'][g] - counts['sum'][g], size=200000,
+                         random_state=rng) for g in (0, 1))
+        binary = pd.DataFrame(results['converted']['bayes']).set_index('B')
+        assert binary.loc[1, 'P(B beats A)'] == pytest.approx(np.mean(b > a), abs=.01)
+        assert binary.loc[1, 'expected loss'] == pytest.approx(np.mean(np.maximum(a - b, 0)), rel=.05)
+
+    def test_lower_is_better(self):
+        experiment, _ = bayes_experiment()
+        higher = experiment.analyser.compare(metrics=['m0'], parametric='bayes', seed=1)['m0']
+        lower = experiment.analyser.compare(metrics=['m0'], parametric='bayes', seed=1, alternative='smaller')['m0']
+
+        assert np.add(higher['bayes']['P(B beats A)'][0], lower['bayes']['P(B beats A)'][0]) == pytest.approx(1)
+
+    def test_many_variants_and_metrics(self):
+        experiment, _ = bayes_experiment(n=16000, n_groups=8, n_metrics=100)
+
+        results = experiment.analyser.compare(metrics=experiment.data.metrics, parametric='bayes', seed=1)
+        assert len(results) == 101
+
+        for option in ({'clustered': True}, {'by': 'm0'}, {'wide': True}):
+            with pytest.raises(AttributeError):
+                experiment.analyser.compare(metrics=['m0'], parametric='bayes', **option)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_experiment
+from dexter.utils import cluster_summary
+
+
+def session_experiment(n_users=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    sessions = rng.integers(1, 8, size=n_users)
+    user = np.repeat(np.arange(n_users), sessions)
+    group = rng.integers(0, 2, size=n_users)[user]
+    # a strong user effect makes the sessions of a user correlated
+    revenue = rng.normal(10, 5, size=n_users)[user] + rng.normal(0, 1, size=len(user))
+
+    df = pd.DataFrame({'group': group, 'revenue': revenue, 'userid': user})
+
+    with pytest.warns(UserWarning):
+        experiment = make_experiment(df, 'sessions', success_metric=['revenue'], health_metric=[], learning_metrics=[])
+
+    return experiment, df
+
+
+class TestClusterSummary(object):
+    def test_delta_method(self):
+        _, df = session_experiment()
+        summary = cluster_summary(df, 'group', 'userid', ['revenue'])
+
+        units = df.groupby(['group', 'userid']).revenue.agg(['sum', 'count'])
+        for g in (0, 1):
+            y, m = units.loc[g, 'sum'].to_numpy(), units.loc[g, 'count'].to_numpy()
+            ratio = y.sum() / m.sum()
+            residual = (y - ratio * m) / m.mean()
+
+            assert summary.n[g, 0] == len(y)
+            assert summary.mean[g, 0] == pytest.approx(ratio)
+            assert summary.var[g, 0] == pytest.approx(residual.var(ddof=1))
+
+    def test_one_row_per_unit(self, dummy_df):
+        summary = cluster_summary(dummy_df, 'group', 'userid', ['revenue'])
+        expected = dummy_df.groupby('group').revenue.agg(['count', 'mean', 'var'])
+
+        assert summary.n[:, 0] == pytest.approx(expected['count'].to_numpy())
+        assert summary.mean[:, 0] == pytest.approx(expected['mean'].to_numpy())
+        assert summary.var[:, 0] == pytest.approx(expected['var'].to_numpy())
+
+
+class TestClusteredAnalyses(object):
+    def test_compare_and_power(self):
+        experiment, df = session_experiment()
+
+        res = pd.DataFrame(experiment.analyser.compare(clustered=True)['revenue']['clustered'])
+        assert res['n(A)'].iloc[0] + res['n(B)'].iloc[0] == df.userid.nunique()
+
+        clustered = experiment.mde(clustered=True)[0].mde
+        naive = experiment.mde()[0].mde
+        assert clustered > naive
+
+        assert experiment.required_n(clustered=True)[0].n > 0
@@ -0,0 +1,57 @@
+import numpy as np
+import pingouin as pg
+import pytest
+
+from conftest import make_dummy_df, make_experiment
+from dexter.analyser import MultipleComparison
+from dexter.utils import levene_by_group
+
+df = make_dummy_df(n_groups=4)
+
+exp_df = make_experiment(df, success_metric=['revenue'], health_metric=['vips'], learning_metrics='leads').data
+
+
+def comparison(**kwargs):
+    calculator = MultipleComparison(
+        data=exp_df, metrics=['revenue', 'vips'], treatment='group', alpha=.05, padjust='holm', parametric=True,
+        alternative='two-sided', paired=False, groups=np.arange(4), **kwargs
+        )
+    calculator.run()
+    return calculator.results
+
+
+def column(res, name):
+    return np.array(list(res[name].values()))
+
+
+class TestMultipleComparison(object):
+    def test_levene_matches_pingouin(self):
+        _, p = levene_by_group(df, 'group', ['revenue', 'vips'])
+        expected = [pg.homoscedasticity(df, dv=m, group='group').loc['levene', 'pval'] for m in ['revenue', 'vips']]
+        assert p == pytest.approx(expected)
+
+    @pytest.mark.parametrize('posthoc, pingouin_func', [
+        ('tukey', pg.pairwise_tukey),
+        ('gameshowell', pg.pairwise_gameshowell)
+        ])
+    def test_posthoc_matches_pingouin(self, posthoc, pingouin_func):
+        res = comparison(posthoc=posthoc)['revenue']['post_hoc']
+        expected = pingouin_func(data=df, dv='revenue', between='group', effsize='cohen')
+
+        assert column(res, 't-stat') == pytest.approx(expected['T'].to_numpy())
+        assert column(res, 'p-value') == pytest.approx(expected.filter(like='p').iloc[:, -1].to_numpy(), abs=1e-6)
+        assert column(res, 'effect size (d)') == pytest.approx(expected['cohen'].to_numpy())
+
+    def test_anova_matches_pingouin(self):
+        res = comparison()['vips']['anova']
+        expected = pg.anova(data=df, dv='vips', between='group', detailed=True)
+
+        assert res['f-stat'][0] == pytest.approx(expected['F'][0])
+        assert res['SS'][1] == pytest.approx(expected['SS'][1])
+
+    def test_control_contrasts(self):
+        res = comparison(contrasts='control', posthoc='welch')['revenue']['post_hoc']
+
+        assert list(res['A'].values()) == [0, 0, 0]
+        assert list(res['B'].values()) == [1, 2, 3]
+        assert all(column(res, 'p-value (adj)') >= column(res, 'p-value'))
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import chi2_contingency, fisher_exact
+
+from conftest import make_experiment
+from dexter.stats_func import mde
+from dexter.utils import binary_counts, metric_type
+
+
+def discrete_experiment(n=4000, n_groups=2, seed=0):
+    rng = np.random.default_rng(seed)
+    group = rng.integers(0, n_groups, size=n)
+    df = pd.DataFrame({
+        'group': group,
+        'converted': (rng.random(n) < .1 + .03 * group).astype(float),
+        'leads': rng.poisson(2, size=n),
+        'sessions': rng.negative_binomial(1, .2, size=n),
+        'userid': np.arange(n)
+        })
+
+    experiment = make_experiment(df, 'discrete', success_metric=['converted'], health_metric=['leads'],
+                                 learning_metrics=['sessions'],
+                                 expected_proportions=[.5, .5] if n_groups == 2 else [.3, .3, .4])
+
+    return experiment, df
+
+
+def table(df, metric, groups):
+    successes = df.groupby('group')[metric].sum().loc[groups]
+    n = df.groupby('group')[metric].count().loc[groups]
+    return np.column_stack([successes, n - successes])
+
+
+class TestMetricTypes(object):
+    def test_classification_and_compaction(self):
+        experiment, df = discrete_experiment()
+
+        assert experiment.data.metric_types() == {'converted': 'binary', 'leads': 'count', 'sessions': 'count'}
+        assert metric_type(pd.Series([.5, 1.])) == 'continuous'
+        assert metric_type(pd.Series([-1, 1])) == 'continuous'
+        # the caller's DataFrame is left as is, unless compaction is asked for
+        assert df['converted'].dtype == np.float64 and df['leads'].dtype == np.int64
+        experiment.data.compact()
+        assert experiment.data.data['leads'].dtype == np.int8
+        assert (experiment.data.data['leads'] - 3).min() < 0
+
+    def test_binary_counts(self):
+        _, df = discrete_experiment(n=1001)
+        counts = binary_counts(df, 'group', ['converted'])
+
+        assert counts.successes[:, 0] == pytest.approx(df.groupby('group').converted.sum().to_numpy())
+        assert counts.n[:, 0] == pytest.approx(df.groupby('group').size().to_numpy())
+
+
+class TestDiscreteComparison(object):
+    def test_proportions_and_rates(self):
+        experiment, df = discrete_experiment()
+        results = experiment.analyser.compare(metrics=['converted', 'leads', 'sessions'])
+
+        res = pd.DataFrame(results['converted']['proportions'])
+        expected = chi2_contingency(table(df, 'converted', [0, 1]), correction=False)
+        assert res['z-stat'].iloc[0] ** 2 == pytest.approx(expected.statistic)
+        assert res['p-value'].iloc[0] == pytest.approx(expected.pvalue)
+
+        rates = pd.DataFrame(results['leads']['rates'])
+        means = df.groupby('group').leads.mean()
+        assert rates['rate ratio'].iloc[0] == pytest.approx(means[0] / means[1])
+
+        # overdispersed counts fall back to t-tests
+        assert set(results['sessions']) == {'t-tests'}
+
+    def test_fisher_for_small_counts(self):
+        experiment, df = discrete_experiment(n=60)
+        res = pd.DataFrame(experiment.analyser.compare(metrics=['converted'])['converted']['proportions'])
+
+        assert res['p-value'].iloc[0] == pytest.approx(fisher_exact(table(df, 'converted', [0, 1])).pvalue)
+
+    def test_multiple_groups(self):
+        experiment, df = discrete_experiment(n_groups=3)
+        results = experiment.analyser.compare(metrics=['converted'], padjust='holm')['converted']
+
+        chi_square = pd.DataFrame(results['chi-square'])
+        expected = chi2_contingency(table(df, 'converted', [0, 1, 2]), correction=False)
+        assert chi_square['chi2-stat'].iloc[0] == pytest.approx(expected.statistic)
+        assert len(results['proportions']['p-value (adj)']) == 3
+
+    def test_mde_uses_proportion_variance(self):
+        experiment, df = discrete_experiment()
+        p = df.loc[df.group == 0, 'converted'].mean()
+        n = df.group.value_counts().sort_index()
+
+        expected = mde(n[0], n[1], p * (1 - p), p * (1 - p), alpha=.05, beta=.2, alternative='two-sided')
+        assert experiment.mde(metrics=['converted'])[0].mde == pytest.approx(expected)
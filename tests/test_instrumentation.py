@@ -0,0 +1,53 @@
+import pytest
+
+from conftest import ROLES
+from dexter.instrumentation import Instrumentation
+
+
+class TestInstrumentation(object):
+    def test_disabled_by_default(self, experiment):
+        experiment.assumptions.check_groups_balance()
+        assert experiment.instrumentation.records == []
+
+    def test_records_stages_and_metrics(self, experiment):
+        experiment.instrumentation.enable()
+        experiment.assumptions.check_crossover()
+        experiment.analyser.compare()
+
+        df = experiment.instrumentation.to_frame()
+
+        assert {'check_crossover', 'compare', 't-test', 'rate-test', 'formatting'} <= set(df.stage)
+        assert set(df.loc[df.stage == 't-test', 'metric']) == {'revenue'}
+        assert set(df.loc[df.stage == 'rate-test', 'metric']) == {'leads'}
+        assert (df.wall_time >= 0).all()
+        assert df.loc[df.stage == 'check_crossover', 'frame_copies'].iloc[0] > 0
+
+        compare = df.loc[df.stage == 'compare'].iloc[0]
+        nested = df.loc[df.stage.isin(['t-test', 'rate-test']), 'wall_time'].sum()
+        assert compare.wall_time >= nested
+        assert compare.peak_memory > 0
+
+    def test_hooks_and_export(self, experiment, tmp_path):
+        seen = []
+        instrumentation = experiment.instrumentation
+        instrumentation.enable(track_memory=False)
+        instrumentation.register_hook(seen.append)
+
+        experiment.mde()
+
+        assert [r.stage for r in seen] == ['mde']
+        assert seen[0].peak_memory is None
+
+        instrumentation.export(tmp_path / 'records.csv')
+        assert (tmp_path / 'records.csv').read_text().startswith('stage,component,metric')
+
+        with pytest.raises(ValueError):
+            instrumentation.export(tmp_path / 'records.parquet')
+
+    def test_validation_is_recorded(self, dummy_df):
+        from dexter.experiment import ExperimentDataFrame
+
+        instrumentation = Instrumentation(enabled=True)
+        ExperimentDataFrame(dataframe=dummy_df, **ROLES, expected_proportions=[.5, .5], instrumentation=instrumentation)
+
+        assert instrumentation.to_frame().stage.tolist() == ['validation']
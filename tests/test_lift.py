@@ -0,0 +1,26 @@
+import pandas as pd
+import pytest
+from scipy.stats import ttest_ind
+
+from conftest import make_timed_experiment
+
+
+class TestLiftOverTime(object):
+    def test_cumulative_matches_truncated_ttest(self):
+        experiment = make_timed_experiment(n=5000)
+        res = experiment.analyser.lift_over_time(metrics=['revenue'])
+
+        assert len(res) == 2 * 14
+
+        row = res.loc[res.kind == 'cumulative'].iloc[4]
+        df = experiment.data.data
+        prefix = df.loc[df.ts < pd.Timestamp('2021-01-06')]
+        a, b = prefix.loc[prefix.group == 0, 'revenue'], prefix.loc[prefix.group == 1, 'revenue']
+        expected = ttest_ind(b, a, equal_var=False)
+
+        assert row['lift'] == pytest.approx(b.mean() - a.mean())
+        assert row['p-value'] == pytest.approx(expected.pvalue)
+        assert row['ci low'] < row['lift'] < row['ci high']
+
+        last = res.loc[res.kind == 'cumulative'].iloc[-1]
+        assert last['n(A)'] + last['n(B)'] == 5000
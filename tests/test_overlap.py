@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_experiment
+from dexter.overlap import overlap_analysis, unit_keys
+
+
+def overlapping_experiments(n_units=20000, interaction=.3, dependent=False, seed=0):
+    """Two experiments on partly the same users, with an interaction of their variants on revenue."""
+    rng = np.random.default_rng(seed)
+    users = np.arange(n_units)
+    first = rng.integers(0, 2, n_units)
+    second = (rng.random(n_units) < (.3 + .4 * first if dependent else .5)).astype(int)
+    revenue = 10 + .5 * first + .2 * second + interaction * first * second + rng.normal(0, 1, n_units)
+
+    experiments = []
+    for name, units, groups in (('first', users[:15000], first[:15000]), ('second', users[5000:], second[5000:])):
+        df = pd.DataFrame({'userid': [f'u{u}' for u in units], 'group': groups, 'revenue': revenue[units]})
+        experiments.append(make_experiment(df, name, success_metric=['revenue'], health_metric=[], learning_metrics=[],
+                                           expected_proportions=[.5, .5]))
+
+    return experiments
+
+
+class TestOverlap(object):
+    def test_interactions(self):
+        res = overlap_analysis(overlapping_experiments())
+
+        assert res['overlap']['overlap'][0] == 10000
+        assert res['overlap']['share(A)'][0] == pytest.approx(10000 / 15000)
+        assert res['independence']['p-value'][0] > .001
+
+        interactions = res['interactions']
+        assert len(interactions) == 1 and interactions['metric'][0] == 'revenue'
+        assert interactions['interaction'][0] == pytest.approx(.3, abs=4 * interactions['stderr'][0])
+        assert interactions['p-value'][0] < .001
+
+    def test_dependent_assignments(self):
+        res = overlap_analysis(overlapping_experiments(interaction=0, dependent=True))
+        assert res['independence']['p-value'][0] < 1e-6
+        assert res['independence']['srm p-value(B)'][0] > .001
+
+    def test_unit_keys(self):
+        assert unit_keys(np.array([3, 1])).dtype == np.int64
+        hashed = unit_keys(np.array(['a', 'b', 'a'], dtype=object))
+        assert hashed[0] == hashed[2] != hashed[1]
@@ -0,0 +1,120 @@
+from itertools import combinations, product
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import f_oneway, ttest_ind, ttest_rel
+
+from conftest import make_experiment
+from dexter.stats_func import subset_sum_distribution
+
+
+def paired_experiment(n_units=12, effect=.5, seed=0):
+    """Every unit is measured under both variants, with a strong unit effect."""
+    rng = np.random.default_rng(seed)
+    level = rng.normal(10, 3, size=n_units)
+    df = pd.DataFrame({
+        'userid': np.tile(np.arange(n_units), 2),
+        'group': np.repeat([0, 1], n_units),
+        'revenue': np.concatenate([level, level + effect]) + rng.normal(0, 1, size=2 * n_units)
+        })
+
+    with pytest.warns(UserWarning):
+        experiment = make_experiment(df, 'paired', success_metric=['revenue'], health_metric=[], learning_metrics=[])
+
+    return experiment, df
+
+
+class TestPermutationComparison(object):
+    def test_exact_sign_flips(self):
+        experiment, df = paired_experiment()
+        res = experiment.analyser.compare(parametric='permute', paired=True, rounds=5000, seed=1)
+        res = res['revenue']['permutation-tests']
+
+        d = df.query('group == 0').revenue.to_numpy() - df.query('group == 1').revenue.to_numpy()
+        flipped = np.array([np.mean(np.array(signs) * d) for signs in product([-1, 1], repeat=len(d))])
+        assert bool(res['exact'][0]) and res['permutations'][0] == 2 ** 12
+        assert res['p-value'][0] == pytest.approx(np.mean(np.abs(flipped) >= abs(d.mean()) - 1e-12))
+
+    def test_random_sign_flips(self):
+        experiment, df = paired_experiment(n_units=400, effect=.15, seed=2)
+        res = experiment.analyser.compare(parametric='permute', paired=True, rounds=20000, seed=1)
+        res = res['revenue']['permutation-tests']
+
+        expected = ttest_rel(df.query('group == 0').revenue, df.query('group == 1').revenue).pvalue
+        assert not res['exact'][0] and res['pairs'][0] == 400
+        assert res['p-value'][0] == pytest.approx(expected, abs=.01)
+
+        # custom statistics flip the pairs one permutation at a time
+        def median_diff(a, b):
+            return np.median(a), np.median(b), abs(np.median(a - b))
+        res = experiment.analyser.compare(parametric='permute', paired=True, rounds=200, seed=1, func=median_diff)
+        assert 0 <= res['revenue']['permutation-tests']['p-value'][0] <= 1
+
+    def test_unpaired_chunks(self):
+        rng = np.random.default_rng(3)
+        df = pd.DataFrame({'userid': np.arange(3000), 'group': rng.integers(0, 2, 3000)})
+        df['revenue'] = rng.normal(size=3000) + .08 * df['group']
+        experiment = make_experiment(df, 'unpaired', success_metric=['revenue'], health_metric=[], learning_metrics=[])
+
+        res = experiment.analyser.compare(parametric='permute', rounds=20000, seed=1)
+        expected = ttest_ind(df.query('group == 0').revenue, df.query('group == 1').revenue).pvalue
+        assert res['revenue']['permutation-tests']['p-value'][0] == pytest.approx(expected, abs=.01)
+
+        same = experiment.analyser.compare(parametric='permute', rounds=20000, seed=1)
+        assert same['revenue']['permutation-tests']['p-value'][0] == res['revenue']['permutation-tests']['p-value'][0]
+
+    def test_k_sample(self):
+        rng = np.random.default_rng(4)
+        df = pd.DataFrame({'userid': np.arange(2000), 'group': rng.integers(0, 4, 2000)})
+        df['revenue'] = rng.normal(size=2000) + .15 * (df['group'] == 3)
+        experiment = make_experiment(df, 'k-sample', success_metric=['revenue'], health_metric=[], learning_metrics=[])
+
+        res = experiment.analyser.compare(parametric='permute', rounds=4000, seed=1)['revenue']
+        omnibus, contrasts = res['permutation-anova'], res['permutation-tests']
+        assert isinstance(omnibus, pd.DataFrame) and isinstance(contrasts, pd.DataFrame)
+
+        expected = f_oneway(*[g.revenue for _, g in df.groupby('group')])
+        assert omnibus['f-stat'][0] == pytest.approx(expected.statistic)
+        assert omnibus['p-value'][0] == pytest.approx(expected.pvalue, abs=.015)
+
+        assert len(contrasts) == 6
+        assert (contrasts['p-value (adj)'] >= contrasts['p-value']).all()
+        pooled = ttest_ind(df.query('group == 0').revenue, df.query('group == 3').revenue)
+        row = contrasts.query('A == 0 and B == 3').iloc[0]
+        assert row['p-value'] == pytest.approx(pooled.pvalue, abs=.02)
+
+        res = experiment.analyser.compare(parametric='permute', rounds=500, seed=1, contrasts='control')
+        assert list(res['revenue']['permutation-tests']['A']) == [0, 0, 0]
+
+    def test_exact_integer_metric(self):
+        rng = np.random.default_rng(5)
+        df = pd.DataFrame({'userid': np.arange(400), 'group': np.repeat([0, 1], [150, 250])})
+        df['leads'] = rng.poisson(.8 + .25 * df['group'])
+        experiment = make_experiment(df, 'leads', health_metric=[], learning_metrics=[], expected_proportions=[.4, .6])
+
+        exact = experiment.analyser.compare(parametric='permute', method='exact')['leads']['permutation-tests']
+        approx = experiment.analyser.compare(parametric='permute', rounds=50000, seed=1)['leads']['permutation-tests']
+        assert bool(exact['exact'][0]) and not approx['exact'][0]
+        assert exact['p-value'][0] == pytest.approx(approx['p-value'][0], abs=.005)
+
+        with pytest.raises(AttributeError):
+            experiment.analyser.compare(parametric='permute', method='exact', func=lambda a, b: (0, 0, 0))
+
+    def test_exact_distributions(self):
+        values = np.array([0, 3, 1, 1, 4, 0, 2, 7])
+        sums, probabilities = subset_sum_distribution(values, 3)
+        expected = pd.Series([sum(c) for c in combinations(values, 3)]).value_counts(normalize=True)
+        assert np.allclose(probabilities[sums.searchsorted(expected.index)], expected.to_numpy())
+        assert probabilities.sum() == pytest.approx(1)
+
+        experiment, df = paired_experiment(n_units=10)
+        df['revenue'] = np.round(df['revenue'])
+        experiment.data.data = df
+        exact = experiment.analyser.compare(parametric='permute', paired=True, method='exact')
+        enumerated = experiment.analyser.compare(parametric='permute', paired=True, rounds=2 ** 10)
+        assert exact['revenue']['permutation-tests']['p-value'][0] == pytest.approx(
+            enumerated['revenue']['permutation-tests']['p-value'][0])
+
+        with pytest.raises(ValueError):
+            subset_sum_distribution([.5, 1, 2], 1)
@@ -0,0 +1,66 @@
+import pytest
+
+from dexter.pipeline import Pipeline
+from dexter.utils import echo
+
+
+def record(experiment, label, log):
+    log.append(label)
+    echo(label)
+    return label
+
+
+def n_rows(experiment):
+    return len(experiment.data)
+
+
+def drop_odd_units(experiment):
+    experiment.data.filter(experiment.data['userid'] % 2 == 0, name='even units')
+
+
+class TestPipeline(object):
+    def test_mutating_stages_order_the_workflow(self):
+        log = []
+        pipeline = Pipeline(None, executor='thread', max_workers=4)
+        pipeline.add('a', record, label='a', log=log)
+        pipeline.add('b', record, label='b', log=log)
+        pipeline.add('mutate', record, mutates=True, label='mutate', log=log)
+        pipeline.add('c', record, label='c', log=log)
+
+        dependencies = pipeline._dependencies()
+        assert dependencies['mutate'] == {'a', 'b'}
+        assert dependencies['c'] == {'mutate'}
+
+        results = pipeline.run()
+
+        assert list(results) == ['a', 'b', 'mutate', 'c']
+        assert log.index('mutate') == 2
+        assert pipeline.outputs['c'] == 'c\n'
+
+    def test_invalid_dependencies(self):
+        pipeline = Pipeline(None)
+        pipeline.add('a', record, depends_on='b', label='a', log=[])
+        pipeline.add('b', record, depends_on='a', label='b', log=[])
+
+        with pytest.raises(ValueError):
+            pipeline.run()
+
+    @pytest.mark.parametrize('executor', ['serial', 'thread', 'process'])
+    def test_default_pipeline_is_deterministic(self, experiment, executor, capsys):
+        results = experiment.pipeline(executor=executor, max_workers=2).run()
+
+        assert list(results['compare']) == ['leads', 'revenue', 'vips']
+        assert experiment.assumptions.get_log()['crossover']['status']['checked']
+        assert set(experiment.analyser.get_log('analyses')) == {'leads', 'revenue', 'vips'}
+
+        output = capsys.readouterr().out
+        assert output.index('Cross-over') < output.index('Leads') < output.index('Revenue') < output.index('Vips')
+
+    def test_workers_see_mutations(self, experiment):
+        pipeline = Pipeline(experiment, executor='process', max_workers=2)
+        pipeline.add('before', n_rows)
+        pipeline.add('drop', drop_odd_units, mutates=True)
+        pipeline.add('after', n_rows)
+
+        results = pipeline.run()
+        assert results['before'] == 2000 and results['after'] == 1000
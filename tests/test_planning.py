@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import norm
+
+from conftest import make_timed_experiment
+from dexter.planning import unique_unit_curve, fit_accumulation, project_units, days_to_power
+
+
+def historical_traffic(days=28, n_units=20000, seed=0):
+    """Visits of units that return with a daily probability, so that unique units grow sublinearly."""
+    rng = np.random.default_rng(seed)
+    visits = rng.random((n_units, days)) < rng.beta(1, 8, size=(n_units, 1))
+    unit, day = np.nonzero(visits)
+    return pd.DataFrame({'userid': unit, 'ts': pd.Timestamp('2020-12-01') + pd.to_timedelta(day, unit='D')})
+
+
+class TestPlanning(object):
+    def test_unique_unit_curve(self):
+        traffic = historical_traffic()
+        curve = unique_unit_curve(traffic['userid'], traffic['ts'])
+
+        first_day = traffic.groupby('userid').ts.min().value_counts().sort_index()
+        assert curve == pytest.approx(first_day.cumsum().to_numpy())
+
+        a, b = fit_accumulation(curve)
+        assert 0 < b < 1
+        projected = project_units(curve, 60)
+        assert projected[:len(curve)] == pytest.approx(curve)
+        assert np.all(np.diff(projected) >= 0)
+
+    def test_missing_units_and_dates(self):
+        traffic = historical_traffic(days=7, n_units=500)
+        curve = unique_unit_curve(traffic['userid'], traffic['ts'])
+
+        missing = pd.DataFrame({'userid': [np.nan, 10 ** 6], 'ts': [pd.Timestamp('2020-11-01'), pd.NaT]})
+        traffic = pd.concat([traffic, missing], ignore_index=True)
+        assert unique_unit_curve(traffic['userid'], traffic['ts']) == pytest.approx(curve)
+
+        with pytest.raises(ValueError):
+            unique_unit_curve(missing['userid'], missing['ts'])
+
+    def test_days_to_power(self):
+        curve = np.arange(1, 101) * 1000.
+        required, days = days_to_power(curve, mean=[10., .2], var=[4., .16], allocations=[[.5, .5], [.2, .8]],
+                                       roll_out_percent=.5, lift=.05, binary=[False, True], max_days=100)
+        assert required.shape == days.shape == (2, 2, 1)
+
+        z = norm.ppf(.975) + norm.ppf(.8)
+        expected = np.ceil(z ** 2 * (4 / .5 + 4 / .5) / .5 ** 2)
+        assert required[0, 0, 0] == expected
+        assert days[0, 0, 0] == np.ceil(expected / 500)
+        assert required[0, 1, 0] == np.ceil(z ** 2 * (4 / .2 + 4 / .8) / .5 ** 2)
+        # the binary metric needs far more units than a year of traffic
+        assert np.isnan(days[1]).all()
+
+    def test_plan_duration(self):
+        experiment = make_timed_experiment()
+        traffic = experiment.data.data[['userid', 'ts']]
+
+        plan = experiment.plan_duration(traffic, lift=.05, lift_type='absolute', allocations=[[.5, .5], [.3, .7]])
+        assert plan['allocation'].tolist() == ['[0.5, 0.5]', '[0.3, 0.7]']
+        # a balanced split needs the fewest units
+        assert plan['required n'].iloc[0] < plan['required n'].iloc[1]
+        assert plan['periods'].iloc[0] <= plan['periods'].iloc[1]
+        assert plan['end'].iloc[0] == str(pd.Period(experiment.start, 'D') + int(plan['periods'].iloc[0]) - 1)
@@ -0,0 +1,63 @@
+import pickle
+
+import pytest
+
+from dexter.experiment import ExperimentDataFrame, ExperimentSchema
+from dexter.instrumentation import Instrumentation
+
+
+def make_schema():
+    return ExperimentSchema(
+        success_metric=['leads'],
+        health_metric=['revenue'],
+        learning_metrics=['vips'],
+        experiment_unit='userid',
+        treatment='group',
+        expected_proportions=[.5, .5]
+        )
+
+
+class TestExperimentSchema(object):
+    def test_validation_is_cached(self, dummy_df):
+        schema = make_schema()
+
+        assert schema.validate(dummy_df)
+        assert not schema.validate(dummy_df)
+        assert schema.validate(dummy_df.iloc[:100])
+
+        # the cache travels with the schema to worker processes
+        assert not pickle.loads(pickle.dumps(schema)).validate(dummy_df)
+
+    def test_validation_errors(self, dummy_df):
+        with pytest.raises(ValueError):
+            make_schema().validate(dummy_df.drop(columns=['vips']))
+
+        schema = make_schema()
+        schema.expected_proportions = [.2, .3, .5]
+        with pytest.raises(ValueError):
+            schema.validate(dummy_df)
+
+    def test_from_trusted(self, dummy_df):
+        schema = make_schema()
+        instrumentation = Instrumentation(enabled=True, track_memory=False)
+
+        for _ in range(3):
+            exp_df = ExperimentDataFrame.from_trusted(schema, dummy_df, instrumentation=instrumentation)
+
+        assert exp_df.data is dummy_df
+        assert exp_df.learning_metrics == ['vips']
+        assert exp_df.shape == dummy_df.shape
+        assert len(instrumentation.records) == 3
+        assert exp_df.schema.fingerprint(dummy_df) == schema.fingerprint(dummy_df)
+
+    def test_schema_of_data(self, experiment, dummy_df):
+        data = experiment.data
+        schema = data.schema
+        assert data.schema is schema
+
+        # the data was validated when it was set, so the schema does not check it again
+        assert not schema.validate(dummy_df)
+        assert not ExperimentDataFrame.from_trusted(schema, dummy_df).schema.validate(dummy_df)
+
+        data.learning_metrics = []
+        assert data.schema is not schema and data.schema.learning_metrics == []
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import ttest_ind
+
+from conftest import make_experiment
+from dexter.stats_func import padjust
+
+
+class TestSegmentComparison(object):
+    def test_matches_per_segment_ttests(self, experiment, dummy_df):
+        dummy_df['country'] = np.random.default_rng(5).choice(['NL', 'DE', 'FR'], size=len(dummy_df))
+
+        experiment.analyser.compare(by=['country', 'vips'], q=2, padjust='fdr_bh')
+        table = experiment.analyser.get_log('analyses')['segments']
+
+        assert len(table) == 3 * 2 * 2
+        assert table.columns[:2].tolist() == ['country', 'vips']
+
+        row = table.loc[(table.country == 'DE') & (table.metric == 'revenue')].iloc[0]
+        segment = dummy_df.loc[dummy_df.country == 'DE']
+        segment = segment.loc[segment.vips.between(row.vips.left, row.vips.right, inclusive='right')]
+        expected = ttest_ind(
+            segment.loc[segment.group == 0, 'revenue'], segment.loc[segment.group == 1, 'revenue'], equal_var=False
+            )
+
+        assert row['t-stat'] == pytest.approx(expected.statistic)
+        assert row['p-value'] == pytest.approx(expected.pvalue)
+
+        revenue = table.loc[table.metric == 'revenue']
+        assert revenue['p-value (adj)'].to_numpy() == pytest.approx(padjust(revenue['p-value'], 'fdr_bh'))
+
+    def test_heterogeneity(self, experiment):
+        experiment.analyser.compare(by='vips', padjust='holm')
+        heterogeneity = experiment.analyser.get_log('analyses')['heterogeneity']
+
+        assert heterogeneity.metric.tolist() == ['leads', 'revenue']
+        assert heterogeneity['p-value'].between(0, 1).all()
+
+    def test_default_adjustment(self, experiment, capsys):
+        experiment.analyser.compare(by='vips')
+        table = experiment.analyser.get_log('analyses')['segments']
+
+        for _, frame in table.groupby('metric'):
+            assert frame['p-value (adj)'].to_numpy() == pytest.approx(padjust(frame['p-value'], 'fdr_bh'))
+        assert 'fdr_bh' in capsys.readouterr().out
+
+        experiment.analyser.compare(by='vips', padjust='none')
+        table = experiment.analyser.get_log('analyses')['segments']
+        assert table['p-value (adj)'].to_numpy() == pytest.approx(table['p-value'].to_numpy(), nan_ok=True)
+
+    def test_heterogeneity_without_effect(self):
+        df = pd.DataFrame({
+            'segment': np.repeat(['a', 'b'], 8),
+            'group': np.tile([0, 1], 8),
+            'revenue': np.r_[np.repeat([1., 3.], 4), np.arange(8.)],
+            'userid': np.arange(16)
+            })
+        experiment = make_experiment(df, success_metric=['revenue'], health_metric=[], learning_metrics=[])
+        experiment.analyser.compare(by='segment', q=None)
+
+        segments = experiment.analyser.get_log('analyses')['segments']
+        heterogeneity = experiment.analyser.get_log('analyses')['heterogeneity']
+        # segment a has no effect at all, and still gets its inverse-variance weight
+        assert segments['delta'].iloc[0] == 0
+        weights = 1 / segments['stderr'] ** 2
+        expected = np.sum(weights * segments['delta']) / weights.sum()
+        assert heterogeneity['pooled delta'].iloc[0] == pytest.approx(expected)
+        assert np.isfinite(heterogeneity['Q'].iloc[0])
@@ -0,0 +1,115 @@
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from conftest import ROLES, make_dummy_df
+from dexter.server import DexterClient, ExperimentServer
+
+
+@pytest.fixture
+def served(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'exp{i}.csv'
+        make_dummy_df(n=3000, seed=i).to_csv(path, index=False)
+        paths.append(path)
+
+    server = ExperimentServer(memory_limit=10 ** 9, data_dir=tmp_path).start()
+    client = DexterClient(server.url, echo=False)
+    for i, path in enumerate(paths):
+        client.load(f'exp{i}', path, '2021-01-01', '2021-01-14', .1, .1, **ROLES, expected_proportions=[.5, .5])
+    try:
+        yield server, client
+    finally:
+        server.stop()
+
+
+class TestExperimentServer(object):
+    def test_requests(self, served):
+        server, client = served
+
+        # the same experiment and the others at once
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            futures = [pool.submit(client.compare, f'exp{i % 3}', metrics=['revenue']) for i in range(6)]
+            results = [future.result() for future in futures]
+
+        local = server.registry._entries['exp1'].experiment.analyser.compare(metrics=['revenue'])
+        served_stat = results[1]['revenue']['t-tests']['t-stat']['0']
+        assert served_stat == pytest.approx(local['revenue']['t-tests']['t-stat'][0])
+
+        res = client.run('exp0', 'compare', metrics=['revenue'])
+        assert res == results[0]
+        assert set(client.mde('exp0', metrics=['revenue', 'vips'])) == {'revenue', 'vips'}
+        assert client.check('exp0', 'groups_balance')['status']['checked'] is True
+
+        summary = client.summary('exp0')
+        assert summary.rows.sum() == pytest.approx(3000)
+
+        with pytest.raises(KeyError):
+            client.compare('unknown')
+        with pytest.raises(ValueError):
+            client.check('exp0', 'unknown')
+
+    def test_output_and_summary_cache(self, served):
+        server, client = served
+        console = sys.stdout
+
+        # the output of a request goes to its reply, without replacing sys.stdout
+        reply = client._request('POST', '/experiments/exp0/compare', {'metrics': ['revenue']})
+        assert 'Revenue' in reply['output'] and sys.stdout is console
+
+        client.summary('exp0')
+        entry = server.registry._entries['exp0']
+        summary = entry.summary
+        client.compare('exp0', metrics=['revenue'])
+        client.summary('exp0')
+        assert entry.summary is summary
+
+        entry.experiment.data.filter(entry.experiment.data['userid'] < 1000)
+        assert client.summary('exp0').rows.sum() == pytest.approx(1000)
+
+        with pytest.raises(ValueError, match='not supported'):
+            client._request('DELETE', '/experiments')
+
+    def test_eviction(self, served):
+        server, client = served
+        server.registry.memory_limit = max(entry['memory'] for entry in client.experiments()) * 3 // 2
+
+        client.mde('exp0')
+        client.mde('exp2')
+        status = {entry['name']: entry['loaded'] for entry in client.experiments()}
+        assert status == {'exp0': False, 'exp1': False, 'exp2': True}
+
+        # evicted experiments are read again on their next request
+        assert set(client.mde('exp0', metrics=['revenue'])) == {'revenue'}
+
+        client.remove('exp1')
+        assert [entry['name'] for entry in client.experiments()] == ['exp2', 'exp0']
+
+    def test_loading_is_restricted(self, served, tmp_path):
+        server, client = served
+        make_dummy_df(n=100).to_pickle(tmp_path / 'exp.pkl')
+
+        for path in (tmp_path / 'exp.pkl', tmp_path.parent / 'exp0.csv', '../exp0.csv'):
+            with pytest.raises(ValueError):
+                client.load('other', path, '2021-01-01', '2021-01-14', .1, .1, **ROLES, expected_proportions=[.5, .5])
+
+        # an experiment in use is never replaced
+        with pytest.raises(ValueError):
+            client.load('exp0', 'exp1.csv', '2021-01-01', '2021-01-14', .1, .1, **ROLES, expected_proportions=[.5, .5])
+        assert [entry['name'] for entry in client.experiments()] == ['exp0', 'exp1', 'exp2']
+
+    def test_token(self):
+        with pytest.raises(ValueError):
+            ExperimentServer(host='0.0.0.0')
+
+        server = ExperimentServer(token='secret').start()
+        try:
+            with pytest.raises(ValueError):
+                DexterClient(server.url).experiments()
+            assert DexterClient(server.url, token='secret').experiments() == []
+            with pytest.raises(ValueError):
+                DexterClient(server.url, token='secret').load('exp', 'exp.csv', '2021-01-01', '2021-01-14', .1, .1)
+        finally:
+            server.stop()
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from dexter.simulation import simulate_group_moments
+from dexter.stats_func import ttest_from_moments
+from scipy.stats import ttest_ind
+
+
+class TestSimulateAA(object):
+    def test_group_moments_match_labels(self):
+        values = np.random.default_rng(0).normal(size=(50, 2))
+        n, mean, var = next(simulate_group_moments(values, [.5, .5], 3, np.random.default_rng(1)))
+
+        labels = np.random.default_rng(1).random((50, 3)) >= .5
+        centred = values - values.mean(axis=0)
+        group = centred[labels[:, 2]]
+
+        assert n[2, 1, 0] == len(group)
+        assert mean[2, 1] == pytest.approx(group.mean(axis=0))
+        assert var[2, 1] == pytest.approx(group.var(axis=0, ddof=1))
+
+    def test_ttest_from_moments(self):
+        rng = np.random.default_rng(2)
+        a, b = rng.normal(size=30), rng.normal(.5, 2, size=40)
+        expected = ttest_ind(a, b, equal_var=False)
+        t, _, p = ttest_from_moments(a.mean(), b.mean(), a.var(ddof=1), b.var(ddof=1), 30, 40)
+        assert t == pytest.approx(expected.statistic)
+        assert p == pytest.approx(expected.pvalue)
+
+    def test_false_positive_rate(self, experiment):
+        report, p_values = experiment.simulate_aa(n_simulations=2000, seed=3)
+
+        assert p_values.shape == (2000, 1, 3)
+        assert report['false positive rate'].between(.03, .07).all()
+
+
+class TestSimulatePower(object):
+    @pytest.mark.parametrize('test', ['ttest', 'mannwhitney', 'permutation'])
+    def test_power_increases_with_lift(self, experiment, test):
+        power = experiment.simulate_power(
+            'revenue', lifts=[0, .5], sample_sizes=[300], test=test, n_simulations=300, permutations=200, seed=4
+            )
+
+        assert power.power.iloc[0] < .1
+        assert power.power.iloc[1] > .5
+        assert power.metric.unique().tolist() == ['revenue']
+
+    def test_invalid_test(self):
+        from dexter.simulation import simulate_power
+
+        with pytest.raises(ValueError):
+            simulate_power([1., 2.], lifts=[0], sample_sizes=[10], test='anova')
+        with pytest.raises(ValueError):
+            simulate_power([1., 2.], lifts=[0], sample_sizes=[10], alternative='one-sided')
+
+    def test_permutation_blocks(self):
+        from dexter.simulation import _relabelings, simulate_power
+
+        # the relabelings do not depend on the block size, and every one splits the units in two halves
+        blocks = np.vstack(list(_relabelings(3, 100, 20, 7)))
+        assert np.array_equal(blocks, next(_relabelings(3, 100, 20, 100)))
+        assert (blocks.sum(axis=1) == 20).all()
+
+        values = np.random.default_rng(0).lognormal(size=1000)
+        power = simulate_power(values, lifts=[0, .3], sample_sizes=[200], test='permutation', n_simulations=100,
+                               permutations=100, seed=1, memory_budget=2 ** 16)
+        assert power.power.iloc[0] < .15 and power.power.iloc[1] > .5
@@ -0,0 +1,48 @@
+import sqlite3
+
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import ttest_ind
+
+from conftest import ROLES, make_dummy_df
+from dexter.experiment import Experiment, ExperimentSchema
+from dexter.sql import summarise_sql, summary_query
+from dexter.summary import ExperimentSummary
+
+schema = ExperimentSchema(**ROLES, expected_proportions=[.5, .5])
+
+
+def database(df):
+    connection = sqlite3.connect(':memory:')
+    df.to_sql('experiment', connection, index=False)
+    return connection
+
+
+class TestSqlPushdown(object):
+    def test_matches_frame_summary(self):
+        df = make_dummy_df(n=3000)
+        df.loc[::7, 'vips'] = np.nan
+        # large values, whose squares cancel without centering
+        df['revenue'] = df['revenue'] + 1e6
+
+        summary = summarise_sql(database(df), 'experiment', schema)
+        expected = ExperimentSummary.from_frame(df, schema)
+
+        assert list(summary.groups) == list(expected.groups)
+        for field in ('rows', 'units', 'n', 'mean', 'var', 'minimum', 'maximum', 'complete_n', 'complete_mean',
+                      'comoment'):
+            assert getattr(summary, field) == pytest.approx(getattr(expected, field), rel=1e-8)
+        assert list(summary.integral) == list(expected.integral)
+
+    def test_experiment_from_sql(self):
+        df = make_dummy_df(n=2000)
+        experiment = Experiment.from_sql('sql', '2021-01-01', '2021-01-14', .3, .1, database(df), 'experiment',
+                                         schema, where='"leads" >= 0')
+
+        res = pd.DataFrame(experiment.analyser.compare(metrics=['revenue'])['revenue']['t-tests'])
+        a, b = df.loc[df.group == 0, 'revenue'], df.loc[df.group == 1, 'revenue']
+        assert res['p-value'].iloc[0] == pytest.approx(ttest_ind(a, b, equal_var=False).pvalue)
+
+        assert len(experiment.mde(metrics=['revenue'])) == 1
+        assert 'WHERE "leads" >= 0' in summary_query('experiment', 'group', 'userid', ['leads'], where='"leads" >= 0')
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import ttest_ind
+
+from conftest import ROLES, make_dummy_df, make_experiment
+from dexter.experiment import Experiment, ExperimentSchema
+from dexter.summary import ExperimentSummary, HyperLogLog
+
+schema = ExperimentSchema(**ROLES, expected_proportions=[.5, .5])
+
+
+def summarise(df, sketch=False):
+    return ExperimentSummary.from_frame(df, schema, sketch=sketch)
+
+
+class TestExperimentSummary(object):
+    def test_merge_matches_full_data(self):
+        df = make_dummy_df(n=3000)
+        df.loc[::7, 'vips'] = np.nan
+        # the second shard only has treated units
+        shards = [summarise(df.iloc[:1000]), summarise(df.iloc[1000:].query('group == 1')),
+                  summarise(df.iloc[1000:].query('group == 0'))]
+
+        full = summarise(df)
+        for merged in (ExperimentSummary.combine(shards), shards[0] + (shards[1] + shards[2])):
+            assert merged.rows == pytest.approx(full.rows)
+            assert merged.n == pytest.approx(full.n)
+            assert merged.mean == pytest.approx(full.mean)
+            assert merged.var == pytest.approx(full.var)
+            assert merged.comoment == pytest.approx(full.comoment)
+            assert merged.minimum == pytest.approx(full.minimum)
+
+        expected = df.dropna().query('group == 0')[['leads', 'revenue', 'vips']].cov()
+        assert full.covariance(0).to_numpy() == pytest.approx(expected.to_numpy())
+        assert full.metric_types() == {'leads': 'count', 'revenue': 'continuous', 'vips': 'continuous'}
+
+    def test_serialisation(self):
+        df = make_dummy_df()
+        summary = summarise(df.query('group == 0'), sketch=True) + summarise(df.query('group == 1'), sketch=True)
+        restored = ExperimentSummary.from_json(summary.to_json())
+
+        assert restored.to_dict() == summary.to_dict()
+        assert restored.unit_counts().to_numpy() == pytest.approx(summary.unit_counts().to_numpy())
+
+    def test_hyperloglog(self):
+        units = np.arange(50000)
+        a, b = HyperLogLog().update(units[:30000]), HyperLogLog().update(units[20000:])
+
+        assert a.merge(b).estimate() == pytest.approx(50000, rel=.05)
+        assert HyperLogLog().update(units[:100]).estimate() == pytest.approx(100, rel=.05)
+
+
+class TestExperimentFromSummaries(object):
+    def test_analyses(self, experiment):
+        df = experiment.data.data
+        summaries = [summarise(df.iloc[:700]), summarise(df.iloc[700:])]
+        from_summaries = Experiment.from_summaries('sharded', '2021-01-01', '2021-01-14', .3, .1, summaries)
+
+        from_summaries.assumptions.check_groups_balance()
+        experiment.assumptions.check_groups_balance()
+        balance = from_summaries.assumptions.get_log()['group_balance']['diagnostics']['tests results']
+        assert balance == experiment.assumptions.get_log()['group_balance']['diagnostics']['tests results']
+
+        res = pd.DataFrame(from_summaries.analyser.compare(metrics=['revenue'])['revenue']['t-tests'])
+        a, b = df.loc[df.group == 0, 'revenue'], df.loc[df.group == 1, 'revenue']
+        assert res['p-value'].iloc[0] == pytest.approx(ttest_ind(a, b, equal_var=False).pvalue)
+
+        for method, field in (('mde', 'mde'), ('required_n', 'n')):
+            actual = getattr(getattr(from_summaries, method)(metrics=['revenue'])[0], field)
+            expected = getattr(getattr(experiment, method)(metrics=['revenue'])[0], field)
+            assert actual == pytest.approx(expected)
+        assert len(from_summaries.actual_power(metrics=['revenue'])) == 1
+
+    def test_welch_anova_matches_rows(self):
+        rng = np.random.default_rng(2)
+        df = pd.DataFrame({'group': rng.integers(0, 3, 3000), 'userid': np.arange(3000)})
+        # unequal variances, so that the row-level comparison runs Welch's ANOVA as well
+        df['revenue'] = rng.normal(size=3000) * (1 + df['group']) + .1 * df['group']
+        rows = make_experiment(df, 'rows', success_metric=['revenue'], health_metric=[], learning_metrics=[])
+        summary = Experiment.from_summaries('summary', '2021-01-01', '2021-01-14', .1, .1, rows.data.summarise())
+
+        expected = pd.DataFrame(rows.analyser.compare(metrics=['revenue'])['revenue']['anova'])
+        res = pd.DataFrame(summary.analyser.compare(metrics=['revenue'])['revenue']['anova'])
+        assert list(res.columns) == list(expected.columns) and 'dof (within)' in res.columns
+        assert res['dof (within)'].iloc[0] == pytest.approx(expected['dof (within)'].iloc[0])
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from scipy.stats import mannwhitneyu, ttest_ind
+
+from dexter.sweep import SortedGroups, mannwhitney_sorted, specifications
+
+
+def handle(values, cap, how, replacement):
+    if how == 'trim':
+        return values[values <= cap]
+    return np.where(values > cap, replacement, values)
+
+
+class TestRobustnessSweep(object):
+    def test_moments_match_handled_data(self):
+        rng = np.random.default_rng(0)
+        a, b = rng.lognormal(2, 1, 3000), rng.lognormal(2.05, 1, 2000)
+        stats = SortedGroups([a, b])
+
+        for quantile, how, transform in [(.99, 'trim', 'raw'), (.95, 'winsorize', 'log'), (None, 'none', 'raw')]:
+            cap, replacement = stats.cap(quantile)
+            expected = [handle(v, cap, how, replacement) for v in (a, b)]
+            expected = [np.log(v + 1) if transform == 'log' else v for v in expected]
+
+            n, mean, var = stats.moments(quantile, how, transform)
+            assert n == pytest.approx([len(v) for v in expected])
+            assert mean == pytest.approx([v.mean() for v in expected])
+            assert var == pytest.approx([v.var(ddof=1) for v in expected])
+
+    def test_mannwhitney(self):
+        rng = np.random.default_rng(1)
+        x, y = np.sort(rng.poisson(3, 500).astype(float)), np.sort(rng.poisson(3.3, 400).astype(float))
+        for alternative, scipy_alternative in [('two-sided', 'two-sided'), ('smaller', 'less')]:
+            u, p = mannwhitney_sorted(x, y, alternative)
+            expected = mannwhitneyu(x, y, alternative=scipy_alternative, method='asymptotic')
+            assert u == pytest.approx(expected.statistic)
+            assert p == pytest.approx(expected.pvalue)
+
+    @pytest.mark.parametrize('dummy_df', [dict(n=4000, n_groups=3)], indirect=True)
+    @pytest.mark.parametrize('experiment', [dict(success_metric=['revenue'], health_metric=[], learning_metrics=[],
+                                                 expected_proportions=[.3, .3, .4])], indirect=True)
+    def test_sweep(self, experiment, dummy_df):
+        res = experiment.robustness_sweep(caps=(None, .99))
+        # the data is not changed
+        assert experiment.data.versions.empty and len(experiment.data) == len(dummy_df)
+        assert len(res) == 2 * len(specifications(caps=(None, .99)))
+
+        row = res.query("B == 2 and handling == 'trim' and transform == 'log' and test == 'welch'").iloc[0]
+        cap = np.quantile(dummy_df['revenue'], .99)
+        trimmed = dummy_df[dummy_df['revenue'] <= cap]
+        expected = ttest_ind(np.log(trimmed.loc[trimmed.group == 2, 'revenue'] + 1),
+                             np.log(trimmed.loc[trimmed.group == 0, 'revenue'] + 1), equal_var=False)
+        assert row['statistic'] == pytest.approx(expected.statistic)
+        assert row['p-value'] == pytest.approx(expected.pvalue)
+        assert res.groupby(['B', 'transform'])['rank'].max().sum() == len(res)
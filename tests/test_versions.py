@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_dummy_df, make_experiment
+
+
+def versioned_experiment(n=2000):
+    df = make_dummy_df(n=n)
+    # the first 50 units are exposed to both variants
+    crossed = df.iloc[:50].assign(group=1 - df['group'].iloc[:50])
+    df = pd.concat([df, crossed], ignore_index=True)
+
+    with pytest.warns(UserWarning):
+        experiment = make_experiment(df, 'versions', success_metric=['revenue'], health_metric=['leads'])
+
+    return experiment, df
+
+
+class TestDataVersions(object):
+    def test_handling_is_versioned(self):
+        experiment, df = versioned_experiment()
+        data = experiment.data
+        base = data.base
+
+        experiment.assumptions.check_crossover()
+        experiment.assumptions.handle_crossover(force=True)
+        assert len(data) == len(df) - 100
+        assert not data.data['userid'].isin(range(50)).any()
+
+        is_outlier = data['revenue'] > data['revenue'].quantile(.99)
+        experiment.assumptions.handle_outliers(metrics=['revenue'], method='winsorize', is_outlier=is_outlier)
+        assert data['revenue'].max() == pytest.approx(data['revenue'][is_outlier].min())
+
+        # the base is untouched and the data of every version can be rebuilt
+        assert data.base is base and base['revenue'].max() == df['revenue'].max()
+        assert len(data.view(0)) == len(df)
+        assert len(data.view(1)) == len(df) - 100
+        assert data.versions['name'].tolist() == ['handle_crossover', 'handle_outliers']
+
+        experiment.assumptions.undo()
+        assert data['revenue'].max() == df['revenue'].iloc[50:-50].max()
+        assert experiment.assumptions.get_log()['outliers']['status']['handled'] is False
+
+        experiment.assumptions.undo()
+        assert len(data) == len(df)
+        with pytest.raises(Exception):
+            experiment.assumptions.undo()
+
+    def test_no_crossover(self, experiment, dummy_df):
+        experiment.assumptions.handle_crossover()
+        assert len(experiment.data) == len(dummy_df) and experiment.data.versions.empty
+
+    def test_assignments_and_filters(self):
+        experiment, df = versioned_experiment()
+        data = experiment.data
+
+        removed = data.filter(data['leads'] > 0, name='with leads')
+        data['log revenue'] = np.log(data['revenue'])
+        data['leads'] = data['leads'] * 2
+
+        assert removed == (df['leads'] == 0).sum()
+        assert 'log revenue' not in data.base.columns
+        assert data['log revenue'].to_numpy() == pytest.approx(np.log(df.loc[df['leads'] > 0, 'revenue']).to_numpy())
+        assert data['leads'].sum() == 2 * df['leads'].sum()
+
+        # the view is cached until the data changes
+        assert data.data is data.data
+        assert data.undo(2) == ['set log revenue', 'set leads']
+        assert data['leads'].sum() == df['leads'].sum() and 'log revenue' not in data.columns
+
+    def test_compaction_replaces_base(self):
+        experiment, df = versioned_experiment()
+        data = experiment.data
+        data.override({'vips': data['vips'] * 1.5}, name='scaled')
+        data['leads'] = data['leads'] * 1000
+
+        data.compact()
+        # the compacted columns are copies, the caller's DataFrame is left as is
+        assert data.base['leads'].dtype == np.int8 and df['leads'].dtype == np.int64 and data.base is not df
+        assert data.base['leads'].to_numpy() == pytest.approx(df['leads'].to_numpy())
+        assert data.view(1)['leads'].dtype == np.int8
+        # values that do not fit the compacted dtype keep a wider one
+        assert data['leads'].sum() == 1000 * df['leads'].sum()
+
+    def test_versions_are_applied_incrementally(self):
+        experiment, df = versioned_experiment()
+        data = experiment.data
+        data.filter(data['leads'] > 0, name='with leads')
+
+        view = data.data
+        for i in range(5):
+            data['vips'] = data['vips'] + 1
+        data.override({'revenue': data['revenue'].iloc[:10] * 0}, name='sparse')
+
+        # the data is updated, not rebuilt, and the earlier view is left as is
+        assert data.data is not view and view['vips'].sum() == pytest.approx(df.loc[df['leads'] > 0, 'vips'].sum())
+        pd.testing.assert_frame_equal(data.data, data._compose(len(data._versions))[0])
+        assert data['vips'].to_numpy() == pytest.approx(df.loc[df['leads'] > 0, 'vips'].to_numpy() + 5)
+        assert data['revenue'].iloc[:10].sum() == 0
+
+        # whole columns are stored without positions
+        assert all(data._versions[i].overrides['vips'][0] is None for i in range(1, 6))
+        assert data._versions[-1].overrides['revenue'][0].tolist() == data.positions[:10].tolist()
@@ -0,0 +1,63 @@
+import matplotlib
+import numpy as np
+import pandas as pd
+import pytest
+
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt  # noqa: E402
+
+
+class TestConditionalAggregates(object):
+    def test_matches_qcut_groupby(self, experiment, dummy_df):
+        res = experiment.visualiser.conditional_aggregates(y='revenue', x='vips', group='group', q=5)
+
+        bins = pd.qcut(dummy_df['vips'], q=5)
+        expected = dummy_df.groupby(['group', bins], observed=True)['revenue'].agg(['mean', 'count'])
+
+        assert res['revenue'].to_numpy() == pytest.approx(expected['mean'].to_numpy())
+        assert res['n'].tolist() == expected['count'].tolist()
+        assert (res['ci low'] < res['revenue']).all()
+
+    def test_bin_edges_follow_the_data(self, experiment):
+        visualiser = experiment.visualiser
+        visualiser.conditional_aggregates(y='leads', x='revenue', group='group', q=5)
+        visualiser.conditional_aggregates(y='vips', x='revenue', group='group', q=5)
+        assert len(visualiser._bin_edges) == 1
+
+        # a new version with the same number of rows, in which edges of the raw values would leave bins empty
+        experiment.data['revenue'] = np.log1p(experiment.data['revenue'])
+
+        res = visualiser.conditional_aggregates(y='leads', x='revenue', group='group', q=5)
+        assert len(res) == 10 and res['leads'].notna().all()
+        assert res['n'].sum() == len(experiment.data)
+
+        experiment.data.undo()
+        experiment.data['revenue'] = experiment.data['revenue'] ** 2
+        assert visualiser.conditional_aggregates(y='leads', x='revenue', group='group', q=5)['n'].min() > 0
+        assert len(visualiser._bin_edges) == 3
+
+
+class TestLiftOverTimePlot(object):
+    def test_plot_runs_the_analysis(self):
+        from conftest import make_timed_experiment
+
+        experiment = make_timed_experiment(n=3000)
+        _, ax = plt.subplots()
+        experiment.visualiser.plot_lift_over_time('revenue', relative=True, ax=ax)
+
+        # the lift of the single variant and the zero line
+        assert len(ax.lines) == 2
+        assert experiment.analyser.get_log('lift_over_time') is not None
+
+    def test_kind_is_validated(self):
+        from conftest import make_timed_experiment
+
+        experiment = make_timed_experiment(n=3000)
+        experiment.analyser.lift_over_time(metrics=['revenue'], freq='h')
+        _, ax = plt.subplots()
+        experiment.visualiser.plot_lift_over_time('revenue', kind='per bucket', ax=ax)
+        assert len(ax.lines) == 2
+
+        with pytest.raises(ValueError):
+            experiment.visualiser.plot_lift_over_time('revenue', kind='daily')
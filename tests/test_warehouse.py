@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from conftest import make_dummy_df, make_experiment
+from dexter.stats_func import meta_analysis
+from dexter.warehouse import ResultsWarehouse
+
+
+def stored_experiment(name, start, lift, seed):
+    df = make_dummy_df(n=4000, seed=seed)
+    df['revenue'] = df['revenue'] + lift * df['group']
+
+    experiment = make_experiment(df, name, start, success_metric=['revenue'], health_metric=['leads'])
+    experiment.assumptions.check_groups_balance()
+    experiment.analyser.compare(metrics=['revenue', 'leads'])
+
+    return experiment, df
+
+
+class TestResultsWarehouse(object):
+    def test_store_and_query(self, tmp_path):
+        path = tmp_path / 'results.db'
+        with ResultsWarehouse(path) as warehouse:
+            experiment, df = stored_experiment('exp-a', '2021-01-01', 1, seed=1)
+            warehouse.store(experiment, parameters={'alpha': .05})
+            warehouse.store(experiment)
+
+        # the results outlive the process that computed them
+        with ResultsWarehouse(path) as warehouse:
+            assert warehouse.experiments()['name'].tolist() == ['exp-a']
+            assert warehouse.parameters('treatment')['text'].tolist() == ['group']
+
+            balance = warehouse.checks('group_balance')
+            assert balance['checked'].tolist() == [1]
+
+            tests = warehouse.results(metric='revenue', analysis='t-tests')
+            logged = experiment.analyser.get_log('analyses')['revenue']['t-tests']
+            assert tests['t-stat'].iloc[0] == pytest.approx(logged['t-stat'][0])
+
+            history = warehouse.metric_history('revenue')
+            stats = df.groupby('group').revenue.agg(['mean', 'var', 'count'])
+            assert history['delta'].iloc[0] == pytest.approx(stats['mean'][1] - stats['mean'][0])
+            assert history['stderr'].iloc[0] == pytest.approx(np.sqrt((stats['var'] / stats['count']).sum()))
+
+    def test_meta_analysis(self):
+        warehouse = ResultsWarehouse()
+        for i, lift in enumerate([0, 2, 4, 8]):
+            experiment, _ = stored_experiment(f'exp-{i}', f'2021-0{i + 1}-01', lift, seed=i)
+            warehouse.store(experiment)
+
+        history = warehouse.metric_history('revenue', last=3)
+        assert history['experiment'].tolist() == ['exp-1', 'exp-2', 'exp-3']
+
+        res = warehouse.meta_analysis('revenue')
+        history = warehouse.metric_history('revenue')
+        weights = 1 / history['stderr'] ** 2
+        assert res.loc['fixed', 'estimate'] == pytest.approx(np.sum(weights * history['delta']) / weights.sum())
+        # the lifts are heterogeneous, so the random effects interval is wider
+        assert res.loc['random', 'tau2'] > 0
+        assert res.loc['random', 'stderr'] > res.loc['fixed', 'stderr']
+
+        with pytest.raises(ValueError):
+            warehouse.meta_analysis('unknown')
+
+    def test_homogeneous_effects(self):
+        fixed, random, q, q_p, tau2, i2 = meta_analysis([1., 1., 1.], [.1, .2, .3])
+        assert fixed[0] == pytest.approx(1) and tau2 == 0 and i2 == 0
+        assert random[:2] == pytest.approx(fixed[:2])
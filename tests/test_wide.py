@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scipy.stats import ttest_ind
+
+from conftest import make_experiment
+from dexter.stats_func import padjust
+
+
+def wide_experiment(n_metrics=60, n=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame(rng.normal(size=(n, n_metrics)), columns=[f'm{i}' for i in range(n_metrics)])
+    df['group'] = rng.integers(0, 3, size=n)
+    df['userid'] = np.arange(n)
+    # a true effect on the first learning metric
+    df.loc[df.group == 2, 'm2'] += .5
+
+    experiment = make_experiment(df, 'wide', success_metric=['m0'], health_metric=['m1'],
+                                 learning_metrics=[f'm{i}' for i in range(2, n_metrics)],
+                                 expected_proportions=[.3, .3, .4])
+
+    return experiment, df
+
+
+class TestWideComparison(object):
+    def test_result_matrix(self):
+        experiment, df = wide_experiment()
+        experiment.analyser.compare(wide=True, padjust={'success': 'none', 'health': 'none', 'learning': 'holm'})
+        res = experiment.analyser.get_log('analyses')['wide']
+
+        assert len(res) == 60 * 2
+        assert res.index.get_level_values('family')[:2].tolist() == ['success', 'success']
+
+        row = res.loc[('learning', 'm5', 1)]
+        a, b = df.loc[df.group == 0, 'm5'], df.loc[df.group == 1, 'm5']
+        expected = ttest_ind(a, b, equal_var=not row['welch'])
+        assert row['t-stat'] == pytest.approx(expected.statistic)
+        assert row['p-value'] == pytest.approx(expected.pvalue)
+
+        learning = res.loc['learning']
+        assert learning['p-value (adj)'].to_numpy() == pytest.approx(padjust(learning['p-value'], 'holm'))
+        assert learning.loc[('m2', 2), 'significant']
+
+    def test_default_adjustment(self, capsys):
+        experiment, _ = wide_experiment(n_metrics=10)
+        experiment.analyser.compare(wide=True)
+        res = experiment.analyser.get_log('analyses')['wide']
+
+        # fdr_bh within each family by default, and said so
+        learning = res.loc['learning']
+        assert learning['p-value (adj)'].to_numpy() == pytest.approx(padjust(learning['p-value'], 'fdr_bh'))
+        assert 'fdr_bh' in capsys.readouterr().out
+
+        experiment.analyser.compare(wide=True, padjust='none')
+        res = experiment.analyser.get_log('analyses')['wide']
+        assert res['p-value (adj)'].to_numpy() == pytest.approx(res['p-value'].to_numpy())